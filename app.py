@@ -1,27 +1,133 @@
-from flask import Flask, request, redirect, render_template, session
+from flask import Flask, Response, g, jsonify, request, redirect, render_template, stream_template, stream_with_context, session
 from spotufy import *
-import dotenv
-import requests
+import spotufy_async
 import ast
+import hmac
+import logging
+import os
+import time
 
 # Inspiration for flask skeleton: 
 # https://www.youtube.com/watch?v=dam0GPOAvVI
 # https://www.youtube.com/watch?v=oVA0fD13NGI
 # https://www.youtube.com/watch?v=MwZwr5Tvyxo
-try:
-    api_secrets = dotenv.dotenv_values('.env')
-    client_id = api_secrets["CLIENT_ID"]
-    client_secret = api_secrets["CLIENT_SECRET"]
-    secret_app_key = api_secrets["SECRET_KEY"]
-    flask_host = api_secrets["FLASK_HOST"]
-    flask_port = api_secrets["FLASK_PORT"]
-    callback_url = api_secrets["CALLBACK_URL"]
-except:
-    print(".env either does not exist or does not contain the correct values. Make sure the following variables are set:")
-    print("CLIENT_ID\nCLIENT_SECRET\nSECRET_KEY\nFLASK_HOST\nFLASK_PORT\nCALLBACK_URL")
+
+# Structured JSON logs on stderr, written from a background thread (see spotufy.configure_logging)
+configure_logging()
+log = logging.getLogger("spotufy.app")
+
+# Configuration is read once at startup, from the environment first and then the .env file
+settings = get_settings()
+missing_settings = [name.upper() for name in ("client_id", "client_secret", "secret_key", "callback_url") if not getattr(settings, name)]
+if missing_settings:
+    log.warning("Configuration is incomplete. Make sure the following variables are set in the environment or .env: %s",
+                ", ".join(missing_settings))
 
 app = Flask(__name__)
-app.secret_key = f"{secret_app_key}"
+app.secret_key = f"{settings.secret_key}"
+
+# Streamed rendering sends the page layout immediately and the result cards as the upstream
+# calls behind them complete. Set SPOTUFY_STREAM_RESPONSES=0 to render pages in one piece
+STREAM_RESPONSES = os.environ.get('SPOTUFY_STREAM_RESPONSES', '1') != '0'
+
+# Bulk API settings: at most BULK_MAX_ITEMS inputs per request, looked up BULK_CONCURRENCY at a time.
+# Lookups still running after BULK_DEADLINE seconds are reported as errors
+BULK_MAX_ITEMS = int(os.environ.get('SPOTUFY_BULK_MAX_ITEMS', 500))
+BULK_CONCURRENCY = int(os.environ.get('SPOTUFY_BULK_CONCURRENCY', 8))
+BULK_DEADLINE = float(os.environ.get('SPOTUFY_BULK_DEADLINE', 120))
+
+# When set, /metrics is only served to scrapers sending `Authorization: Bearer <SPOTUFY_METRICS_TOKEN>`
+METRICS_TOKEN = os.environ.get('SPOTUFY_METRICS_TOKEN', '')
+
+class DeferredResults:
+    # Iterable wrapping upstream lookups that only run when a template first loops over it, so a
+    # streamed page can send everything before the loop while the lookups are still in flight.
+    # A lookup that fails or finds nothing, also part way through its results, sets `failed`. Headers
+    # are already sent by then, so streamed templates show their error state after the loop; pages
+    # rendered in one piece are replaced by the 404 page (see render_results)
+    def __init__(self, lookup):
+        self.lookup = lookup
+        self.failed = False
+
+    def __iter__(self):
+        try:
+            results = self.lookup()
+        except Exception as e:
+            log.warning("Lookup for streamed page failed: %s", e)
+            results = None
+        if results is None:
+            self.failed = True
+            return iter([])
+        return self.guarded(results)
+
+    def guarded(self, results):
+        # Results of a generator are fetched while being iterated, so its errors surface here
+        try:
+            yield from results
+        except Exception as e:
+            log.warning("Lookup for streamed page failed part way: %s", e)
+            self.failed = True
+
+@app.before_request
+def track_foreground_start():
+    # Lets background work (lyrics prefetching) back off while user requests are being served
+    foreground.enter()
+
+@app.teardown_request
+def track_foreground_end(exc):
+    foreground.exit()
+
+@app.before_request
+def start_trace():
+    # Record the upstream calls made while serving this request, see spotufy.RequestTrace
+    current_trace.set(RequestTrace())
+
+@app.after_request
+def add_server_timing(response):
+    # Streamed pages only report the work done before their body starts
+    trace = current_trace.get()
+    if trace is not None:
+        response.headers["Server-Timing"] = trace.server_timing()
+        g.status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_trace(exc):
+    # Runs once the response (including a streamed body) has been sent
+    trace = current_trace.get()
+    if trace is None:
+        return
+    current_trace.set(None)
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    request_latency.observe(time.perf_counter() - trace.started, route=route, method=request.method)
+    if TRACE_LOG:
+        line = {"event": "request", "method": request.method, "route": route,
+                "status": g.get("status", 500), **trace.summary()}
+        trace_logger.info("request", extra={"fields": line})
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # Prometheus metrics of this worker process
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        return Response("Unauthorized\n", status=401, mimetype="text/plain", headers={"WWW-Authenticate": "Bearer"})
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+async def upstream(coro):
+    # Await a spotufy_async coroutine on the worker's shared event loop. Flask runs every async view
+    # in its own short-lived loop, while the pooled async client lives on the shared one
+    return await spotufy_async.runner.call(coro)
+
+def render_results(template_name, **context):
+    # Render a result page, streamed or in one piece depending on STREAM_RESPONSES
+    if not STREAM_RESPONSES:
+        page = render_template(template_name, **context)
+        if any(isinstance(value, DeferredResults) and value.failed for value in context.values()):
+            return render_template("404.html", title="404 Not Found", token=context.get("token")), 404
+        return page
+    response = Response(stream_template(template_name, **context))
+    # Tell nginx not to buffer the streamed body
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 # Routes for the default pages such as home, search, etc.
 @app.route("/")
@@ -59,53 +165,53 @@ def artist_releases():
 
 # Routes for the get functions when the user presses "Submit" on a form
 @app.route("/get_search", methods=["POST","GET"])
-def search_artist():
+async def search_artist():
     if request.method == "POST":
         name = request.form.get("search_artist")
         if name == "": 
             return render_template("404.html", title="404 Not Found", token=session.get("access_token"))
         try: 
             token = session.get("access_token")
-            print(token)
-            get_artists = search_artists(token, name)
-            print(get_artists)
+            get_artists = await upstream(spotufy_async.search_artists(token, name))
+            log.debug("Artist search for %r returned %s result(s)", name, len(get_artists or ()))
             return render_template("get_search.html", title="Search Artist", artists=get_artists, matched_artist=name,token=session.get("access_token"))
         except: 
             return render_template("404.html", title="404 Not Found", token=session.get("access_token"))
 
 @app.route("/get_top_tracks", methods=["POST","GET"])
-def get_tracks():
+async def get_tracks():
     if request.method == "POST":
         top_tracks = request.form.get("search_tracks")
         if top_tracks == "": 
             return render_template("404.html", title="404 Not Found", token=session.get("access_token"))
         try: 
             token = session.get("access_token")
-            get_tracks_query = get_top_tracks(token, top_tracks)
+            get_tracks_query = await upstream(spotufy_async.get_top_tracks(token, top_tracks))
+            prefetch_lyrics(get_tracks_query)
         except: 
             return render_template("404.html", title="404 Not Found", token=session.get("access_token"))
         return render_template("top_tracks.html", title="Search Tracks", tracks=get_tracks_query, artist_title=top_tracks,token=session.get("access_token"))
 
 @app.route("/get_track_details", methods=["POST","GET"])
-def get_track_details():
+async def get_track_details():
     if request.method == "POST":
         track_artist = request.form.get("search_details_artist")
         track_name = request.form.get("search_details_track")
         token = session.get("access_token")
-        get_tracks_details = search_song_details(token, track_name, track_artist)
-        print(get_tracks_details)
+        get_tracks_details = await upstream(spotufy_async.search_song_details(token, track_name, track_artist))
         if get_tracks_details is None:
             return render_template("404.html", title="404 Not Found", token=token)
         return render_template("get_track_details.html", title="Search Tracks", tracks=get_tracks_details, artist=track_artist, name=track_name,token=session.get("access_token"))
 
 @app.route("/get_recommendations", methods=["POST","GET"])
-def get_recommendations():
+async def get_recommendations():
     if request.method == "POST":
         try: 
             track_artist = request.form.get("recommendations_artist")
             track_name = request.form.get("recommendations_song")
             token = session.get("access_token")
-            get_track_recommendations = get_track_recs(token, track_name, track_artist)
+            get_track_recommendations = await upstream(spotufy_async.get_track_recs(token, track_name, track_artist))
+            prefetch_lyrics(get_track_recommendations)
             #play_link = create_playlist(token, f"Recommended Songs based on {track_artist}", get_track_recommendations)
             return render_template("get_recommendations.html", title="Get Recommendations", tracks=get_track_recommendations, artist=track_artist, name=track_name, token=session.get("access_token"))
         except:
@@ -115,43 +221,38 @@ def get_recommendations():
 def search_related():
     if request.method == "POST":
         name = request.form.get("search_related")
-        print(name)
         if name == "": 
             return render_template("404.html", title="404 Not Found", token=session.get("access_token"))
-        try: 
-            token = session.get("access_token")
-            get_artists = search_artists(token, name)
-            get_related_artist = get_related_artists(token, get_artists[1]["id"])
-            print(get_related_artist)
-            return render_template("get_related.html", title="Related Artists", related_artists=get_related_artist, matched_artist=name, token=session.get("access_token"))
-        except: 
-            return render_template("404.html",title="404 Not Found",token=session.get("access_token"))
+        token = session.get("access_token")
+        # The artist is resolved before the page starts, so an unknown artist still gets a 404
+        artist = resolve_artist(token, name)
+        if artist is None:
+            return render_template("404.html", title="404 Not Found", token=token), 404
+        get_related_artist = DeferredResults(lambda: get_related_artists(token, artist.id))
+        return render_results("get_related.html", title="Related Artists", related_artists=get_related_artist, matched_artist=name, token=session.get("access_token"))
         
 @app.route("/create_playlist",methods=["POST"])
-def create_playlist_post():
+async def create_playlist_post():
     get_playlist_name = request.form['playlist_name']
     playlist_name = f"Recommended Songs based on {get_playlist_name.title()}"
     tracks_query = ast.literal_eval(request.form['tracks'])
     token = session.get("access_token")
 
-    link = create_playlist(token, playlist_name, tracks_query)
+    link = await upstream(spotufy_async.create_playlist(token, playlist_name, tracks_query))
     return redirect(link)
 
 @app.route("/my_recommendations",methods=["GET"])
 def my_recommendations():
-    try: 
-        token = session.get("access_token")
-        my_recs = get_user_recs(token)
-        return render_template("my_recommendations.html", title="My Recommendations", recs=my_recs,token=token)
-    except:
-        return render_template("404.html",token=session.get("access_token"))
+    token = session.get("access_token")
+    my_recs = DeferredResults(lambda: get_user_recs(token))
+    return render_results("my_recommendations.html", title="My Recommendations", recs=my_recs,token=token)
 
 @app.route("/get_lyrics",methods=["GET","POST"])
-def get_lyrics():
+async def get_lyrics():
     if  request.method == "POST":
         artist_name = request.form.get("search_lyric_artist")
         artist_song = request.form.get("search_lyric_track")
-        get_lyrics_query = get_genius_lyrics(artist_name,artist_song)
+        get_lyrics_query = await upstream(spotufy_async.get_genius_lyrics(artist_name,artist_song))
         return render_template("get_lyrics.html", title="Lyrics", token=session.get("access_token"),
                                lyrics=get_lyrics_query, name=artist_song, artist=artist_name)
     else:
@@ -162,16 +263,145 @@ def get_artist_release():
     if request.method == "POST":
         token = session.get("access_token")
         name = request.form.get("search_artist_releases")
-        get_artists = search_artists(token,name)
-        get_discography =  get_artist_releases(token,get_artists[1])
-        return render_template("get_discography.html", title="Artist Discography", token=session.get("access_token"), name=name, discography=get_discography)
+        artist = resolve_artist(token, name) if name else None
+        if artist is None:
+            return render_template("404.html", title="404 Not Found", token=token), 404
+        # In streaming mode the discography renders as release pages arrive from the API
+        get_discography = DeferredResults(lambda: stream_artist_releases(token, artist))
+        return render_results("get_discography.html", title="Artist Discography", token=session.get("access_token"), name=name, discography=get_discography)
 
 @app.route("/get_new_releases")
-def get_new_release():
-    new_releases = get_new_album_releases(session.get("access_token"))
-    print(new_releases)
+async def get_new_release():
+    new_releases = await upstream(spotufy_async.get_new_album_releases(session.get("access_token")))
     return render_template("/new_albums.html", token=session.get("access_token"), album=new_releases)
 
+@app.route("/api/suggest")
+def suggest():
+    # Typeahead over the artists and tracks in the local search index, answered without upstream calls.
+    # Query parameters: q (the text typed so far), type (artist or track) and limit (at most 50)
+    query = request.args.get("q", "")
+    kind = request.args.get("type")
+    if kind not in (None, "artist", "track"):
+        return jsonify({"error": "type must be artist or track"}), 400
+    limit = max(min(request.args.get("limit", 10, type=int), 50), 0)
+    suggestions = []
+    for model in search_index.suggest(query, limit=limit, kind=kind):
+        suggestion = {"type": "artist" if isinstance(model, Artist) else "track", "id": model.id, "name": model.name, "uri": model.uri}
+        if isinstance(model, Track):
+            suggestion["artist"] = model.artist
+        suggestions.append(suggestion)
+    return jsonify({"query": query, "suggestions": suggestions})
+
+# Versioned JSON API for bulk lookups. Each endpoint takes a JSON object with an array of inputs and
+# streams back one NDJSON line per distinct input as its lookup finishes:
+#   {"indexes": [positions of the input in the array], "input": ..., "result": ...}
+# result is null when nothing was found; inputs that are invalid or were not looked up before the
+# deadline get an "error" instead. The access token is read from an "Authorization: Bearer" header,
+# or from the session of a logged in browser.
+def api_token():
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        return authorization[len("Bearer "):].strip()
+    return session.get("access_token")
+
+def api_error(status, message):
+    return jsonify({"error": message}), status
+
+def artist_input(item):
+    # (dedupe key, lookup arguments) of an artist name, None if invalid
+    if isinstance(item, str) and normalize_query(item):
+        return normalize_query(item), (item,)
+    return None
+
+def track_input(item):
+    # (dedupe key, lookup arguments) of a {"track": ..., "artist": ...} object, None if invalid
+    if isinstance(item, dict) and is_track_pair((item.get("track"), item.get("artist"))):
+        return track_id_cache_key(item["track"], item["artist"]), (item["track"], item["artist"])
+    return None
+
+def bulk_lookup(field, parse, lookup):
+    # Shared body of the bulk endpoints: validate the `field` array of the request, look up every
+    # distinct input with lookup(token, *arguments) on the fan-out executor and stream the results
+    token = api_token()
+    if not token:
+        return api_error(401, "An access token is required")
+    body = request.get_json(silent=True)
+    items = body.get(field) if isinstance(body, dict) else None
+    if not isinstance(items, list):
+        return api_error(400, f"The request body must be a JSON object with a '{field}' array")
+    if len(items) > BULK_MAX_ITEMS:
+        return api_error(413, f"At most {BULK_MAX_ITEMS} {field} can be looked up per request")
+
+    invalid = []
+    groups = {}
+    for index, item in enumerate(items):
+        parsed = parse(item)
+        if parsed is None:
+            invalid.append({"indexes": [index], "input": item, "error": "invalid input"})
+            continue
+        key, arguments = parsed
+        group = groups.setdefault(key, {"indexes": [], "input": item, "arguments": arguments})
+        group["indexes"].append(index)
+    groups = list(groups.values())
+    calls = [lambda arguments=group["arguments"]: lookup(token, *arguments) for group in groups]
+
+    def generate():
+        for line in invalid:
+            yield RESULT_ENCODER.encode(line) + "\n"
+        unfinished = set(range(len(groups)))
+        for index, result in fan_out_completed(calls, BULK_CONCURRENCY, BULK_DEADLINE):
+            unfinished.discard(index)
+            group = groups[index]
+            yield RESULT_ENCODER.encode({"indexes": group["indexes"], "input": group["input"], "result": result}) + "\n"
+        for index in sorted(unfinished):
+            group = groups[index]
+            yield RESULT_ENCODER.encode({"indexes": group["indexes"], "input": group["input"], "error": "deadline exceeded"}) + "\n"
+
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route("/api/v1/artists/search", methods=["POST"])
+def bulk_search_artists():
+    # {"artists": [names]} -> the artists matching each name
+    def lookup(token, name):
+        artists = search_artists(token, name)
+        return artists[1:] if artists else None
+    return bulk_lookup("artists", artist_input, lookup)
+
+@app.route("/api/v1/artists/top-tracks", methods=["POST"])
+def bulk_top_tracks():
+    # {"artists": [names]} -> the top tracks of each artist
+    return bulk_lookup("artists", artist_input, get_top_tracks)
+
+@app.route("/api/v1/tracks/details", methods=["POST"])
+def bulk_track_details():
+    # {"tracks": [{"track": name, "artist": name}]} -> the details of each track
+    return bulk_lookup("tracks", track_input, search_song_details)
+
+@app.route("/api/v1/tracks/recommendations", methods=["POST"])
+def bulk_track_recommendations():
+    # {"tracks": [{"track": name, "artist": name}]} -> the recommendations based on each track
+    return bulk_lookup("tracks", track_input, get_track_recs)
+
+@app.route("/api/v1/recommendations")
+async def api_recommendations():
+    # Recommendations for comma separated seed_tracks and seed_artists (IDs) and seed_genres, at most
+    # RECOMMENDATION_MAX_SEEDS combined, and an optional limit. tracks is null when nothing was found
+    token = api_token()
+    if not token:
+        return api_error(401, "An access token is required")
+    seeds = canonical_seeds(*([seed for seed in request.args.get(f"seed_{kind}", "").split(",") if seed.strip()]
+                              for kind in SEED_TYPES))
+    if seeds is None:
+        return api_error(400, f"Between 1 and {RECOMMENDATION_MAX_SEEDS} seed tracks, artists or genres are required")
+    limit = request.args.get("limit", RECOMMENDATION_LIMIT, type=int)
+    if not is_recommendation_limit(limit):
+        return api_error(400, f"limit must be between 1 and {RECOMMENDATION_MAX_LIMIT}")
+    tracks = await upstream(spotufy_async.get_recommendations(token, *seeds, limit=limit))
+    body = {"seeds": dict(zip(SEED_TYPES, seeds)), "limit": limit, "tracks": tracks}
+    return Response(RESULT_ENCODER.encode(body), mimetype="application/json")
+
 @app.route("/login", methods=["POST","GET"])
 def get_login_key():
     get_api_token = request_api_token()
@@ -186,15 +416,16 @@ def logout():
 @app.route("/callback", methods=["GET"])
 def callback():
     if "code" in request.args:
+        settings = get_settings()
         req_body = {
             "code" : request.args["code"],
             "grant_type" : "authorization_code",
-            "redirect_uri" : callback_url,
-            "client_id" : client_id,
-            "client_secret" : client_secret
+            "redirect_uri" : settings.callback_url,
+            "client_id" : settings.client_id,
+            "client_secret" : settings.client_secret
         }
-        TOKEN_URL = "https://accounts.spotify.com/api/token"
-        response = requests.post(TOKEN_URL,data=req_body)
+        TOKEN_URL = f"{settings.spotify_accounts_url}/api/token"
+        response = transport.request("POST", TOKEN_URL, data=req_body)
         token_info = response.json()
         session["access_token"] = token_info["access_token"]
         return redirect("/")
@@ -202,4 +433,4 @@ def callback():
         return render_template("404.html")
 
 if __name__ == '__main__':
-    app.run(host=flask_host, debug=True, port=flask_port)
\ No newline at end of file
+    app.run(host=settings.flask_host, debug=True, port=settings.flask_port)
\ No newline at end of file
@@ -0,0 +1,303 @@
+import argparse
+import collections
+import concurrent.futures
+import csv
+import json
+import os
+import sys
+import threading
+import time
+import requests
+import spotufy
+from spotufy import (RESULT_ENCODER, RequestTrace, configure_logging, create_playlist, current_trace, get_settings,
+                     get_track_recs, is_track_pair, logger, search_song_details, track_id_cache_key)
+
+# Command-line batch mode: resolves (artist, track) seeds read from a CSV or JSONL file with the
+# feature functions of spotufy.py, without going through the web app. Each seed is written to the
+# output as one JSON line holding its track details and, with --recommendations, the tracks
+# recommended from it; --playlist then collects every track of the output into a new playlist.
+#
+#   python batch.py seeds.csv --output results.jsonl --recommendations
+#   python batch.py seeds.jsonl --output results.jsonl --resume --playlist "Nightly mix"
+#
+# CSV files have an artist and a track column (by header, else the first two columns); JSONL files
+# hold {"artist": ..., "track": ...} objects. Completed seeds are appended to a checkpoint file, so an
+# interrupted run continues where it stopped with --resume. Seeds whose lookup failed (as opposed to
+# having no match) are not checkpointed and are retried by the next run.
+#
+# Catalog lookups work with an app token obtained through the client credentials flow from CLIENT_ID
+# and CLIENT_SECRET, fetched again before it expires or when the API refuses it; creating playlists
+# needs a user token passed with --token or SPOTUFY_ACCESS_TOKEN.
+
+# Seeds submitted to the worker pool ahead of the ones being written, per worker
+QUEUE_DEPTH = 4
+# Client credentials tokens are fetched again this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 60
+
+def read_seeds(path, format=None):
+    # List of (artist, track) pairs read from a CSV or JSONL file; rows without both are skipped
+    format = format or ("jsonl" if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson", ".json") else "csv")
+    seeds = []
+    with open(path, newline='', encoding='utf-8') as f:
+        if format == "jsonl":
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping line %s of %s: not valid JSON", number, path)
+                    continue
+                if isinstance(row, dict):
+                    seeds.append((row.get("artist"), row.get("track")))
+        else:
+            rows = csv.reader(f)
+            first = next(rows, [])
+            header = [column.strip().lower() for column in first]
+            if "artist" in header and "track" in header:
+                artist_column, track_column = header.index("artist"), header.index("track")
+            else:
+                # No header: the first row is a seed too
+                artist_column, track_column = 0, 1
+                if len(first) > 1:
+                    seeds.append((first[0].strip(), first[1].strip()))
+            for row in rows:
+                if len(row) > max(artist_column, track_column):
+                    seeds.append((row[artist_column].strip(), row[track_column].strip()))
+    valid = [(artist, track) for artist, track in seeds if is_track_pair((track, artist))]
+    if len(valid) < len(seeds):
+        logger.warning("Skipped %s seed(s) of %s without both an artist and a track", len(seeds) - len(valid), path)
+    return valid
+
+def seed_key(artist, track):
+    # Checkpoint key of a seed; seeds that only differ in case or punctuation share one
+    return track_id_cache_key(track, artist)
+
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+def client_credentials_token(settings=None):
+    # App access token of the client credentials flow, as an (access token, lifetime in seconds)
+    # pair: enough for catalog lookups, not for anything done on behalf of a user
+    settings = settings or get_settings()
+    if not settings.client_id or not settings.client_secret:
+        return None
+    try:
+        response = spotufy.transport.request("POST", f"{settings.spotify_accounts_url}/api/token", data={
+            "grant_type": "client_credentials",
+            "client_id": settings.client_id,
+            "client_secret": settings.client_secret,
+        })
+        response.raise_for_status()
+        token_info = response.json()
+        return token_info["access_token"], float(token_info.get("expires_in", 3600))
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logger.error("Could not obtain an access token: %s", e)
+        return None
+
+class StaticToken:
+    # Access token given on the command line, used as it is for the whole run
+    def __init__(self, token):
+        self.token = token
+
+    def get(self):
+        return self.token
+
+    def invalidate(self, token):
+        pass
+
+class ClientCredentials:
+    # Client credentials token of a run. App tokens expire after an hour, so a new one is fetched
+    # TOKEN_REFRESH_MARGIN seconds before that, or as soon as a request with the current one is refused
+    def __init__(self, settings=None, margin=TOKEN_REFRESH_MARGIN):
+        self.settings = settings
+        self.margin = margin
+        self.token = None
+        self.expires = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self.token is None or time.monotonic() >= self.expires - self.margin:
+                fetched = client_credentials_token(self.settings)
+                if fetched:
+                    self.token, lifetime = fetched
+                    self.expires = time.monotonic() + lifetime
+            return self.token
+
+    def invalidate(self, token):
+        # Called with a token the API refused; later calls to get() fetch a new one
+        with self._lock:
+            if token == self.token:
+                self.expires = 0
+
+def process_seed(tokens, artist, track, recommendations=False):
+    # Record of one seed and whether the lookups behind it completed. The upstream calls are traced,
+    # and a seed whose token was refused (401) is looked up once more with a new token
+    for attempt in range(2):
+        api_token = tokens.get()
+        trace = RequestTrace()
+        reset = current_trace.set(trace)
+        try:
+            record, complete = lookup_seed(api_token, artist, track, recommendations)
+        finally:
+            current_trace.reset(reset)
+        if complete or not any(call["status"] == 401 for call in trace.calls):
+            break
+        tokens.invalidate(api_token)
+    return record, complete
+
+def lookup_seed(api_token, artist, track, recommendations=False):
+    record = {"artist": artist, "track": track, "details": search_song_details(api_token, track, artist)}
+    if record["details"] is None:
+        # A confirmed miss is cached by the track ID lookup, a failed search is not
+        hit, _ = spotufy.cached_track_id(track, artist)
+        return record, hit
+    if recommendations:
+        record["recommendations"] = get_track_recs(api_token, track, artist)
+        if record["recommendations"] is None:
+            return record, False
+    return record, True
+
+class Progress:
+    # Periodic progress line on stderr: seeds done, throughput and estimated time left
+    def __init__(self, total, interval=5, stream=None):
+        self.total = total
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.done = 0
+        self.failed = 0
+        self.begin = time.monotonic()
+        self.last = self.begin
+
+    def update(self, failed=False):
+        self.done += 1
+        self.failed += failed
+        now = time.monotonic()
+        if self.interval and now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def rate(self):
+        elapsed = time.monotonic() - self.begin
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        rate = self.rate()
+        eta = f"{(self.total - self.done) / rate:.0f}s" if rate else "?"
+        print(f"{self.done}/{self.total} seeds  {rate:.1f} seeds/s  {self.failed} failed  ETA {eta}", file=self.stream)
+
+def run_batch(tokens, seeds, output, checkpoint=None, resume=False, recommendations=False, workers=4,
+              progress_interval=5, stream=None):
+    # Look up every seed not yet in the checkpoint with a pool of workers and append the records to
+    # output as they complete. tokens is an access token or a token source such as ClientCredentials.
+    # Returns a summary of the run
+    if isinstance(tokens, str):
+        tokens = StaticToken(tokens)
+    checkpoint = checkpoint or f"{output}.checkpoint"
+    if not resume:
+        for path in (output, checkpoint):
+            if os.path.exists(path):
+                os.remove(path)
+    completed = read_checkpoint(checkpoint)
+
+    pending = collections.OrderedDict()
+    for artist, track in seeds:
+        key = seed_key(artist, track)
+        if key not in completed:
+            pending.setdefault(key, (artist, track))
+    skipped = len({seed_key(artist, track) for artist, track in seeds}) - len(pending)
+    progress = Progress(len(pending), progress_interval, stream)
+
+    with open(output, "a", encoding='utf-8') as out, open(checkpoint, "a", encoding='utf-8') as done, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as pool:
+        queue = iter(pending.items())
+        running = {}
+
+        def submit():
+            for key, (artist, track) in queue:
+                running[pool.submit(process_seed, tokens, artist, track, recommendations)] = key
+                if len(running) >= workers * QUEUE_DEPTH:
+                    return
+
+        submit()
+        while running:
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                key = running.pop(future)
+                try:
+                    record, complete = future.result()
+                except Exception as e:
+                    logger.error("Seed %s failed: %s", key, e)
+                    record, complete = None, False
+                # The record is written before its checkpoint entry, so a crash in between repeats the
+                # seed on resume rather than losing it
+                if complete:
+                    out.write(RESULT_ENCODER.encode(record) + "\n")
+                    out.flush()
+                    done.write(key + "\n")
+                    done.flush()
+                progress.update(failed=not complete)
+            submit()
+
+    progress.report()
+    return {"seeds": len(pending), "skipped": skipped, "completed": progress.done - progress.failed,
+            "failed": progress.failed, "seeds_per_second": round(progress.rate(), 2)}
+
+def playlist_uris(output):
+    # URIs of the tracks in an output file, in order and without repeats
+    uris = []
+    with open(output, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            tracks = [record.get("details")] + (record.get("recommendations") or [])
+            uris.extend(track["uri"] for track in tracks if track and track.get("uri"))
+    return list(dict.fromkeys(uris))
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve (artist, track) seeds in bulk and optionally build a playlist")
+    parser.add_argument("seeds", help="CSV or JSONL file of artist and track seeds")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="input format (default: from the file extension)")
+    parser.add_argument("--output", default="batch-results.jsonl")
+    parser.add_argument("--checkpoint", help="file of completed seeds (default: <output>.checkpoint)")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted run instead of starting over")
+    parser.add_argument("--recommendations", action="store_true", help="also fetch the tracks recommended from each seed")
+    parser.add_argument("--playlist", help="create a playlist of this name from every track in the output")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--progress-interval", type=float, default=5, help="seconds between progress lines")
+    parser.add_argument("--token", default=os.environ.get("SPOTUFY_ACCESS_TOKEN"),
+                        help="Spotify access token (default: SPOTUFY_ACCESS_TOKEN, else the client credentials flow)")
+    args = parser.parse_args()
+
+    configure_logging()
+    if args.playlist and not args.token:
+        parser.error("creating a playlist needs a user access token (--token or SPOTUFY_ACCESS_TOKEN)")
+    tokens = StaticToken(args.token) if args.token else ClientCredentials()
+    if not tokens.get():
+        parser.error("no access token: pass --token or set CLIENT_ID and CLIENT_SECRET")
+
+    seeds = read_seeds(args.seeds, args.format)
+    summary = run_batch(tokens, seeds, args.output, args.checkpoint, args.resume, args.recommendations,
+                        args.workers, args.progress_interval)
+    print(f"{summary['completed']} seeds completed, {summary['failed']} failed, {summary['skipped']} already done "
+          f"({summary['seeds_per_second']} seeds/s). Results written to {args.output}")
+
+    if args.playlist:
+        if summary["failed"]:
+            print("Not creating the playlist while seeds are failing; run again with --resume")
+            sys.exit(1)
+        url = create_playlist(args.token, args.playlist, playlist_uris(args.output))
+        if not url:
+            print("Could not create the playlist")
+            sys.exit(1)
+        print(f"Playlist created: {url}")
+    elif summary["failed"]:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+import argparse
+import concurrent.futures
+import datetime
+import json
+import logging
+import math
+import os
+import subprocess
+import threading
+import time
+import requests
+from fake_upstream import FakeUpstreamServer
+
+# Load-test harness driving the app.py routes at a target request rate and reporting latency
+# percentiles, throughput and upstream calls per page for each route. Results are written as JSON
+# so runs can be diffed to spot regressions.
+#
+# By default the fake upstream server and the app are both started in-process:
+#   python benchmark.py --rate 20 --duration 10 --output benchmark-results.json
+# An already running app (e.g. the Docker image configured against `python fake_upstream.py`) can be
+# measured with --target; pass --upstream as well to count upstream calls:
+#   python benchmark.py --target http://127.0.0.1:8080 --upstream http://127.0.0.1:8099
+
+# Requests made for each route: (method, path, body). The body is sent as form data, except for the
+# JSON API routes under /api/ which get it as a JSON document
+TRACKS_FORM = repr([f"spotify:track:{i:022d}" for i in range(5)])
+# Inputs of the bulk API routes: enough distinct items for the lookups to fan out
+BULK_ARTISTS = ["Al Green", "Aretha Franklin", "Otis Redding", "Sam Cooke", "Marvin Gaye", "Bill Withers",
+                "Curtis Mayfield", "Etta James", "Wilson Pickett", "Ann Peebles"]
+BULK_TRACKS = [{"artist": "Al Green", "track": track} for track in (
+    "Let's Stay Together", "Tired of Being Alone", "Love and Happiness", "Take Me to the River",
+    "I'm Still in Love with You")]
+SEED_TRACKS = "Y8iH1wOLaQan8ePsqMgLj2,AOivg3QxvEXHJX6nsBvBqJ"
+ROUTES = {
+    "home": ("GET", "/", None),
+    "get_search": ("POST", "/get_search", {"search_artist": "Al Green"}),
+    "get_top_tracks": ("POST", "/get_top_tracks", {"search_tracks": "Al Green"}),
+    "get_track_details": ("POST", "/get_track_details", {"search_details_artist": "Al Green", "search_details_track": "Let's Stay Together"}),
+    "get_recommendations": ("POST", "/get_recommendations", {"recommendations_artist": "Al Green", "recommendations_song": "Let's Stay Together"}),
+    "get_related": ("POST", "/get_related", {"search_related": "Al Green"}),
+    "my_recommendations": ("GET", "/my_recommendations", None),
+    "get_lyrics": ("POST", "/get_lyrics", {"search_lyric_artist": "Al Green", "search_lyric_track": "Let's Stay Together"}),
+    "get_artist_releases": ("POST", "/get_artist_releases", {"search_artist_releases": "Al Green"}),
+    "get_new_releases": ("GET", "/get_new_releases", None),
+    "create_playlist": ("POST", "/create_playlist", {"playlist_name": "Al Green", "tracks": TRACKS_FORM}),
+    "api_bulk_artists_search": ("POST", "/api/v1/artists/search", {"artists": BULK_ARTISTS}),
+    "api_bulk_top_tracks": ("POST", "/api/v1/artists/top-tracks", {"artists": BULK_ARTISTS}),
+    "api_bulk_track_details": ("POST", "/api/v1/tracks/details", {"tracks": BULK_TRACKS}),
+    "api_bulk_track_recommendations": ("POST", "/api/v1/tracks/recommendations", {"tracks": BULK_TRACKS}),
+    "api_recommendations": ("GET", f"/api/v1/recommendations?seed_tracks={SEED_TRACKS}&seed_genres=soul&limit=5", None),
+    # Last, so the searches of the routes above have filled the suggestion index
+    "api_suggest": ("GET", "/api/suggest?q=al&limit=10", None),
+}
+
+def percentile(values, p):
+    # Nearest-rank percentile of a list of numbers, None for an empty list
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(math.ceil(p / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+def summarize(latencies, errors, elapsed, upstream_calls=None):
+    # Summary of one route's run; latencies in seconds
+    pages = len(latencies)
+    latency_ms = {name: round(value * 1000, 2) if value is not None else None for name, value in (
+        ("p50", percentile(latencies, 50)),
+        ("p95", percentile(latencies, 95)),
+        ("p99", percentile(latencies, 99)),
+        ("max", max(latencies) if latencies else None),
+        ("mean", sum(latencies) / pages if pages else None),
+    )}
+    return {
+        "requests": pages,
+        "errors": errors,
+        "throughput_rps": round(pages / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": latency_ms,
+        "upstream_calls_per_page": round(upstream_calls / pages, 2) if upstream_calls is not None and pages else None,
+    }
+
+def start_local_app(upstream_url, client_rate_limit=None):
+    # Start app.py in-process against the fake upstream server, return (server, base URL).
+    # Settings are read when spotufy is imported, so the environment is prepared first.
+    os.environ.update({
+        "SPOTIFY_API_URL": f"{upstream_url}/v1",
+        "SPOTIFY_ACCOUNTS_URL": upstream_url,
+        "GENIUS_URL": f"{upstream_url}/",
+    })
+    for name, value in (("CLIENT_ID", "benchmark"), ("CLIENT_SECRET", "benchmark"), ("SECRET_KEY", "benchmark"),
+                        ("CALLBACK_URL", "http://127.0.0.1/callback"), ("GENIUS_TOKEN", "benchmark")):
+        os.environ.setdefault(name, value)
+    if client_rate_limit is not None:
+        os.environ["SPOTUFY_RATE_LIMIT"] = str(client_rate_limit)
+    import werkzeug.serving
+    from app import app
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = werkzeug.serving.make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='benchmark-app', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def login(target):
+    # The callback route exchanges a code for a token at the (fake) accounts service and stores it
+    # in the session cookie
+    session = requests.Session()
+    session.get(f"{target}/callback", params={"code": "benchmark"}, allow_redirects=False, timeout=30)
+    return session.cookies
+
+class Client(threading.local):
+    # One HTTP session per load-generating thread, all sharing the same login
+    def __init__(self, cookies):
+        self.session = requests.Session()
+        self.session.cookies.update(cookies)
+
+def upstream_stats(upstream, reset=False):
+    if not upstream:
+        return None
+    if reset:
+        return requests.post(f"{upstream}/_reset", timeout=5).json()
+    return requests.get(f"{upstream}/_stats", timeout=5).json()
+
+def run_route(target, upstream, name, rate, duration, concurrency, client):
+    # Send rate requests per second to one route for duration seconds. Requests are scheduled at
+    # fixed times and latency is measured from the scheduled time, so a slow server also shows the
+    # queueing delay it causes instead of silently lowering the request rate
+    method, path, body = ROUTES[name]
+    body = {"json": body} if path.startswith("/api/") else {"data": body}
+    count = max(int(rate * duration), 1)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def send(scheduled):
+        nonlocal errors
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            response = client.session.request(method, f"{target}{path}", **body, allow_redirects=False, timeout=60)
+            response.content
+            failed = response.status_code >= 400
+        except requests.exceptions.RequestException:
+            failed = True
+        finished = time.perf_counter()
+        with lock:
+            if failed:
+                errors += 1
+            else:
+                latencies.append(finished - scheduled)
+
+    upstream_stats(upstream, reset=True)
+    begin = time.perf_counter() + 0.05
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(send, begin + i / rate) for i in range(count)]:
+            future.result()
+    elapsed = time.perf_counter() - begin
+    stats = upstream_stats(upstream)
+    result = summarize(latencies, errors, elapsed, stats["requests"] if stats else None)
+    if stats:
+        result["upstream_throttled"] = stats["throttled"]
+        result["upstream_errors"] = stats["error"]
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the spotufy routes against a fake upstream")
+    parser.add_argument("--rate", type=float, default=10, help="requests per second per route")
+    parser.add_argument("--duration", type=float, default=5, help="seconds to drive each route")
+    parser.add_argument("--concurrency", type=int, default=32, help="maximum requests in flight")
+    parser.add_argument("--routes", default="all", help="comma separated route names (default: all)")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--target", help="base URL of a running app (default: start one in-process)")
+    parser.add_argument("--upstream", help="base URL of a running fake_upstream.py server")
+    parser.add_argument("--latency", type=float, default=0.05, help="upstream latency of the in-process fake server")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--client-rate-limit", type=float, default=None,
+                        help="override SPOTUFY_RATE_LIMIT of the in-process app (0 disables it)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    routes = list(ROUTES) if args.routes == "all" else args.routes.split(",")
+    unknown = [name for name in routes if name not in ROUTES]
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(unknown)}")
+
+    fake = app_server = None
+    upstream, target = args.upstream, args.target
+    if not upstream and not target:
+        fake = FakeUpstreamServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                  throttle_rate=args.throttle_rate, retry_after=0, seed=args.seed).start()
+        upstream = fake.url
+    if not target:
+        app_server, target = start_local_app(upstream, args.client_rate_limit)
+
+    started_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    client = Client(login(target))
+    results = {}
+    try:
+        for name in routes:
+            results[name] = run_route(target, upstream, name, args.rate, args.duration, args.concurrency, client)
+            summary = results[name]
+            print(f"{name:22} p50 {summary['latency_ms']['p50']}ms  p95 {summary['latency_ms']['p95']}ms  "
+                  f"p99 {summary['latency_ms']['p99']}ms  {summary['throughput_rps']} req/s  "
+                  f"{summary['upstream_calls_per_page']} upstream calls/page  {summary['errors']} errors")
+    finally:
+        if app_server is not None:
+            app_server.shutdown()
+        if fake is not None:
+            fake.stop()
+
+    report = {
+        "started_at": started_at,
+        "git_commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "routes": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
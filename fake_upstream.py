@@ -0,0 +1,250 @@
+import argparse
+import http.server
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+# Local stand-in for the Spotify Web API, the Spotify accounts service and Genius, replaying the
+# recorded responses in fixtures/. Latency, 5xx errors and 429 responses can be injected to see how
+# the app behaves against a slow or unhealthy upstream. Point the app at it through its settings:
+#   SPOTIFY_API_URL=http://127.0.0.1:8099/v1
+#   SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:8099
+#   GENIUS_URL=http://127.0.0.1:8099/
+# GET /_stats returns the number of requests served per route, POST /_reset clears the counters.
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Routes served by the stand-in server: (method, path pattern, route name). The route name is also
+# the fixture file (fixtures/<name>.json) replayed for it, except for the special cases in
+# FakeUpstreamHandler.respond()
+ROUTES = [
+    ("POST", r"^/api/token$", "spotify_token"),
+    ("GET", r"^/v1/search$", "spotify_search"),
+    ("GET", r"^/v1/artists/[^/]+/top-tracks$", "spotify_top_tracks"),
+    ("GET", r"^/v1/artists/[^/]+/related-artists$", "spotify_related_artists"),
+    ("GET", r"^/v1/artists/[^/]+/albums$", "spotify_artist_albums"),
+    ("GET", r"^/v1/artists$", "spotify_artists"),
+    ("GET", r"^/v1/tracks/[^/]+$", "spotify_track"),
+    ("GET", r"^/v1/recommendations$", "spotify_recommendations"),
+    ("GET", r"^/v1/me$", "spotify_me"),
+    ("GET", r"^/v1/me/top/tracks$", "spotify_me_top_tracks"),
+    ("GET", r"^/v1/browse/new-releases$", "spotify_new_releases"),
+    ("POST", r"^/v1/users/[^/]+/playlists$", "spotify_create_playlist"),
+    ("POST", r"^/v1/playlists/[^/]+/tracks$", "spotify_add_tracks"),
+    ("GET", r"^/api/search/multi$", "genius_search_multi"),
+    ("GET", r"^/[^/]+-lyrics$", "genius_lyrics"),
+]
+
+def load_fixtures(directory=FIXTURES_DIR):
+    # Read every fixture once; JSON fixtures are kept decoded, HTML pages as bytes
+    fixtures = {}
+    for name in os.listdir(directory):
+        base, extension = os.path.splitext(name)
+        with open(os.path.join(directory, name), 'rb') as f:
+            fixtures[base] = json.loads(f.read()) if extension == '.json' else f.read()
+    return fixtures
+
+def without_markets(value):
+    # Copy of a decoded fixture without its available_markets lists
+    if isinstance(value, dict):
+        return {key: without_markets(item) for key, item in value.items() if key != "available_markets"}
+    if isinstance(value, list):
+        return [without_markets(item) for item in value]
+    return value
+
+class FakeUpstreamHandler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive connections, like the real APIs, so connection pooling behaves the same
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def handle_request(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        server = self.server
+
+        if url.path == "/_stats":
+            return self.send_json(200, server.stats())
+        if url.path == "/_reset":
+            server.reset()
+            return self.send_json(200, server.stats())
+
+        route = server.match(method, url.path)
+        if route is None:
+            server.count("not_found")
+            return self.send_json(404, {"error": {"status": 404, "message": "Service not found"}})
+        server.count(route)
+
+        fault = server.pick_fault()
+        if server.latency or server.jitter:
+            time.sleep(server.latency + server.random.uniform(0, server.jitter))
+        if fault == "throttled":
+            return self.send_json(429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                                  {"Retry-After": str(server.retry_after)})
+        if fault == "error":
+            return self.send_json(503, {"error": {"status": 503, "message": "Service unavailable"}})
+        self.respond(route, url, query)
+
+    def respond(self, route, url, query):
+        fixtures = self.server.fixtures
+        if route == "genius_lyrics":
+            return self.send_body(200, fixtures[route], "text/html; charset=utf-8")
+        status = 201 if route in ("spotify_create_playlist", "spotify_add_tracks") else 200
+        body = fixtures.get(route)
+        if route == "spotify_search":
+            body = fixtures["spotify_search_track" if query.get("type") == "track" else "spotify_search_artist"]
+        elif route == "spotify_artists":
+            # Batch lookups are answered from the artists of the related-artists recording
+            known = {a["id"]: a for a in fixtures["spotify_related_artists"]["artists"]}
+            ids = query.get("ids", "").split(",")
+            body = {"artists": [known.get(i) for i in ids]}
+        elif route == "spotify_track":
+            # Tracks are answered from the full track objects of the search and top-tracks recordings
+            known = {t["id"]: t for t in fixtures["spotify_search_track"]["tracks"]["items"] + fixtures["spotify_top_tracks"]["tracks"]}
+            body = known.get(url.path.rsplit("/", 1)[-1])
+            if body is None:
+                return self.send_json(404, {"error": {"status": 404, "message": "Non existing id"}})
+        elif route == "spotify_artist_albums":
+            # The recording holds the whole discography; page through it like the real endpoint
+            items = fixtures["spotify_artist_albums"]["items"]
+            offset = int(query.get("offset", 0))
+            limit = int(query.get("limit", 20))
+            base = f"http://{self.headers.get('Host')}{url.path}"
+            next_url = f"{base}?offset={offset + limit}&limit={limit}" if offset + limit < len(items) else None
+            if next_url and "market" in query:
+                next_url += f"&market={query['market']}"
+            body = {
+                "href": f"{base}?offset={offset}&limit={limit}",
+                "items": items[offset:offset + limit],
+                "limit": limit,
+                "next": next_url,
+                "offset": offset,
+                "previous": None,
+                "total": len(items),
+            }
+        if "market" in query:
+            # Like Spotify, objects fetched for a market leave out their available_markets
+            body = without_markets(body)
+        return self.send_json(status, body)
+
+    def send_json(self, status, body, headers=None):
+        self.send_body(status, json.dumps(body).encode(), "application/json; charset=utf-8", headers)
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class FakeUpstreamServer(http.server.ThreadingHTTPServer):
+    # Threaded stand-in server. latency (seconds, plus up to jitter more) is added to every response;
+    # error_rate and throttle_rate are the fractions of requests answered with 503 and with 429
+    # (Retry-After: retry_after seconds) instead of their recording
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, jitter=0.0, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=1, seed=None, fixtures_dir=FIXTURES_DIR):
+        super().__init__(address, FakeUpstreamHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.fixtures = load_fixtures(fixtures_dir)
+        self.routes = [(method, re.compile(pattern), name) for method, pattern, name in ROUTES]
+        self.counts = {}
+        self.faults = {"throttled": 0, "error": 0}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def match(self, method, path):
+        for route_method, pattern, name in self.routes:
+            if route_method == method and pattern.match(path):
+                return name
+        return None
+
+    def pick_fault(self):
+        with self._lock:
+            roll = self.random.random()
+            if roll < self.throttle_rate:
+                fault = "throttled"
+            elif roll < self.throttle_rate + self.error_rate:
+                fault = "error"
+            else:
+                return None
+            self.faults[fault] += 1
+            return fault
+
+    def count(self, route):
+        with self._lock:
+            self.counts[route] = self.counts.get(route, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {"requests": sum(self.counts.values()), "routes": dict(self.counts), **self.faults}
+
+    def reset(self):
+        with self._lock:
+            self.counts = {}
+            self.faults = {"throttled": 0, "error": 0}
+
+    def start(self):
+        # Serve from a daemon thread and return the server
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,), name='fake-upstream', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Spotify and Genius APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds of 429 responses")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeUpstreamServer((args.host, args.port), latency=args.latency, jitter=args.jitter,
+                                error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                                retry_after=args.retry_after, seed=args.seed)
+    print(f"Serving fake Spotify/Genius APIs on {server.url}")
+    print(f"SPOTIFY_API_URL={server.url}/v1")
+    print(f"SPOTIFY_ACCOUNTS_URL={server.url}")
+    print(f"GENIUS_URL={server.url}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
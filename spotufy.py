@@ -3,11 +3,181 @@ import dotenv
 import urllib.parse
 import re
 import json
+import os
+import atexit
+import threading
+import time
+import concurrent.futures
+import functools
+import random
+import hashlib
+import dataclasses
+import zlib
+import bisect
+import queue
+import collections
+import socket
+import sqlite3
+import sys
+import copy
+import logging
+import logging.handlers
+import contextvars
+import inspect
+import datetime
 import lyricsgenius
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from requests.adapters import HTTPAdapter
 from flask import redirect
 
-# Base API URL used for all API requests
+# Default base URLs of the upstream services; each can be overridden through Settings, e.g. to
+# point the app at the local stand-in server of fake_upstream.py
 APIURL = 'https://api.spotify.com/v1'
+ACCOUNTS_URL = 'https://accounts.spotify.com'
+GENIUS_URL = 'https://genius.com/'
+
+# Connection pool and timeout settings for the shared HTTP transport
+# POOL_CONNECTIONS is the number of hosts to keep pools for, POOL_MAXSIZE the number of
+# keep-alive sockets kept per host (should be >= the number of threads per worker)
+POOL_CONNECTIONS = int(os.environ.get('SPOTUFY_POOL_CONNECTIONS', 4))
+POOL_MAXSIZE = int(os.environ.get('SPOTUFY_POOL_MAXSIZE', 16))
+CONNECT_TIMEOUT = float(os.environ.get('SPOTUFY_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('SPOTUFY_READ_TIMEOUT', 10))
+
+# Upstream resilience settings. Requests are limited client-side to RATE_LIMIT_PER_SECOND
+# (bursts of RATE_LIMIT_BURST; 0 disables the limiter) and retried up to MAX_RETRIES times.
+# 429 responses are retried after their Retry-After delay unless it exceeds MAX_RETRY_AFTER seconds.
+# After BREAKER_THRESHOLD consecutive failures a host is skipped for BREAKER_RESET_TIMEOUT seconds
+RATE_LIMIT_PER_SECOND = float(os.environ.get('SPOTUFY_RATE_LIMIT', 10))
+RATE_LIMIT_BURST = float(os.environ.get('SPOTUFY_RATE_LIMIT_BURST', 20))
+MAX_RETRIES = int(os.environ.get('SPOTUFY_MAX_RETRIES', 3))
+MAX_RETRY_AFTER = float(os.environ.get('SPOTUFY_MAX_RETRY_AFTER', 10))
+BACKOFF_BASE = float(os.environ.get('SPOTUFY_BACKOFF_BASE', 0.25))
+BACKOFF_CAP = float(os.environ.get('SPOTUFY_BACKOFF_CAP', 4))
+BREAKER_THRESHOLD = int(os.environ.get('SPOTUFY_BREAKER_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = float(os.environ.get('SPOTUFY_BREAKER_RESET_TIMEOUT', 30))
+
+# Fan-out settings for running independent upstream calls concurrently
+# FANOUT_WORKERS sizes the per-worker thread pool, FANOUT_CONCURRENCY caps how many calls a single
+# request may have in flight at once and FANOUT_DEADLINE (seconds) bounds how long a request waits
+FANOUT_WORKERS = int(os.environ.get('SPOTUFY_FANOUT_WORKERS', 16))
+FANOUT_CONCURRENCY = int(os.environ.get('SPOTUFY_FANOUT_CONCURRENCY', 4))
+FANOUT_DEADLINE = float(os.environ.get('SPOTUFY_FANOUT_DEADLINE', 15))
+
+# Market used for catalog lookups; part of every catalog cache key. Track and album objects fetched
+# with a market omit their available_markets list, often the largest part of a catalog payload
+DEFAULT_MARKET = 'US'
+
+# Response cache settings for public catalog lookups. CACHE_URL selects the backend (see
+# create_cache_backend). Entries are evicted least-recently-used once either limit is reached;
+# CACHE_TTLS sets how long (seconds) results of each endpoint stay fresh
+CACHE_URL = os.environ.get('SPOTUFY_CACHE_URL', 'memory://')
+CACHE_MAX_ENTRIES = int(os.environ.get('SPOTUFY_CACHE_MAX_ENTRIES', 2048))
+CACHE_MAX_BYTES = int(os.environ.get('SPOTUFY_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# The SQLite backend records the access time of a hit at most once per this many seconds, so most
+# hits are plain reads that do not compete for the database's single writer lock
+SQLITE_TOUCH_INTERVAL = 60
+CACHE_TTLS = {
+    "search_artists": 60 * 60,
+    "get_top_tracks": 60 * 60,
+    "get_artist_releases": 6 * 60 * 60,
+    "get_related_artists": 24 * 60 * 60,
+    "get_new_album_releases": 15 * 60,
+    "get_recommendations": 6 * 60 * 60,
+    "get_track": 24 * 60 * 60,
+}
+# Version of the cached result format, part of every catalog cache key so that shared caches
+# written by an older release are not read back in the wrong shape
+CACHE_SCHEMA = 2
+
+# Lyrics cache settings. Found lyrics are kept for LYRICS_TTL seconds, songs without lyrics on
+# Genius for LYRICS_MISS_TTL. GENIUS_SLEEP_TIME is the pause lyricsgenius makes after every request
+LYRICS_CACHE_URL = os.environ.get('SPOTUFY_LYRICS_CACHE_URL', 'memory://?max_entries=512')
+LYRICS_TTL = 30 * 24 * 60 * 60
+LYRICS_MISS_TTL = 60 * 60
+GENIUS_TIMEOUT = float(os.environ.get('SPOTUFY_GENIUS_TIMEOUT', 5))
+GENIUS_SLEEP_TIME = float(os.environ.get('SPOTUFY_GENIUS_SLEEP_TIME', 0))
+
+# Track ID resolution cache settings. Track IDs found by a (track, artist) search are kept for
+# TRACK_ID_TTL seconds, pairs without a match on Spotify for TRACK_ID_MISS_TTL
+TRACK_ID_CACHE_URL = os.environ.get('SPOTUFY_TRACK_ID_CACHE_URL', 'memory://?max_entries=8192')
+TRACK_ID_TTL = 30 * 24 * 60 * 60
+TRACK_ID_MISS_TTL = 60 * 60
+
+# Lyrics prefetch settings. When enabled, lyrics of tracks shown on top-tracks and recommendation
+# pages are fetched in the background by PREFETCH_WORKERS threads. At most PREFETCH_QUEUE_SIZE tracks
+# wait in the queue, and nothing is prefetched while more than PREFETCH_MAX_FOREGROUND foreground
+# requests are being served by the worker
+LYRICS_PREFETCH = os.environ.get('SPOTUFY_LYRICS_PREFETCH', '0') == '1'
+PREFETCH_WORKERS = int(os.environ.get('SPOTUFY_PREFETCH_WORKERS', 1))
+PREFETCH_QUEUE_SIZE = int(os.environ.get('SPOTUFY_PREFETCH_QUEUE_SIZE', 50))
+PREFETCH_MAX_FOREGROUND = int(os.environ.get('SPOTUFY_PREFETCH_MAX_FOREGROUND', 2))
+
+# Local search index settings. Artists and tracks seen in Spotify results are indexed by name, up to
+# SEARCH_INDEX_MAX_ENTRIES entries. With SEARCH_INDEX_PATH set, the index is loaded from that file at
+# startup and written back every SEARCH_INDEX_SAVE_INTERVAL seconds and at exit
+SEARCH_INDEX_PATH = os.environ.get('SPOTUFY_SEARCH_INDEX_PATH', '')
+SEARCH_INDEX_MAX_ENTRIES = int(os.environ.get('SPOTUFY_SEARCH_INDEX_MAX_ENTRIES', 100000))
+SEARCH_INDEX_SAVE_INTERVAL = float(os.environ.get('SPOTUFY_SEARCH_INDEX_SAVE_INTERVAL', 300))
+# Maximum number of index words scanned for one typeahead prefix
+SUGGEST_MAX_SCAN = 2000
+
+# Access tokens are valid for an hour, so the user ID behind a token is cached for as long
+USER_ID_TTL = 60 * 60
+USER_ID_CACHE_MAX_ENTRIES = int(os.environ.get('SPOTUFY_USER_ID_CACHE_MAX_ENTRIES', 4096))
+
+# Per-user recommendations cache settings (see get_user_recs). A user's top tracks and the
+# recommendations based on them are kept by user ID for USER_RECS_TTL seconds. Once older than
+# USER_RECS_REFRESH_AFTER they are still served, while USER_RECS_REFRESH_WORKERS background threads
+# fetch replacements; at most USER_RECS_REFRESH_QUEUE_SIZE refreshes wait in the queue
+USER_RECS_CACHE_URL = os.environ.get('SPOTUFY_USER_RECS_CACHE_URL', 'memory://?max_entries=4096')
+USER_RECS_REFRESH_AFTER = float(os.environ.get('SPOTUFY_USER_RECS_REFRESH_AFTER', 60 * 60))
+USER_RECS_TTL = 7 * 24 * 60 * 60
+USER_RECS_REFRESH_WORKERS = int(os.environ.get('SPOTUFY_USER_RECS_REFRESH_WORKERS', 1))
+USER_RECS_REFRESH_QUEUE_SIZE = 100
+
+# Logging settings, see configure_logging(). LOG_LEVEL is the minimum level written; records below
+# WARNING are kept with probability LOG_SAMPLE_RATE. Records are handed to a background thread
+# through a queue of LOG_QUEUE_SIZE entries and dropped (and counted) while it is full
+LOG_LEVEL = os.environ.get('SPOTUFY_LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.environ.get('SPOTUFY_LOG_SAMPLE_RATE', 1))
+LOG_QUEUE_SIZE = int(os.environ.get('SPOTUFY_LOG_QUEUE_SIZE', 10000))
+
+# Tracing and metrics settings. The upstream calls made for each Flask request are recorded in a
+# RequestTrace; with TRACE_LOG a JSON summary line is printed per request. At most
+# SERVER_TIMING_MAX_CALLS upstream calls are listed in the Server-Timing header. LATENCY_BUCKETS are
+# the upper bounds (seconds) of the latency histograms exposed on /metrics
+TRACE_LOG = os.environ.get('SPOTUFY_TRACE_LOG', '1') != '0'
+SERVER_TIMING_MAX_CALLS = 20
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Maximum number of track URIs accepted per "add items to playlist" request
+PLAYLIST_CHUNK_SIZE = 100
+
+# Paging settings: page size of /artists/{id}/albums (50 is the maximum Spotify allows) and the
+# maximum number of pages followed for a single listing
+RELEASES_PAGE_SIZE = 50
+MAX_PAGES = int(os.environ.get('SPOTUFY_MAX_PAGES', 40))
+# Streamed discographies are collected for the cache only up to this many releases, so streaming
+# holds at most this many releases in memory rather than the whole discography
+STREAM_CACHE_MAX_RELEASES = int(os.environ.get('SPOTUFY_STREAM_CACHE_MAX_RELEASES', 4 * RELEASES_PAGE_SIZE))
+
+# Maximum number of IDs accepted by the /artists?ids= batch endpoint
+ARTIST_BATCH_SIZE = 50
+# Fields of a full artist object required to build an artist result
+ARTIST_FIELDS = ("name", "external_urls", "followers", "popularity", "genres", "id", "uri", "images")
+# Fields of a full track object required to build a track details result
+TRACK_FIELDS = ("id", "name", "album", "duration_ms", "external_urls")
+
+# Recommendation settings: tracks returned by default and at most per request, and the maximum
+# number of seeds (tracks, artists and genres combined) the /recommendations endpoint accepts
+RECOMMENDATION_LIMIT = 5
+RECOMMENDATION_MAX_LIMIT = 100
+RECOMMENDATION_MAX_SEEDS = 5
+SEED_TYPES = ("tracks", "artists", "genres")
 
 
 ################ Core Functions ################
@@ -16,36 +186,876 @@ APIURL = 'https://api.spotify.com/v1'
 # the features.                                #
 ################################################
 
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    # Application configuration. Built once by load_settings() rather than read from disk per call;
+    # each field is read from the environment variable of the same name in upper case
+    # Secrets are left out of repr() so settings can be logged safely
+    client_id: str = ""
+    client_secret: str = dataclasses.field(default="", repr=False)
+    secret_key: str = dataclasses.field(default="", repr=False)
+    flask_host: str = "0.0.0.0"
+    flask_port: int = 9191
+    callback_url: str = ""
+    genius_token: str = dataclasses.field(default="", repr=False)
+    spotify_api_url: str = APIURL
+    spotify_accounts_url: str = ACCOUNTS_URL
+    genius_url: str = GENIUS_URL
+
+def load_settings(env_file='.env'):
+    # Environment variables (as provided by docker-compose) take precedence over the .env file
+    file_values = dotenv.dotenv_values(env_file) if os.path.exists(env_file) else {}
+    values = {}
+    for field in dataclasses.fields(Settings):
+        value = os.environ.get(field.name.upper()) or file_values.get(field.name.upper())
+        if value:
+            values[field.name] = field.type(value)
+    return Settings(**values)
+
+def get_settings():
+    return settings
+
+def reload_settings(env_file='.env'):
+    # Re-read the configuration, e.g. after rotating credentials. Feature functions pick up the
+    # new settings on their next call without any per-request file reads
+    global settings
+    settings = load_settings(env_file)
+    return settings
+
+# Settings of this worker, loaded at import time
+settings = load_settings()
+
+# Loggers of the client functions and of the per-request trace lines
+logger = logging.getLogger("spotufy")
+trace_logger = logging.getLogger("spotufy.trace")
+
+# Credentials must never reach the logs: bearer tokens and Spotify access/refresh tokens in messages
+# are masked, as are log fields with one of the REDACT_FIELDS names
+REDACT_PATTERNS = (re.compile(r"(Bearer\s+)[A-Za-z0-9._~+/=-]+"), re.compile(r"()\b(?:BQ|AQ)[A-Za-z0-9_-]{30,}"))
+REDACT_FIELDS = {"token", "access_token", "refresh_token", "api_token", "authorization", "client_secret", "genius_token", "code"}
+
+def redact(value):
+    if not isinstance(value, str):
+        return value
+    for pattern in REDACT_PATTERNS:
+        value = pattern.sub(lambda match: match.group(1) + "[REDACTED]", value)
+    return value
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line with the time, level, logger name, message, the `fields` passed
+    # through `extra` and the exception traceback if any. Runs on the listener thread
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        for key, value in getattr(record, "fields", {}).items():
+            entry[key] = "[REDACTED]" if key in REDACT_FIELDS else redact(value)
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = redact(record.exc_text)
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+class SamplingFilter(logging.Filter):
+    # Keeps every record at WARNING and above and records below it with probability `rate`
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Non-blocking handler: records are put on a bounded queue for the listener thread to format and
+    # write, and dropped (counted in `dropped`) instead of blocking the request when it is full
+    def __init__(self, queue_size=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(queue_size))
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Merge the message arguments now, as they may change once the call returns; formatting,
+        # redaction and I/O are left to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+# Queue handler and listener thread of this worker process, set up by configure_logging()
+log_handler = None
+log_listener = None
+log_pid = None
+
+def configure_logging(level=LOG_LEVEL, stream=None):
+    # Route the spotufy loggers through a DroppingQueueHandler to a listener thread writing JSON lines
+    # to stderr (or `stream`). Called by app.py at startup; each worker process sets up its own
+    # listener. Without it, spotufy logs through the standard library defaults.
+    global log_handler, log_listener, log_pid
+    if log_listener is not None and log_pid == os.getpid():
+        return log_handler
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter())
+    log_handler = DroppingQueueHandler()
+    log_handler.addFilter(SamplingFilter())
+    log_listener = logging.handlers.QueueListener(log_handler.queue, output)
+    log_listener.start()
+    log_pid = os.getpid()
+    atexit.register(log_listener.stop)
+    logger.handlers = [log_handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    # Trace lines are switched on by SPOTUFY_TRACE_LOG, independently of the log level
+    trace_logger.setLevel(logging.INFO)
+    return log_handler
+
+def format_labels(names, values, extra=()):
+    # Prometheus label set, e.g. {endpoint="/search",method="GET"}
+    pairs = []
+    for name, value in list(zip(names, values)) + list(extra):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append('%s="%s"' % (name, value))
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    # Prometheus-style counter with one series per label set
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.series.get(tuple(str(labels[name]) for name in self.labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = sorted(self.series.items())
+        for key, value in series:
+            lines.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self.series = {}
+
+class Histogram(Counter):
+    # Prometheus-style cumulative histogram with one series per label set. Each series holds the
+    # count of observations per bucket followed by the sum and the total count
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def value(self, **labels):
+        # Number of observations of a label set
+        series = self.series.get(tuple(str(labels[name]) for name in self.labels))
+        return series[-1] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self.series.items())
+        for key, values in series:
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', '+Inf')])} {values[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {values[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {values[-1]}")
+        return lines
+
+class MetricsRegistry:
+    # The metrics of this worker process, rendered in the Prometheus text format for /metrics
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+metrics = MetricsRegistry()
+request_latency = metrics.register(Histogram(
+    "spotufy_request_duration_seconds", "Duration of Flask requests by route", ("route", "method")))
+feature_latency = metrics.register(Histogram(
+    "spotufy_feature_duration_seconds", "Duration of feature function calls", ("function",)))
+upstream_latency = metrics.register(Histogram(
+    "spotufy_upstream_request_duration_seconds", "Duration of upstream calls including retries", ("endpoint", "method")))
+upstream_requests = metrics.register(Counter(
+    "spotufy_upstream_requests_total", "Upstream calls by final status", ("endpoint", "method", "status")))
+upstream_retries = metrics.register(Counter(
+    "spotufy_upstream_retries_total", "Retried upstream attempts", ("endpoint",)))
+cache_lookups = metrics.register(Counter(
+    "spotufy_cache_lookups_total", "Cache lookups by result", ("endpoint", "result")))
+
+class RequestTrace:
+    # Upstream calls, cache lookups and feature timings recorded while serving one request. Made
+    # available to feature functions (and the fan-out threads and event loop they use) through the
+    # current_trace context variable
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.calls = []
+        self.cache = []
+        self.features = []
+        self._lock = threading.Lock()
+
+    def record_call(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def record_cache(self, endpoint, hit):
+        with self._lock:
+            self.cache.append((endpoint, hit))
+
+    def record_feature(self, name, elapsed):
+        with self._lock:
+            self.features.append((name, elapsed))
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def server_timing(self):
+        # Server-Timing header value: total time, feature functions, cache results and upstream calls
+        with self._lock:
+            calls, features, cache = list(self.calls), list(self.features), list(self.cache)
+        entries = [f"total;dur={self.elapsed_ms()}"]
+        entries += [f"{name};dur={round(elapsed * 1000, 1)}" for name, elapsed in features]
+        if cache:
+            hits = sum(1 for _, hit in cache if hit)
+            entries.append(f'cache;desc="{hits} hit, {len(cache) - hits} miss"')
+        for i, call in enumerate(calls[:SERVER_TIMING_MAX_CALLS]):
+            entries.append(f'upstream-{i};desc="{call["method"]} {call["endpoint"]} {call["status"]}";dur={call["latency_ms"]}')
+        return ", ".join(entries)
+
+    def summary(self):
+        with self._lock:
+            calls, features, cache = list(self.calls), list(self.features), list(self.cache)
+        hits = sum(1 for _, hit in cache if hit)
+        return {
+            "duration_ms": self.elapsed_ms(),
+            "upstream": calls,
+            "cache": {"hit": hits, "miss": len(cache) - hits, "lookups": [
+                {"endpoint": endpoint, "result": "hit" if hit else "miss"} for endpoint, hit in cache]},
+            "features": [{"function": name, "duration_ms": round(elapsed * 1000, 1)} for name, elapsed in features],
+        }
+
+# Trace of the request being served, None outside of Flask requests (e.g. background prefetching)
+current_trace = contextvars.ContextVar('spotufy_trace', default=None)
+
+# Collections whose next path segment is an ID, see endpoint_template()
+ID_COLLECTIONS = {"artists", "albums", "tracks", "playlists", "users", "shows", "episodes", "audiobooks"}
+
+def endpoint_template(url):
+    # Path of a Spotify API URL relative to the API root with IDs replaced by {id}, so calls can be
+    # grouped by endpoint, e.g. /artists/{id}/top-tracks
+    path = urllib.parse.urlsplit(url).path
+    root = urllib.parse.urlsplit(get_settings().spotify_api_url).path
+    if root and path.startswith(root):
+        path = path[len(root):]
+    segments = path.split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in ID_COLLECTIONS and segments[i]:
+            segments[i] = "{id}"
+    return '/'.join(segments) or '/'
+
+def record_upstream_call(endpoint, method, status, size, elapsed, retries):
+    # Record a finished upstream call (after all of its retries) in the metrics and current trace
+    status = status or "error"
+    method = method.upper()
+    upstream_latency.observe(elapsed, endpoint=endpoint, method=method)
+    upstream_requests.inc(endpoint=endpoint, method=method, status=status)
+    if retries:
+        upstream_retries.inc(retries, endpoint=endpoint)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.record_call({"endpoint": endpoint, "method": method, "status": status, "bytes": size,
+                           "latency_ms": round(elapsed * 1000, 1), "retries": retries})
+
+def record_cache_lookup(endpoint, hit):
+    cache_lookups.inc(endpoint=endpoint, result="hit" if hit else "miss")
+    trace = current_trace.get()
+    if trace is not None:
+        trace.record_cache(endpoint, hit)
+
+def timed(func):
+    # Decorator recording the duration of a feature function (sync or async) in feature_latency and
+    # in the current trace
+    name = func.__name__
+
+    def record(started):
+        elapsed = time.perf_counter() - started
+        feature_latency.observe(elapsed, function=name)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.record_feature(name, elapsed)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                record(started)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(started)
+    return wrapper
+
+class HTTPTransport:
+    # Shared keep-alive HTTP transport used for every upstream request.
+    # Holds one requests.Session (and therefore one urllib3 connection pool per host)
+    # per worker process, so TCP+TLS connections are reused between API calls.
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def session(self):
+        # Sessions are created lazily and per process: gunicorn forks its workers after
+        # importing the app, and sockets must never be shared between processes
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    self._session = self._new_session()
+                    self._pid = pid
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session().request(method, url, **kwargs)
+
+    def stats(self):
+        # Connection reuse counters summed over every host pool of this worker
+        stats = {"requests": 0, "connections": 0, "reused": 0}
+        session = self._session
+        if session is None or self._pid != os.getpid():
+            return stats
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                stats["requests"] += pool.num_requests
+                stats["connections"] += pool.num_connections
+        stats["reused"] = max(stats["requests"] - stats["connections"], 0)
+        return stats
+
+    def close(self):
+        # Close every pooled connection; a new session is created on next use
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+            self._session = None
+            self._pid = None
+
+# Transport shared by all feature functions of this worker
+transport = HTTPTransport()
+atexit.register(transport.close)
+
+class FanOutExecutor:
+    # Bounded thread pool shared by all requests of a worker process, used to run
+    # independent upstream calls at the same time instead of one after another
+    def __init__(self, max_workers=FANOUT_WORKERS):
+        self.max_workers = max_workers
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def pool(self):
+        # Like the transport, threads are created lazily and per process
+        pid = os.getpid()
+        if self._pool is None or self._pid != pid:
+            with self._lock:
+                if self._pool is None or self._pid != pid:
+                    self._pool = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix='spotufy-fanout')
+                    self._pid = pid
+        return self._pool
+
+    def run(self, calls, max_concurrency=FANOUT_CONCURRENCY, deadline=FANOUT_DEADLINE):
+        # Run a list of zero-argument callables and return their results in the same order.
+        # At most max_concurrency calls of this request are in flight at once. Once the deadline
+        # (in seconds) passes, calls that have not started are cancelled and every unfinished
+        # call's result is None. A call that raises also yields None.
+        results = [None] * len(calls)
+        for index, result in self.iter_completed(calls, max_concurrency, deadline):
+            results[index] = result
+        return results
+
+    def iter_completed(self, calls, max_concurrency=FANOUT_CONCURRENCY, deadline=FANOUT_DEADLINE):
+        # Generator form of run(), yielding (index, result) pairs in the order the calls finish so
+        # results can be passed on as they arrive. Calls still unfinished at the deadline are cancelled
+        # and not yielded, as are the remaining calls when the caller stops iterating
+        if not calls:
+            return
+        if len(calls) == 1:
+            # Nothing to overlap with, so skip the thread hop
+            try:
+                result = calls[0]()
+            except Exception as e:
+                logger.error("Upstream call failed: %s", e)
+                result = None
+            yield 0, result
+            return
+
+        pool = self.pool()
+        end = time.monotonic() + deadline
+        waiting = list(enumerate(calls))
+        running = {}
+        try:
+            while waiting or running:
+                while waiting and len(running) < max_concurrency:
+                    index, call = waiting.pop(0)
+                    # Calls run with a copy of the caller's context, so they are recorded in its trace
+                    running[pool.submit(contextvars.copy_context().run, call)] = index
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, _ = concurrent.futures.wait(running, timeout=remaining,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    index = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error("Upstream call failed: %s", e)
+                        result = None
+                    yield index, result
+            if waiting or running:
+                logger.warning("Fan-out deadline of %ss exceeded, cancelling %s call(s)", deadline, len(waiting) + len(running))
+        finally:
+            for future in running:
+                future.cancel()
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._pid = None
+
+# Fan-out executor shared by all feature functions of this worker
+executor = FanOutExecutor()
+atexit.register(executor.shutdown)
+
+def fan_out(calls, max_concurrency=FANOUT_CONCURRENCY, deadline=FANOUT_DEADLINE):
+    # Convenience wrapper around the shared executor, see FanOutExecutor.run()
+    return executor.run(calls, max_concurrency=max_concurrency, deadline=deadline)
+
+def fan_out_completed(calls, max_concurrency=FANOUT_CONCURRENCY, deadline=FANOUT_DEADLINE):
+    # Convenience wrapper around the shared executor, see FanOutExecutor.iter_completed()
+    return executor.iter_completed(calls, max_concurrency=max_concurrency, deadline=deadline)
+
+class BackgroundQueue:
+    # Bounded queue of jobs run by daemon worker threads of this worker process. Submitting never
+    # blocks: jobs that do not fit in the queue are dropped. A job submitted with a key is queued at
+    # most once at a time. Subclasses do the work of a job in process(), returning whether it completed
+    thread_name = 'background'
+    description = 'Background job'
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = set()
+        self._pid = None
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.dropped = 0
+        self.completed = 0
+
+    def start(self):
+        # Worker threads are started lazily and per process
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+                self.pending = set()
+                for i in range(self.workers):
+                    threading.Thread(target=self.run, name=f'spotufy-{self.thread_name}-{i}', daemon=True).start()
+                self._pid = pid
+
+    def put(self, job, key=None):
+        # Queue a job; returns whether it was queued
+        self.start()
+        with self._lock:
+            if key is not None and key in self.pending:
+                return False
+            try:
+                self.queue.put_nowait((key, job))
+            except queue.Full:
+                self.dropped += 1
+                return False
+            if key is not None:
+                self.pending.add(key)
+            self.accepted += 1
+            return True
+
+    def process(self, job):
+        raise NotImplementedError
+
+    def run(self):
+        while True:
+            key, job = self.queue.get()
+            try:
+                if self.process(job):
+                    self.completed += 1
+            except Exception as e:
+                logger.error("%s failed: %s", self.description, e)
+            finally:
+                with self._lock:
+                    self.pending.discard(key)
+                self.queue.task_done()
+
+    def clear(self):
+        # Drop every queued job; a job already running is left to finish
+        with self._lock:
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.queue.task_done()
+            self.pending.clear()
+
+    def stats(self):
+        return {"accepted": self.accepted, "dropped": self.dropped, "completed": self.completed,
+                "queued": self.queue.qsize()}
+
+class InFlightCall:
+    # A call being made by one caller on behalf of every concurrent caller with the same key
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    # Deduplicates identical concurrent calls: while a call for a key is in flight, other callers
+    # with the same key wait for its result instead of making their own. Built on threading
+    # primitives, so it also holds across greenlets when gevent monkey-patches the threading module.
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = InFlightCall()
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+# Single-flight groups for upstream requests and for cached catalog lookups
+api_flight = SingleFlight()
+cache_flight = SingleFlight()
+
 def make_api_call(url, method, headers=None, payload=None):
     # Generalized function to make any and all API requests as needed by the application
-    # Send the request with the passed in parameters
+    # Identical concurrent GET requests (same URL and same credentials) share a single upstream call
+    if method.upper() == "GET":
+        authorization = (headers or {}).get("Authorization")
+        return api_flight.do((url, authorization), lambda: send_api_request(url, method, headers, payload))
+    return send_api_request(url, method, headers, payload)
+
+def auth_headers(api_token, **extra):
+    # Headers of an API request made with api_token
+    return {"Authorization": f"Bearer {api_token}", **extra}
+
+class TokenBucket:
+    # Client-side rate limiter: allows `rate` requests per second with bursts of up to `capacity`.
+    # pause() stops all requests until a point in time, used to honour Retry-After on 429 responses.
+    def __init__(self, rate=RATE_LIMIT_PER_SECOND, capacity=RATE_LIMIT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def reserve(self):
+        # Take a token without blocking. Returns 0 if a request may be sent now, otherwise the
+        # number of seconds to wait before trying again (used by the async client in spotufy_async)
+        if self.rate <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, max_wait=None):
+        # Block until a request may be sent and return True, or return False straight away when that
+        # would take longer than max_wait seconds (e.g. while paused by a long Retry-After)
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return True
+            if max_wait is not None and wait > max_wait:
+                return False
+            time.sleep(wait)
+
+class CircuitBreaker:
+    # Fails fast while an upstream host is unhealthy. After `threshold` consecutive failures the
+    # circuit opens and requests are refused for `reset_timeout` seconds; then a single trial
+    # request is let through (half-open) and its outcome closes or re-opens the circuit.
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.failures >= self.threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        # A request that was never sent (such as an invalid URL) says nothing about the host; a
+        # trial it was let through as is handed to the next request
+        with self._lock:
+            self.trial_running = False
+
+# Rate limiters are shared per app credential (Spotify limits are applied per client ID),
+# circuit breakers per upstream host
+rate_limiters = {}
+circuit_breakers = {}
+resilience_lock = threading.Lock()
+
+def get_rate_limiter(credential=None):
+    credential = credential or get_settings().client_id
+    with resilience_lock:
+        if credential not in rate_limiters:
+            rate_limiters[credential] = TokenBucket()
+        return rate_limiters[credential]
+
+def get_circuit_breaker(url):
+    host = urllib.parse.urlparse(url).netloc
+    with resilience_lock:
+        if host not in circuit_breakers:
+            circuit_breakers[host] = CircuitBreaker()
+        return circuit_breakers[host]
+
+def backoff_delay(attempt):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+def retry_after_seconds(response):
+    # Spotify sends Retry-After as a number of seconds
     try:
-        response = requests.request(method, url, headers=headers, data=payload)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        print(f"ERROR: Error in API response code: {e}")
+        return max(float(response.headers.get("Retry-After", 1)), 0)
+    except ValueError:
+        return 1.0
+
+def send_api_request(url, method, headers=None, payload=None):
+    # Send the request with the passed in parameters over the shared pooled transport.
+    # 429 responses are retried after the Retry-After delay (pausing every request sharing the
+    # rate limiter). 5xx responses and connection errors are retried with jittered exponential
+    # backoff for idempotent methods only, and feed the host's circuit breaker.
+    # Every call is recorded, with its final status and number of retries, in the metrics and trace
+    limiter = get_rate_limiter()
+    breaker = get_circuit_breaker(url)
+    idempotent = method.upper() in ("GET", "HEAD", "PUT", "DELETE")
+    started = time.perf_counter()
+    status, size, attempt = None, 0, 0
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            last_attempt = attempt == MAX_RETRIES
+            status, size = None, 0
+            if not breaker.allow():
+                logger.warning("Circuit open for %s, not sending request", urllib.parse.urlparse(url).netloc)
+                return None
+            if not limiter.acquire(max_wait=MAX_RETRY_AFTER):
+                logger.warning("Rate limited by API, not sending request")
+                return None
+            try:
+                response = transport.request(method, url, headers=headers, data=payload)
+            except requests.exceptions.HTTPError as e:
+                breaker.release()
+                logger.error("Error in API response code: %s", e)
+                return None
+            except requests.exceptions.MissingSchema as e:
+                breaker.release()
+                logger.error("Missing schema info. Ensure the URL is valid: %s", e)
+                return None
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                breaker.record_failure()
+                if idempotent and not last_attempt:
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                logger.error("API request failed: %s", e)
+                return None
+            except requests.exceptions.RequestException as e:
+                # Broken bodies, redirect loops and the like: the host is not answering properly
+                breaker.record_failure()
+                logger.error("API request failed: %s", e)
+                return None
+
+            status, size = response.status_code, len(response.content or b"")
+            if response.status_code == 429:
+                delay = retry_after_seconds(response)
+                limiter.pause(delay)
+                if not last_attempt and delay <= MAX_RETRY_AFTER:
+                    continue
+                logger.warning("Rate limited by API, retry after %ss", delay)
+                return None
+            if response.status_code >= 500:
+                breaker.record_failure()
+                if idempotent and not last_attempt:
+                    time.sleep(backoff_delay(attempt))
+                    continue
+            else:
+                breaker.record_success()
+
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                logger.error("Error in API response code: %s", e)
+                return None
+            return decode_response(response.content)
         return None
-    except requests.exceptions.MissingSchema as e:
-        print(f"ERROR: Missing schema info. Ensure the URL is valid: {e}")
+    finally:
+        record_upstream_call(endpoint_template(url), method, status, size, time.perf_counter() - started, attempt)
+
+def decode_json(data):
+    # Decode a JSON response body. orjson, when installed, decodes the large catalog payloads several
+    # times faster than the standard library; both raise a ValueError subclass on invalid JSON
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def decode_response(content):
+    # JSON body of a successful API response, None for an empty or invalid one
+    if not content:
+        return None
+    try:
+        return decode_json(content)
+    except ValueError as e:
+        logger.error("Invalid JSON in API response: %s", e)
         return None
-    else:
-        return response.json() if response.text else None
 
-def request_api_token():
+def request_api_token(settings=None):
     # Function to request an API token from Spotify - valid for 1hr
-    # Read the app's client ID and secret from .env file
-    try:
-        api_secrets = dotenv.dotenv_values('.env')
-        if not api_secrets:
-            raise ValueError
-    except ValueError:
-        print('Reading .env file failed - no data read.\n' +
-              'Ensure the .env file exists in the project root directory and contains the correct values\n' +
-              'CLIENT_ID=<client id>\n' +
-              'CLIENT_SECRET=<client secret>', end="")
+    # Uses the app's client ID and callback URL from the loaded settings
+    settings = settings or get_settings()
+    if not settings.client_id or not settings.callback_url:
+        logger.error('No Spotify client configuration found. '
+                     'Ensure the environment or the .env file in the project root directory contains '
+                     'CLIENT_ID, CLIENT_SECRET and CALLBACK_URL')
         return None
 
-    client_id = api_secrets["CLIENT_ID"]
+    client_id = settings.client_id
 
     # Scopes define what permissions the application has to perform on a user's behalf.
     # Read more: https://developer.spotify.com/documentation/web-api/concepts/scopes
@@ -54,10 +1064,10 @@ def request_api_token():
             'response_type': 'code',
             'client_id': client_id,
             'scope': scope,
-            'redirect_uri': api_secrets["CALLBACK_URL"],
+            'redirect_uri': settings.callback_url,
             "show_dialog" : True
         }
-    SITE_URL = "https://accounts.spotify.com/authorize"
+    SITE_URL = f"{settings.spotify_accounts_url}/authorize"
     auth_url = f"{SITE_URL}?{urllib.parse.urlencode(params)}"
     return redirect(auth_url)
 
@@ -66,206 +1076,1304 @@ def parse_input(string):
     # Solution from https://stackoverflow.com/a/46414390
     return re.sub('[^0-9a-zA-Z ]', '', string)
 
-def create_playlist(api_token, playlist_name, track_list):
-    if not api_token:
-        print("ERROR: No API token provided")
+def normalize_query(string):
+    # Cache key form of a user query: parse_input() output, lowercased with whitespace collapsed
+    return ' '.join(parse_input(string).lower().split())
+
+# Result models returned by the feature functions. Slotted, frozen dataclasses take a fraction of
+# the memory of the dictionaries they replace and are safe to share between requests from the cache.
+# Templates read them through attribute access; item access (model["name"]) is kept for callers
+# written against the former dictionaries.
+class Model:
+    __slots__ = ()
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def to_list(self):
+        # Field values in declaration order: the compact form used by the cache backends
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*values)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Artist(Model):
+    id: str
+    name: str
+    uri: str
+    url: str
+    followers: str
+    popularity: int
+    genres: str
+    image: str
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Track(Model):
+    id: str
+    name: str
+    artist: str
+    album: str
+    uri: str = None
+    url: str = None
+    popularity: int = None
+    image: str = None
+    release_date: str = None
+    duration: float = None
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Release(Model):
+    id: str
+    title: str
+    type: str
+    url: str
+    release_date: str
+    tracks: int
+    cover_image: str
+    artists: list
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Album(Model):
+    id: str
+    name: str
+    uri: str
+    url: str
+    album_type: str
+    total_tracks: int
+    release_date: str
+    image: str
+
+# Models by name, for decoding cached values
+MODELS = {model.__name__: model for model in (Artist, Track, Release, Album)}
+
+def encode_model(value):
+    # JSONEncoder default hook: models are stored as their name and field values, without the
+    # field names every dictionary entry used to repeat
+    if isinstance(value, Model):
+        return {"$": type(value).__name__, "v": value.to_list()}
+    return str(value)
+
+def decode_model(obj):
+    # json.loads object hook reversing encode_model()
+    if "$" in obj and len(obj) == 2 and "v" in obj:
+        model = MODELS.get(obj["$"])
+        if model is not None:
+            return model.from_list(obj["v"])
+    return obj
+
+def encode_result(value):
+    # JSONEncoder default hook for API output: models become objects with their field names
+    if isinstance(value, Model):
+        return value.to_dict()
+    return str(value)
+
+# JSON encoder of API responses
+RESULT_ENCODER = json.JSONEncoder(separators=(',', ':'), default=encode_result)
+
+# Compact JSON encoder shared by the cache backends; result models are encoded by encode_model()
+CACHE_ENCODER = json.JSONEncoder(separators=(',', ':'), default=encode_model)
+
+class CacheBackend:
+    # Interface for the storage behind ResponseCache. Keys are strings; values are results of feature
+    # functions: JSON-serializable data and result models. get() returns a (hit, value) tuple so that falsy values can be
+    # told apart from misses, set() stores a value for ttl seconds.
+    # Backends outside the process wait on I/O (locks, sockets) and are `blocking`
+    blocking = True
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+    def encode(self, value):
+        return CACHE_ENCODER.encode(value).encode()
+
+    def decode(self, data):
+        return json.loads(data, object_hook=decode_model)
+
+    def decode_entry(self, key, data):
+        # (hit, value) of a stored entry. Corrupt or truncated entries are dropped and count as misses
+        try:
+            return True, self.decode(data)
+        except (zlib.error, ValueError, TypeError, KeyError) as e:
+            logger.error("Dropping unreadable cache entry %s: %s", key, e)
+            self.delete(key)
+            return False, None
+
+class MemoryCacheBackend(CacheBackend):
+    # Bounded in-process LRU store, evicting by entry count and by serialized byte size.
+    # Values are shared between requests and must be treated as read-only.
+    blocking = False
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()  # key -> (expires, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[2]
+
+    def set(self, key, value, ttl):
+        # Size is estimated from the serialized value; entries that could never fit are not stored
+        size = len(self.encode(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+class SQLiteCacheBackend(CacheBackend):
+    # On-disk store shared by every worker process on a node (WAL mode allows concurrent
+    # readers alongside a writer). Survives worker restarts and evicts least-recently-used
+    # entries by entry count and byte size like the in-memory backend. With compress, values are
+    # zlib-compressed on disk (worthwhile for large text such as lyrics). Database errors (e.g. a
+    # lock held past the timeout or a full disk) are treated as cache misses.
+    def __init__(self, path, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, compress=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._local = threading.local()
+        self.evictions = 0
+        self.expirations = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires REAL NOT NULL, accessed REAL NOT NULL)")
+        self._connection().execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+
+    def _connection(self):
+        # sqlite3 connections must not cross threads or forked processes
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
+    def encode(self, value):
+        data = super().encode(value)
+        return zlib.compress(data) if self.compress else data
+
+    def decode(self, data):
+        # Compressed and plain entries can both be read, so compression can be toggled on an existing file
+        if data[:1] == b"\x78":
+            data = zlib.decompress(data)
+        return super().decode(data)
+
+    def get(self, key):
+        now = time.time()
+        try:
+            db = self._connection()
+            row = db.execute("SELECT value, expires, accessed FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False, None
+            if row[1] <= now:
+                db.execute("DELETE FROM cache WHERE key = ? AND expires <= ?", (key, now))
+                self.expirations += 1
+                return False, None
+        except sqlite3.Error as e:
+            logger.error("SQLite cache unavailable: %s", e)
+            return False, None
+        if now - row[2] > SQLITE_TOUCH_INTERVAL:
+            # Recording the access is best effort; the hit stands if the write fails
+            try:
+                db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                logger.warning("Could not update SQLite cache access time: %s", e)
+        return self.decode_entry(key, row[0])
+
+    def set(self, key, value, ttl):
+        data = self.encode(value)
+        if len(data) > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            db = self._connection()
+            with db:
+                db.execute("BEGIN IMMEDIATE")
+                db.execute("INSERT OR REPLACE INTO cache (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                           (key, data, len(data), now + ttl, now))
+                db.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+                count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+                while count > self.max_entries or total > self.max_bytes:
+                    oldest, size = db.execute("SELECT key, size FROM cache ORDER BY accessed LIMIT 1").fetchone()
+                    db.execute("DELETE FROM cache WHERE key = ?", (oldest,))
+                    count -= 1
+                    total -= size
+                    self.evictions += 1
+        except sqlite3.Error as e:
+            logger.error("SQLite cache unavailable: %s", e)
+
+    def delete(self, key):
+        try:
+            self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logger.error("SQLite cache unavailable: %s", e)
+
+    def clear(self):
+        try:
+            self._connection().execute("DELETE FROM cache")
+        except sqlite3.Error as e:
+            logger.error("SQLite cache unavailable: %s", e)
+
+    def stats(self):
+        try:
+            count, total = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        except sqlite3.Error as e:
+            logger.error("SQLite cache unavailable: %s", e)
+            count, total = None, None
+        return {
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": count,
+            "bytes": total,
+        }
+
+class RedisCacheBackend(CacheBackend):
+    # Store speaking the Redis protocol (RESP), shared by every worker that can reach the server.
+    # Expiry is handled by the server (SET ... PX); size-based eviction should be configured on the
+    # server itself (maxmemory + allkeys-lru). Connection errors are treated as cache misses.
+    def __init__(self, host='localhost', port=6379, db=0, prefix='spotufy:', timeout=1.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _socket(self):
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid or self._local.sock is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self._local.sock = sock
+            self._local.reader = sock.makefile('rb')
+            self._local.pid = pid
+            if self.db:
+                self._command("SELECT", self.db)
+        return self._local.sock
+
+    def _command(self, *args):
+        sock = self._socket()
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(f"${len(arg)}\r\n".encode() + arg + b"\r\n")
+        try:
+            sock.sendall(b"".join(parts))
+            return self._read_reply()
+        except OSError:
+            # Drop the broken connection so the next command reconnects
+            self._local.sock = None
+            raise
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by Redis server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length == -1 else [self._read_reply() for _ in range(length)]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def get(self, key):
+        try:
+            data = self._command("GET", self.prefix + key)
+        except (OSError, RuntimeError) as e:
+            logger.error("Redis cache unavailable: %s", e)
+            return False, None
+        if data is None:
+            return False, None
+        return self.decode_entry(key, data)
+
+    def set(self, key, value, ttl):
+        try:
+            self._command("SET", self.prefix + key, self.encode(value), "PX", int(ttl * 1000))
+        except (OSError, RuntimeError) as e:
+            logger.error("Redis cache unavailable: %s", e)
+
+    def delete(self, key):
+        try:
+            self._command("DEL", self.prefix + key)
+        except (OSError, RuntimeError) as e:
+            logger.error("Redis cache unavailable: %s", e)
+
+    def clear(self):
+        # Only removes this application's keys, never the whole database
+        try:
+            keys = self._command("KEYS", self.prefix + "*")
+            if keys:
+                self._command("DEL", *keys)
+        except (OSError, RuntimeError) as e:
+            logger.error("Redis cache unavailable: %s", e)
+
+def create_cache_backend(url=CACHE_URL):
+    # Build the cache backend described by a URL:
+    #   memory://                    in-process store (default, one per worker)
+    #   sqlite:///path/to/cache.db   on-disk store shared by all workers on the node
+    #   redis://host:port/db         Redis-protocol server shared by all nodes
+    # memory:// and sqlite:// accept max_entries and max_bytes query parameters, sqlite:// also compress=1
+    parsed = urllib.parse.urlparse(url or "memory://")
+    options = dict(urllib.parse.parse_qsl(parsed.query))
+    limits = {name: int(options[name]) for name in ("max_entries", "max_bytes") if name in options}
+    if parsed.scheme == "memory":
+        return MemoryCacheBackend(**limits)
+    if parsed.scheme == "sqlite":
+        compress = options.get("compress", "0") not in ("0", "false", "")
+        return SQLiteCacheBackend(parsed.path or ":memory:", compress=compress, **limits)
+    if parsed.scheme == "redis":
+        db = int(parsed.path.strip('/') or 0)
+        return RedisCacheBackend(parsed.hostname or 'localhost', parsed.port or 6379, db)
+    raise ValueError(f"Unsupported cache backend URL: {url}")
+
+class ResponseCache:
+    # TTL cache for results of public catalog lookups, stored in a pluggable CacheBackend.
+    # Each endpoint has its own TTL; hit/miss counters are kept per worker.
+    def __init__(self, backend=None, ttls=None):
+        self.backend = MemoryCacheBackend() if backend is None else backend
+        self.ttls = dict(CACHE_TTLS if ttls is None else ttls)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def blocking(self):
+        return self.backend.blocking
+
+    def get(self, key):
+        hit, value = self.backend.get(key)
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return hit, value
+
+    def set(self, endpoint, key, value):
+        ttl = self.ttls.get(endpoint)
+        if ttl:
+            self.backend.set(key, value, ttl)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        stats = {"hits": self.hits, "misses": self.misses, "evictions": 0, "expirations": 0}
+        stats.update(self.backend.stats())
+        return stats
+
+# Lyrics by normalized (artist, track); lyric lookups are the slowest upstream calls of the app
+try:
+    lyrics_cache = create_cache_backend(LYRICS_CACHE_URL)
+except (ValueError, sqlite3.Error) as e:
+    logger.error("Could not open lyrics cache %s, falling back to in-process cache: %s", LYRICS_CACHE_URL, e)
+    lyrics_cache = MemoryCacheBackend()
+
+# Track IDs by normalized (track, artist) pair, shared by every lookup that searches for a track
+try:
+    track_id_cache = create_cache_backend(TRACK_ID_CACHE_URL)
+except (ValueError, sqlite3.Error) as e:
+    logger.error("Could not open track ID cache %s, falling back to in-process cache: %s", TRACK_ID_CACHE_URL, e)
+    track_id_cache = MemoryCacheBackend()
+
+# User IDs by access token digest; tokens are only valid for an hour
+user_id_cache = MemoryCacheBackend(max_entries=USER_ID_CACHE_MAX_ENTRIES)
+
+# Top tracks and recommendations by user ID, see get_user_recs()
+try:
+    user_recs_cache = create_cache_backend(USER_RECS_CACHE_URL)
+except (ValueError, sqlite3.Error) as e:
+    logger.error("Could not open user recommendations cache %s, falling back to in-process cache: %s", USER_RECS_CACHE_URL, e)
+    user_recs_cache = MemoryCacheBackend(max_entries=USER_ID_CACHE_MAX_ENTRIES)
+
+# Catalog cache shared by all feature functions of this worker
+try:
+    response_cache = ResponseCache(create_cache_backend(CACHE_URL))
+except (ValueError, sqlite3.Error) as e:
+    logger.error("Could not open cache backend %s, falling back to in-process cache: %s", CACHE_URL, e)
+    response_cache = ResponseCache()
+
+def cached(endpoint, key):
+    # Decorator caching the result of a catalog feature function in response_cache.
+    # The cache key does not include the API token, so identical lookups from different users share
+    # both cached results and in-flight requests.
+    # key receives the function's arguments and returns the normalized query to cache on, or None
+    # to bypass the cache (e.g. for invalid input, which the function itself reports).
+    # None results are never cached so failed lookups are retried on the next request.
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            query = key(*args, **kwargs)
+            if query is None:
+                return func(*args, **kwargs)
+            cache_key = catalog_cache_key(endpoint, query)
+            hit, value = response_cache.get(cache_key)
+            record_cache_lookup(endpoint, hit)
+            if hit:
+                return value
+
+            # Concurrent misses for the same key (e.g. many users searching for an artist whose
+            # album just dropped) wait for the first lookup instead of repeating it upstream
+            def lookup():
+                value = func(*args, **kwargs)
+                if value is not None:
+                    response_cache.set(endpoint, cache_key, value)
+                return value
+            return cache_flight.do(cache_key, lookup)
+        return wrapper
+    return decorator
+
+def catalog_cache_key(endpoint, query):
+    return f"{endpoint}:v{CACHE_SCHEMA}:{DEFAULT_MARKET}:{query}"
+
+def name_cache_key(api_token, name):
+    # Cache key for lookups by artist name: the normalized name
+    if not api_token or not isinstance(name, str) or not name:
         return None
-    if not playlist_name:
-        print("ERROR: No playlist name provided")
+    return normalize_query(name)
+
+def id_cache_key(api_token, spotify_id):
+    # Cache key for lookups by Spotify ID; IDs are case-sensitive so they are used as-is
+    if not api_token or not isinstance(spotify_id, str) or not spotify_id:
         return None
-    if not track_list:
-        print("ERROR: No track list provided")
+    return spotify_id
+
+def releases_cache_key(api_token, artist):
+    # Cache key for releases of an Artist: its ID
+    return id_cache_key(api_token, artist.get('id') if isinstance(artist, (dict, Model)) else None)
+
+def new_releases_cache_key(api_token):
+    # New releases are the same for every user
+    return "" if api_token else None
+
+def token_cache_key(api_token):
+    # Access tokens are never used as cache keys directly, only their digest
+    return hashlib.sha256(api_token.encode()).hexdigest()
+
+def get_user_id(api_token):
+    # Return the Spotify user ID owning an access token. IDs are cached per token for the token's
+    # lifetime, so repeated playlist creation does not refetch /me every time
+    hit, user_id = cached_user_id(api_token)
+    if hit:
+        return user_id
+    response = make_api_call(f"{get_settings().spotify_api_url}/me", "GET", headers=auth_headers(api_token))
+    return store_user_id(api_token, response)
+
+def cached_user_id(api_token):
+    hit, user_id = user_id_cache.get(token_cache_key(api_token))
+    record_cache_lookup("user_id", hit)
+    return hit, user_id
+
+def store_user_id(api_token, response):
+    # User ID of a /me response, cached for the token
+    if not response or not response.get("id"):
+        logger.warning("Could not determine the user ID for this token")
         return None
-    if not isinstance(playlist_name, str):
-        print("ERROR: Playlist name is not a string")
+    user_id_cache.set(token_cache_key(api_token), response["id"], USER_ID_TTL)
+    return response["id"]
+
+def clear_caches():
+    # Drop every cached result of this worker
+    response_cache.clear()
+    user_id_cache.clear()
+    user_recs_cache.clear()
+    user_recs_refresher.clear()
+    lyrics_cache.clear()
+    track_id_cache.clear()
+    search_index.clear()
+
+def popularity(model):
+    return -1 if model.popularity is None else model.popularity
+
+class SearchIndex:
+    # Local index of the artists and tracks seen in Spotify results, keyed by their normalize_query()
+    # names (tracks by track and artist name). It answers exact name -> artist/track lookups without a
+    # Spotify search and prefix lookups for typeahead: every word of an entry's name is kept in a
+    # sorted list, so the entries with a word starting with a prefix are found by bisection.
+    # Entries are Artist and Track models. When two entries share a name the more popular one is
+    # kept; results for the same ID are merged, so a track seen on a top-tracks page gains its
+    # duration once its details are looked up.
+    def __init__(self, path=SEARCH_INDEX_PATH, max_entries=SEARCH_INDEX_MAX_ENTRIES,
+                 save_interval=SEARCH_INDEX_SAVE_INTERVAL):
+        self.path = path
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self._entries = collections.OrderedDict()  # (kind, key) -> model, oldest first
+        self._words = []  # sorted (word, (kind, key)) pairs
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._pid = None
+        if path:
+            self.load()
+
+    @staticmethod
+    def entry_key(model):
+        if isinstance(model, Artist):
+            return ("artist", normalize_query(model.name))
+        return ("track", f"{normalize_query(model.name)}:{normalize_query(model.artist)}")
+
+    def add(self, models):
+        # Index the artists and tracks of a result list; anything else in it is ignored
+        changed = False
+        with self._lock:
+            for model in models or ():
+                if not isinstance(model, (Artist, Track)) or not isinstance(model.name, str) or not model.id:
+                    continue
+                if isinstance(model, Track) and not isinstance(model.artist, str):
+                    continue
+                key = self.entry_key(model)
+                if not normalize_query(model.name):
+                    continue
+                existing = self._entries.get(key)
+                if existing is not None and existing.id == model.id:
+                    merged = dataclasses.replace(existing, **{name: value for name, value in model.to_dict().items() if value is not None})
+                    if merged == existing:
+                        continue
+                    self._entries[key] = merged
+                elif existing is None or popularity(model) > popularity(existing):
+                    if existing is not None:
+                        self._remove(key)
+                    self._entries[key] = model
+                    for word in set(normalize_query(model.name).split()):
+                        bisect.insort(self._words, (word, key))
+                else:
+                    continue
+                changed = True
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            if changed:
+                self._dirty = True
+        if changed:
+            self.start()
+
+    def _remove(self, key):
+        model = self._entries.pop(key)
+        for word in set(normalize_query(model.name).split()):
+            index = bisect.bisect_left(self._words, (word, key))
+            if index < len(self._words) and self._words[index] == (word, key):
+                del self._words[index]
+
+    def artist(self, name):
+        # Artist indexed under exactly this (normalized) name, or None
+        with self._lock:
+            return self._entries.get(("artist", normalize_query(name)))
+
+    def track(self, name, artist):
+        # Track indexed under exactly this (normalized) track and artist name, or None
+        with self._lock:
+            return self._entries.get(("track", f"{normalize_query(name)}:{normalize_query(artist)}"))
+
+    def suggest(self, query, limit=10, kind=None):
+        # Entries matching a typeahead query, most popular first: the last word of the query is a
+        # prefix of a word of the name, the other query words are words of the name.
+        # kind restricts the results to "artist" or "track" entries
+        words = normalize_query(query).split() if isinstance(query, str) else []
+        if not words or limit <= 0:
+            return []
+        prefix = words.pop()
+        matches = {}
+        with self._lock:
+            start = bisect.bisect_left(self._words, (prefix,))
+            for word, key in self._words[start:start + SUGGEST_MAX_SCAN]:
+                if not word.startswith(prefix):
+                    break
+                if key in matches or (kind and key[0] != kind):
+                    continue
+                model = self._entries[key]
+                if words and not set(words) <= set(normalize_query(model.name).split()):
+                    continue
+                matches[key] = model
+        return sorted(matches.values(), key=lambda model: (-popularity(model), len(model.name)))[:limit]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._words = []
+            self._dirty = False
+
+    def load(self):
+        # Merge the entries saved in the index file, if there is one
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.loads(f.read(), object_hook=decode_model)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error("Could not read search index %s: %s", self.path, e)
+            return
+        if isinstance(data, dict) and data.get("version") == CACHE_SCHEMA:
+            # Entries read from the file are already saved
+            with self._lock:
+                dirty = self._dirty
+                self.add(data.get("entries"))
+                self._dirty = dirty
+
+    def save(self):
+        # Write the index to its file, merged with the entries other workers saved there. The file is
+        # replaced atomically so readers never see a partial index
+        if not self.path or not self._dirty:
+            return
+        self.load()
+        with self._lock:
+            entries = list(self._entries.values())
+            self._dirty = False
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(CACHE_ENCODER.encode({"version": CACHE_SCHEMA, "entries": entries}).encode())
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.error("Could not write search index %s: %s", self.path, e)
+            self._dirty = True
+
+    def start(self):
+        # The saving thread is started lazily, once per worker process (none with a save_interval of 0)
+        if not self.path or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                if self.save_interval > 0:
+                    threading.Thread(target=self.run, name='spotufy-search-index', daemon=True).start()
+                atexit.register(self.save)
+
+    def run(self):
+        while True:
+            time.sleep(self.save_interval)
+            self.save()
+
+# Search index of this worker
+search_index = SearchIndex()
+
+def first_image(images, index=0):
+    # URL of an image from a Spotify images array
+    try:
+        return images[index]["url"]
+    except IndexError:
+        return "Image not found"
+
+def parse_artist(artist):
+    # Build the artist model used throughout the templates from a full Spotify artist object
+    return Artist(
+        id=artist["id"],
+        name=artist["name"],
+        uri=artist["uri"],
+        url=artist["external_urls"]["spotify"],
+        followers="{:,d}".format(artist["followers"]["total"]),
+        popularity=artist["popularity"],
+        genres=', '.join(artist["genres"]),
+        image=first_image(artist["images"]),
+    )
+
+def parse_top_track(track):
+    # Build the track model used by top_tracks.html from a full Spotify track object
+    return Track(
+        id=track.get("id"),
+        name=track["name"],
+        artist=(track.get("artists") or track["album"]["artists"])[0]["name"],
+        album=track["album"]["name"],
+        uri=track["uri"],
+        url=track["external_urls"]["spotify"],
+        popularity=track["popularity"],
+        image=track["album"]["images"][1]["url"],
+        release_date=track["album"]["release_date"],
+    )
+
+def parse_track_details(track):
+    # Build the track model used by get_track_details.html from a full track object
+    return Track(
+        id=track["id"],
+        name=track["name"],
+        artist=track["album"]["artists"][0]["name"],
+        album=track["album"]["name"],
+        uri=track.get("uri"),
+        url=track["external_urls"]["spotify"],
+        image=first_image(track["album"]["images"], 1),
+        release_date=track["album"]["release_date"],
+        duration=track["duration_ms"] * (10 ** -3),
+    )
+
+def parse_recommendation(rec):
+    # Build the model of a recommended track: id, album, artist and album art
+    return Track(
+        id=rec["id"],
+        name=rec["name"],
+        artist=rec["artists"][0]["name"],
+        album=rec["album"]["name"],
+        uri=rec["uri"],
+        url=rec["external_urls"]["spotify"],
+        popularity=rec["popularity"],
+        image=first_image(rec["album"]["images"]),
+    )
+
+def parse_release(release):
+    # Build the release model used by get_discography.html from a simplified album object
+    return Release(
+        id=release["id"],
+        title=release["name"],
+        type=release["album_group"],
+        url=release["external_urls"]["spotify"],
+        release_date=release["release_date"],
+        tracks=release["total_tracks"],
+        cover_image=first_image(release["images"]),
+        artists=[a["name"] for a in release["artists"]],
+    )
+
+def parse_new_album(album):
+    # Build the album model used by new_albums.html from a simplified album object
+    return Album(
+        id=album.get("id"),
+        name=album["name"],
+        uri=album["uri"],
+        url=album["external_urls"]["spotify"],
+        album_type=album["album_type"],
+        total_tracks=album["total_tracks"],
+        release_date=album["release_date"],
+        image=first_image(album["images"]),
+    )
+
+def is_full_artist(artist):
+    # Simplified artist objects (as embedded in tracks/albums) lack the fields parse_artist needs
+    return all(field in artist for field in ARTIST_FIELDS)
+
+def get_artists(api_token, artist_ids):
+    # Look up several full artist objects at once using /artists?ids=, in chunks of ARTIST_BATCH_SIZE
+    # Returns a dictionary of artist ID -> artist object for every artist that was found
+    # Chunks are independent of each other, so they are fetched concurrently
+    headers = auth_headers(api_token)
+    responses = fan_out([lambda url=url: make_api_call(url, "GET", headers) for url in artists_urls(artist_ids)])
+    return parse_artists(responses)
+
+def artists_urls(artist_ids):
+    urls = []
+    for i in range(0, len(artist_ids), ARTIST_BATCH_SIZE):
+        chunk = artist_ids[i:i + ARTIST_BATCH_SIZE]
+        query = urllib.parse.quote(','.join(chunk))
+        urls.append(f"{get_settings().spotify_api_url}/artists?ids={query}")
+    return urls
+
+def parse_artists(responses):
+    # Artist ID -> artist object of the responses of artists_urls()
+    artists = {}
+    for response in responses:
+        if not response:
+            logger.warning("Response from API request is empty")
+            continue
+        for artist in response.get('artists') or []:
+            # Unknown IDs are returned as null entries
+            if artist and artist.get('id'):
+                artists[artist['id']] = artist
+    return artists
+
+def iter_pages(api_token, url, prefetch=True, max_pages=None):
+    # Generator following the `next` links of a Spotify paging object, yielding one page at a time.
+    # With prefetch, the next page is requested in the background while the caller processes the
+    # current one. At most max_pages pages (default MAX_PAGES) are fetched.
+    headers = auth_headers(api_token)
+    max_pages = MAX_PAGES if max_pages is None else max_pages
+    page = make_api_call(url, "GET", headers=headers)
+    if not page:
+        logger.warning("Response from API request is empty")
+        return
+    pending = None
+    try:
+        for count in range(1, max_pages + 1):
+            next_url = page.get('next') if count < max_pages else None
+            if prefetch and next_url:
+                pending = executor.pool().submit(contextvars.copy_context().run, make_api_call, next_url, "GET", headers)
+            yield page
+            if not next_url:
+                return
+            page = pending.result() if pending else make_api_call(next_url, "GET", headers=headers)
+            pending = None
+            if not page:
+                logger.warning("Response from API request is empty")
+                return
+    finally:
+        # Abandoned by the caller: don't leave a prefetch queued
+        if pending is not None:
+            pending.cancel()
+
+@timed
+def create_playlist(api_token, playlist_name, track_list):
+    if not is_playlist_input(api_token, playlist_name, track_list):
         return None
-    if not isinstance(track_list, list):
-        print("ERROR: Track list is not a list")
+    headers = auth_headers(api_token, **{"Content-Type": "application/json"})
+    user_id = get_user_id(api_token)
+    if not user_id:
         return None
 
-    headers = {"Authorization": f"Bearer {api_token}", "Content-Type":"application/json"}
-    url = "https://api.spotify.com/v1/me"
-    user_id = make_api_call(url, "GET", headers=headers)["id"]
-
     # Send the POST query to create the playlist. Will create a playlist for later inserting tracks into
-    data = {
-        "name": playlist_name,
-        "description": "Playlist created by SpOTUfy!",
-    }
-    payload = json.dumps(data)
-    url = f"{APIURL}/users/{user_id}/playlists"
+    url, payload = playlist_request(user_id, playlist_name)
     response = make_api_call(url, "POST", headers, payload)
     if not response:
         return None
     playlist_id = response["id"]
     play_url = response["external_urls"]["spotify"]
 
-    # Send the POST query to insert tracks into the newly created playlist
-    url = f"{APIURL}/playlists/{playlist_id}/tracks"
-    track_data = {"uris": [track["uri"] for track in track_list]}
-    track_payload = json.dumps(track_data)
-    response = make_api_call(url, "POST", headers, track_payload)
-    if not response:
-        return None
-    else:
-        return play_url
+    # Send the POST queries to insert tracks into the newly created playlist. Chunks are appended in
+    # order; concurrent inserts could land out of order, so the first failed chunk stops the insertion.
+    url, track_payloads = playlist_tracks_requests(playlist_id, track_list)
+    for track_payload in track_payloads:
+        response = make_api_call(url, "POST", headers, track_payload)
+        if not response:
+            return None
+    return play_url
+
+def is_playlist_input(api_token, playlist_name, track_list):
+    if not api_token:
+        logger.debug("No API token provided")
+        return False
+    if not playlist_name:
+        logger.debug("No playlist name provided")
+        return False
+    if not track_list:
+        logger.debug("No track list provided")
+        return False
+    if not isinstance(playlist_name, str):
+        logger.debug("Playlist name is not a string")
+        return False
+    if not isinstance(track_list, list):
+        logger.debug("Track list is not a list")
+        return False
+    return True
+
+def playlist_request(user_id, playlist_name):
+    # URL and payload creating an empty playlist
+    data = {
+        "name": playlist_name,
+        "description": "Playlist created by SpOTUfy!",
+    }
+    return f"{get_settings().spotify_api_url}/users/{user_id}/playlists", json.dumps(data)
+
+def playlist_tracks_requests(playlist_id, track_list):
+    # URL and payloads adding tracks (URIs or Track models) to a playlist. Spotify accepts at most
+    # PLAYLIST_CHUNK_SIZE URIs per request, so all chunk payloads are built up front and sent back to
+    # back over the same kept-alive connection
+    url = f"{get_settings().spotify_api_url}/playlists/{playlist_id}/tracks"
+    uris = [track if isinstance(track, str) else track["uri"] for track in track_list]
+    return url, [json.dumps({"uris": uris[i:i + PLAYLIST_CHUNK_SIZE]}) for i in range(0, len(uris), PLAYLIST_CHUNK_SIZE)]
 
 
 ################ Feature Functions ################
 
+@timed
+@cached("search_artists", key=name_cache_key)
 def search_artists(api_token, input_artist):
+    # Searches artist by name and returns a list of matches
+    url = search_artists_url(input_artist)
+    if url is None:
+        return None
+    return parse_search_artists(make_api_call(url, "GET", auth_headers(api_token)))
+
+def search_artists_url(input_artist):
     if not input_artist:
-        print("ERROR: No input artist provided")
+        logger.debug("No input artist provided")
         return None
     if not isinstance(input_artist, str):
-        print("ERROR: Invalid input artist type (provided value was not a string)")
+        logger.debug("Invalid input artist type (provided value was not a string)")
         return None
-    # Searches artist by name and returns a list of matches
-    headers = {"Authorization": f"Bearer {api_token}"}
     # URL encode artist string to ensure request executes properly
-    artist = parse_input(input_artist)
-    query = urllib.parse.quote(artist)
-    # Construct the query URL
-    url = f"{APIURL}/search?q={query}&type=artist&limit=5"
-
-    # Send the query - will return a list of matching artists
-    try:
-        response = make_api_call(url, "GET", headers)
+    query = urllib.parse.quote(parse_input(input_artist))
+    return f"{get_settings().spotify_api_url}/search?q={query}&type=artist&limit=5"
 
-        if not response:
-            print("ERROR: Response from API request is empty")
-            return None
-        # Check if any artists were found during search
-        if response['artists']['total'] == 0:
-            raise ValueError("No search results found!")
-    except ValueError as e:
-        print(f"ERROR: Error in search results: {e}")
+def parse_search_artists(response):
+    if not response:
+        logger.warning("Response from API request is empty")
+        return None
+    # Check if any artists were found during search
+    if response['artists']['total'] == 0:
+        logger.info("Error in search results: No search results found!")
         return None
 
     # Construct search result output
     artists = ['']  # Will hold the artist results - insert one null value at index 0 for easier array access
     for artist in response['artists']['items']:
-        artist_result = {
-            "name": artist["name"],
-            "url": artist["external_urls"]["spotify"],
-            "followers": "{:,d}".format(artist["followers"]["total"]),
-            "popularity": artist["popularity"],
-            "genres": ', '.join(artist["genres"]), 
-            "id" : artist["id"],
-            "uri" : artist["uri"]
-        }
-        try:
-            artist_result['imageUrl'] = artist["images"][0]["url"]
-        except IndexError:
-            artist_result['imageUrl'] = "Image not found"
-        artists.append(artist_result)
+        artists.append(parse_artist(artist))
+    search_index.add(artists)
     return artists
 
-def get_top_tracks(api_token, artist_name):
-    if not artist_name:
-        print("ERROR: No artist name provided")
-        return None
-    if not isinstance(artist_name, str):
-        print("ERROR: Invalid artist name provided (value provided was not a string)")
+def resolve_artist(api_token, name):
+    # Artist for an artist name: an exact match from the local search index, otherwise the best
+    # match of search_artists()
+    artist = indexed_artist(name)
+    if artist is not None:
+        return artist
+    artists = search_artists(api_token, name)
+    return artists[1] if artists else None
+
+def indexed_artist(name):
+    if not isinstance(name, str) or not name:
         return None
+    artist = search_index.artist(name)
+    record_cache_lookup("search_index", artist is not None)
+    return artist
+
+@timed
+@cached("get_top_tracks", key=name_cache_key)
+def get_top_tracks(api_token, artist_name):
     # Get the most popular tracks for a given artist
-    artists_got = search_artists(api_token, artist_name)
-    try:
-        artist_id = artists_got[1]["id"]
-    except TypeError:
-        print("ERROR: Artist was not found.")
+    if not is_artist_name(artist_name):
         return None
-    headers = {"Authorization": f"Bearer {api_token}"}
-    # URL encode artist string to ensure request executes properly
-    query = urllib.parse.quote(artist_id)
-    # Construct the query URL
-    url = f"{APIURL}/artists/{query}/top-tracks?market=US&limit=5"
+    artist = resolve_artist(api_token, artist_name)
+    if artist is None:
+        logger.info("Artist was not found.")
+        return None
+    return parse_top_tracks(make_api_call(top_tracks_url(artist.id), "GET", headers=auth_headers(api_token)))
 
-    # Send the query - will return a list of matching artists
-    try:
-        response = make_api_call(url, "GET", headers=headers)
+def is_artist_name(artist_name):
+    if not artist_name:
+        logger.debug("No artist name provided")
+        return False
+    if not isinstance(artist_name, str):
+        logger.debug("Invalid artist name provided (value provided was not a string)")
+        return False
+    return True
 
-        if not response:
-            print("ERROR: Response from API request is empty")
-            return None
-        # Check if any artists were found during search
-        if response['tracks'] == 0:
-            raise ValueError("No search results found!")
-    except ValueError as e:
-        print(f"ERROR: Error in search results: {e}")
-        return None
-
-    top_tracks = []
-    for track in response['tracks']:
-        artistResult = {
-            "name": track["name"],
-            "album" : track["album"]["name"],
-            "albumDate" : track["album"]["release_date"],
-            "albumImage" : track["album"]["images"][1]["url"],
-            "songUrl" : track["external_urls"]["spotify"],
-            "popularity": track["popularity"],
-            "uri" : track["uri"]
-        }
-        top_tracks.append(artistResult)
+def top_tracks_url(artist_id):
+    # URL encode the artist ID to ensure request executes properly
+    query = urllib.parse.quote(artist_id)
+    return f"{get_settings().spotify_api_url}/artists/{query}/top-tracks?market={DEFAULT_MARKET}&limit=5"
+
+def parse_top_tracks(response):
+    if not response:
+        logger.warning("Response from API request is empty")
+        return None
+    # Check if any tracks were found for the artist
+    if not response.get('tracks'):
+        logger.info("Error in search results: No search results found!")
+        return None
+    top_tracks = [parse_top_track(track) for track in response['tracks']]
+    search_index.add(top_tracks)
     return top_tracks
 
+@timed
 def search_song_details(api_token, track, artist):
     # Return information about a given track
-    if not api_token:
-        print("ERROR: No API token provided")
+    if not is_song_input(api_token, track, artist):
         return None
-    if not track:
-        print("ERROR: Track input is empty")
+    known, details = known_song_details(track, artist)
+    if known:
+        return details
+    if details is not None:
+        return get_track(api_token, details)
+
+    # Parse API response and store track information
+    found = search_track(api_token, track, artist)
+    if found is None:
         return None
+    return parse_track_details(found)
+
+def is_song_input(api_token, track, artist):
+    if not api_token:
+        logger.debug("No API token provided")
+        return False
+    if not track:
+        logger.debug("Track input is empty")
+        return False
     if not artist:
-        print("ERROR: Artist input is empty")
-        return None
+        logger.debug("Artist input is empty")
+        return False
     if not isinstance(track, str):
-        print("ERROR: Wrong input track type (provided value was not a string)")
-        return None
+        logger.debug("Wrong input track type (provided value was not a string)")
+        return False
     if not isinstance(artist, str):
-        print("ERROR: Wrong input artist type (provided value was not a string)")
+        logger.debug("Wrong input artist type (provided value was not a string)")
+        return False
+    return True
+
+def known_song_details(track, artist):
+    # Pairs searched for before are resolved by the track ID they were cached with: from the search
+    # index when it holds that very track, otherwise by ID through get_track(). The index can hold a
+    # more popular track of the same name, so it only answers on its own for pairs not cached.
+    # Returns (True, details) when answered without an upstream call, otherwise (False, the cached
+    # track ID to look up, or None when the pair has to be searched for)
+    hit, track_id = cached_track_id(track, artist)
+    if hit and track_id is None:
+        logger.info("No track matching search criteria found")
+        return True, None
+    indexed = search_index.track(track, artist)
+    usable = indexed is not None and indexed.duration is not None and (not hit or indexed.id == track_id)
+    record_cache_lookup("search_index", usable)
+    if usable:
+        return True, indexed
+    return False, track_id
+
+@timed
+@cached("get_track", key=id_cache_key)
+def get_track(api_token, track_id):
+    # Details of a track by Spotify ID
+    if not api_token or not track_id:
+        logger.debug("No API token or track ID provided")
         return None
+    return parse_track(make_api_call(track_url(track_id), "GET", headers=auth_headers(api_token)))
 
-    track = parse_input(track)
-    artist = parse_input(artist)
+def track_url(track_id):
+    return f"{get_settings().spotify_api_url}/tracks/{urllib.parse.quote(track_id)}?market={DEFAULT_MARKET}"
+
+def parse_track(response):
+    if not response or not all(field in response for field in TRACK_FIELDS):
+        logger.warning("Response from API request is empty")
+        return None
+    details = parse_track_details(response)
+    search_index.add([details])
+    return details
 
+def add_track_details(found):
+    # Index the details of a track found by a search and cache them under its ID for get_track()
+    if all(field in found for field in TRACK_FIELDS):
+        details = parse_track_details(found)
+        search_index.add([details])
+        response_cache.set("get_track", catalog_cache_key("get_track", found["id"]), details)
+
+def track_id_cache_key(track, artist):
+    return f"track_id:{DEFAULT_MARKET}:{normalize_query(track)}:{normalize_query(artist)}"
+
+def cached_track_id(track, artist):
+    # (hit, track ID) of a (track, artist) pair from track_id_cache; the ID is None for pairs known
+    # to have no match
+    hit, track_id = track_id_cache.get(track_id_cache_key(track, artist))
+    record_cache_lookup("track_id", hit)
+    return hit, track_id or None
+
+def search_track(api_token, track, artist):
+    # Run the `track:X artist:Y` search for a (track, artist) pair and return the first matching
+    # full track object, or None. The outcome is stored in track_id_cache: the track ID, or an empty
+    # string when Spotify has no match. Failed requests are not cached.
+    # Concurrent searches for the same pair, from any user, share one request
+    key = track_id_cache_key(track, artist)
+    url = search_track_url(track, artist)
+    return cache_flight.do(key, lambda: store_search_track(key, make_api_call(url, "GET", auth_headers(api_token))))
+
+def search_track_url(track, artist):
     # URL encode track and artist strings to ensure request executes properly
-    track_query = urllib.parse.quote(track)
-    artist_query = urllib.parse.quote(artist)
-    headers = {"Authorization": f"Bearer {api_token}"}
+    track_query = urllib.parse.quote(parse_input(track))
+    artist_query = urllib.parse.quote(parse_input(artist))
+    return f"{get_settings().spotify_api_url}/search?q=track%3A{track_query}+artist%3A{artist_query}&type=track&limit=1&market={DEFAULT_MARKET}"
 
-    # Construct the query URL
-    url = f"{APIURL}/search?q=track%3A{track_query}+artist%3A{artist_query}&type=track&limit=1"
-    response = make_api_call(url, "GET", headers)
+def store_search_track(key, response):
+    # First track of a search_track_url() response, with the outcome stored under key
     if not response:
-        print("ERROR: Response from API request is empty")
+        logger.warning("Response from API request is empty")
         return None
     if not response["tracks"]["items"]:
-        print("ERROR: No track matching search criteria found")
+        logger.info("No track matching search criteria found")
+        track_id_cache.set(key, "", TRACK_ID_MISS_TTL)
         return None
-    # Parse API response and store track information
-    track = response["tracks"]["items"][0]
-    track_results = {
-        "id" : track["id"],
-        "name": track["name"],
-        "album": track["album"]["name"],
-        "artist": track["album"]["artists"][0]["name"],
-        "duration": track["duration_ms"] * (10 ** -3),
-        "released": track["album"]["release_date"],
-        "url": track["external_urls"]["spotify"],
-    }
-    try:
-        track_results['image'] = track["album"]["images"][1]["url"]
-    except IndexError:
-        track_results['image'] = "Image not found"
-    return track_results
+    found = response["tracks"]["items"][0]
+    track_id_cache.set(key, found["id"], TRACK_ID_TTL)
+    add_track_details(found)
+    return found
+
+def known_track_id(track, artist):
+    # (known, track ID) of a (track, artist) pair from the track ID cache or the search index,
+    # without going upstream. The cached ID, the outcome of searching for the pair, comes first
+    hit, track_id = cached_track_id(track, artist)
+    if hit:
+        return True, track_id
+    indexed = search_index.track(track, artist)
+    record_cache_lookup("search_index", indexed is not None)
+    if indexed is not None:
+        return True, indexed.id
+    return False, None
+
+def resolve_track_id(api_token, track, artist):
+    # Spotify ID of a track by track and artist name, or None if there is no such track
+    known, track_id = known_track_id(track, artist)
+    if known:
+        return track_id
+    found = search_track(api_token, track, artist)
+    return found["id"] if found else None
+
+def resolve_track_ids(api_token, pairs):
+    # Bulk form of resolve_track_id(): resolve a list of (track, artist) pairs and return their track
+    # IDs in the same order, None for invalid pairs and pairs without a match. Pairs that are not
+    # known yet are searched for concurrently, each distinct pair once
+    keys, resolved, pending = known_track_ids(api_token, pairs)
+    results = fan_out([lambda pair=pair: search_track(api_token, *pair) for pair in pending.values()])
+    return resolved_track_ids(keys, resolved, pending, results)
+
+def known_track_ids(api_token, pairs):
+    # Cache keys of pairs, the IDs of the pairs already known by key, and the pairs to search for by key
+    keys = [track_id_cache_key(*pair) if is_track_pair(pair) else None for pair in pairs]
+    resolved = {}
+    pending = {}
+    for key, pair in zip(keys, pairs):
+        if key is None or key in resolved or key in pending:
+            continue
+        known, track_id = known_track_id(*pair)
+        if known:
+            resolved[key] = track_id
+        else:
+            pending[key] = pair
+    if not api_token:
+        pending = {}
+    return keys, resolved, pending
+
+def resolved_track_ids(keys, resolved, pending, results):
+    # Track IDs in the order of keys, with the pending pairs resolved by their search_track() results
+    for key, found in zip(pending, results):
+        resolved[key] = found["id"] if found else None
+    return [resolved.get(key) for key in keys]
+
+def is_track_pair(pair):
+    return (isinstance(pair, (tuple, list)) and len(pair) == 2
+            and all(isinstance(value, str) and value for value in pair))
+
+def canonical_seeds(tracks=(), artists=(), genres=()):
+    # Seeds of a recommendation request as a (tracks, artists, genres) tuple of sorted, distinct
+    # values, so every ordering of the same seeds is one request. A single seed may be passed as a
+    # string. None when a seed is not a non-empty string or there are no or too many seeds
+    seeds = []
+    for values in (tracks, artists, genres):
+        if isinstance(values, str):
+            values = (values,)
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            return None
+        if not all(isinstance(value, str) and value.strip() for value in values):
+            return None
+        seeds.append(tuple(sorted({value.strip() for value in values})))
+    # Track and artist IDs are case-sensitive, genres are not
+    seeds[2] = tuple(sorted({genre.lower() for genre in seeds[2]}))
+    if not 0 < sum(len(values) for values in seeds) <= RECOMMENDATION_MAX_SEEDS:
+        return None
+    return tuple(seeds)
+
+def is_recommendation_limit(limit):
+    return isinstance(limit, int) and not isinstance(limit, bool) and 0 < limit <= RECOMMENDATION_MAX_LIMIT
 
-def get_track_recs(api_token, track, artist):
+def recommendation_cache_key(api_token, tracks=(), artists=(), genres=(), limit=RECOMMENDATION_LIMIT):
+    # Cache key for recommendations: the limit and the canonical seed set, so users asking for the
+    # same seeds in any order share one upstream call
+    seeds = canonical_seeds(tracks, artists, genres)
+    if not api_token or seeds is None or not is_recommendation_limit(limit):
+        return None
+    return f"{limit}:" + ";".join(f"{kind}={','.join(values)}" for kind, values in zip(SEED_TYPES, seeds))
+
+@timed
+@cached("get_recommendations", key=recommendation_cache_key)
+def get_recommendations(api_token, tracks=(), artists=(), genres=(), limit=RECOMMENDATION_LIMIT):
+    # Recommended tracks for up to RECOMMENDATION_MAX_SEEDS seeds: track IDs, artist IDs and genres
+    url = recommendations_url(api_token, tracks, artists, genres, limit)
+    if url is None:
+        return None
+    return parse_recommendations(make_api_call(url, "GET", headers=auth_headers(api_token)))
+
+def recommendations_url(api_token, tracks=(), artists=(), genres=(), limit=RECOMMENDATION_LIMIT):
+    # URL of a recommendation request, None for invalid input
+    if not api_token:
+        logger.debug("No API token provided")
+        return None
+    seeds = canonical_seeds(tracks, artists, genres)
+    if seeds is None:
+        logger.info("Recommendations need between 1 and %s seed tracks, artists or genres", RECOMMENDATION_MAX_SEEDS)
+        return None
+    if not is_recommendation_limit(limit):
+        logger.info("Recommendation limit must be between 1 and %s", RECOMMENDATION_MAX_LIMIT)
+        return None
+    params = {"limit": limit, "market": DEFAULT_MARKET}
+    params.update((f"seed_{kind}", ",".join(values)) for kind, values in zip(SEED_TYPES, seeds) if values)
+    return f"{get_settings().spotify_api_url}/recommendations?{urllib.parse.urlencode(params)}"
+
+def parse_recommendations(response):
+    if not response:
+        logger.warning("Response from API request is empty")
+        return None
+    if not response.get("tracks"):
+        logger.info("No track matching search criteria found")
+        return None
+    recs = [parse_recommendation(rec) for rec in response["tracks"] if rec]
+    search_index.add(recs)
+    return recs
+
+@timed
+def get_track_recs(api_token, track, artist, limit=RECOMMENDATION_LIMIT):
     # Get a list of recommended tracks based on a single input track
-    # URL encode track and artist strings to ensure request executes properly
-    headers = {"Authorization": f"Bearer {api_token}"}
+    if not is_track_recs_input(api_token, track, artist):
+        return None
+    trackID = resolve_track_id(api_token, track, artist)
+    if not trackID:
+        return None
+    return get_recommendations(api_token, tracks=(trackID,), limit=limit)
 
+def is_track_recs_input(api_token, track, artist):
     try:
         # Make sure token, artist and track were given
         if not api_token:
@@ -278,161 +2386,201 @@ def get_track_recs(api_token, track, artist):
             raise ValueError("Input track was not a string")
         if not isinstance(artist, str):
             raise ValueError("Input artist was not a string")
-
-        track_query = urllib.parse.quote(track)
-        artist_query = urllib.parse.quote(artist)
-        # Construct the query URL to search for specified track by specified artist
-        url = f"{APIURL}/search?q=track%3A{track_query}+artist%3A{artist_query}&type=track&limit=1"
-        response = make_api_call(url, "GET", headers=headers)
-        if not response:
-            print("ERROR: Response from API request is empty")
-            return None
-        if not response["tracks"]["items"]:
-            print("ERROR: No track matching search criteria found")
-            return None
     except ValueError as e:
-        print(f"ERROR: Error in search results: {e}")
+        logger.info("Error in search results: %s", e)
+        return False
+    return True
+
+def user_recs_cache_key(user_id, limit):
+    return f"user_recs:v{CACHE_SCHEMA}:{DEFAULT_MARKET}:{limit}:{user_id}"
+
+def is_stale_user_recs(entry):
+    return time.time() - entry["fetched"] > USER_RECS_REFRESH_AFTER
+
+def fetch_user_recs(api_token, limit=RECOMMENDATION_LIMIT):
+    # Fetch a user's top tracks and the recommendations based on them, as a user_recs_cache entry:
+    # {"fetched": time fetched, "seeds": top track IDs, "recs": recommended tracks}
+    seed_tracks = parse_user_seeds(make_api_call(user_seeds_url(), "GET", headers=auth_headers(api_token)))
+    if seed_tracks is None:
         return None
+    return user_recs_entry(seed_tracks, get_recommendations(api_token, tracks=seed_tracks, limit=limit))
 
-    # Parse API response and stores track id
-    track = response["tracks"]["items"][0]
-    trackID = track["id"]
+def user_seeds_url():
+    # A user's top tracks in the past 4 weeks, one per seed
+    return f"{get_settings().spotify_api_url}/me/top/tracks?time_range=short_term&limit={RECOMMENDATION_MAX_SEEDS}"
 
-    # Construct the query URL to search for the top 5 recommended tracks based on specified track id
-    rec_query = urllib.parse.quote(trackID)
-    url = f"{APIURL}/recommendations?limit=5&seed_tracks={rec_query}"
-    try:
-        response = make_api_call(url, "GET", headers=headers)
-        if not response:
-            print("ERROR: Response from API request is empty")
-            return None
-        if not response["tracks"][0]:
-            print("ERROR: No track matching search criteria found")
-            return None
-    except ValueError as e:
-        print(f"ERROR: Error in search results: {e}")
-        return None
-
-    recs = []  # Will hold the track recommendation results - insert one null value at index 0 for easier array access
-    for rec in response['tracks']:
-        # Stores track id, album, artist and album art in dictionary
-        recs_result = {
-            "id": rec["id"],
-            "name": rec["name"],
-            "album": rec["album"]["name"],
-            "artist": rec["artists"][0]["name"],
-            "popularity" : rec["popularity"],
-            "songUrl" : rec["external_urls"]["spotify"],
-            "uri" : rec["uri"]
-        }
-        try:
-            recs_result['imageUrl'] = rec["album"]["images"][0]["url"]
-        except IndexError:
-            recs_result['imageUrl'] = "Image not found"
-        recs.append(recs_result)
-    return recs
+def parse_user_seeds(response):
+    if not response:
+        logger.warning("Response from API request is empty")
+        return None
+    # Users with fewer top tracks get recommendations from the ones they have
+    seed_tracks = [item["id"] for item in response.get("items", []) if item and item.get("id")]
+    if not seed_tracks:
+        logger.info("No track matching search criteria found")
+        return None
+    return seed_tracks[:RECOMMENDATION_MAX_SEEDS]
 
-def get_user_recs(api_token):
-    if not api_token:
-        print("ERROR: No API token provided")
+def user_recs_entry(seed_tracks, recs):
+    if recs is None:
         return None
-    # Get recommendations based on user's top tracks
-    # URL encode username strings to ensure request executes properly
-    headers = {"Authorization": f"Bearer {api_token}"}
-    # Construct the query URL to search for a user's top 5 tracks in the past 4 weeks
-    url = f"{APIURL}/me/top/tracks?time_range=short_term&limit=5"
-    try:
-        response = make_api_call(url, "GET", headers=headers)
-        if not response:
-            print("ERROR: Response from API request is empty")
-            return None
-        if response['total']== 0:
-            print("ERROR: No track matching search criteria found")
-            return None
-    except ValueError as e:
-        print(f"ERROR: Error in search results: {e}")
+    return {"fetched": time.time(), "seeds": seed_tracks, "recs": recs}
+
+def refresh_user_recs(api_token, key, limit=RECOMMENDATION_LIMIT):
+    # Fetch a user's recommendations and store them under key; failures leave any cached entry in place
+    entry = fetch_user_recs(api_token, limit)
+    if entry is not None:
+        user_recs_cache.set(key, entry, USER_RECS_TTL)
+    return entry
+
+class UserRecsRefresher(BackgroundQueue):
+    # Background queue replacing stale user_recs_cache entries. A key is queued at most once at a
+    # time and refreshes that do not fit in the queue are dropped: the stale entry keeps being
+    # served and the next page view asks again
+    thread_name = 'user-recs'
+    description = 'User recommendations refresh'
+
+    def __init__(self, workers=USER_RECS_REFRESH_WORKERS, queue_size=USER_RECS_REFRESH_QUEUE_SIZE):
+        super().__init__(workers, queue_size)
+
+    def submit(self, api_token, key, limit=RECOMMENDATION_LIMIT):
+        # Queue a refresh of key with the token of the user it belongs to; returns whether it was queued
+        return self.put((api_token, key, limit), key=key)
+
+    def process(self, job):
+        return refresh_user_recs(*job) is not None
+
+# Background refresh queue of per-user recommendations of this worker
+user_recs_refresher = UserRecsRefresher()
+
+@timed
+def get_user_recs(api_token, limit=RECOMMENDATION_LIMIT):
+    # Get recommendations based on user's top tracks. Short-term top tracks change slowly, so results
+    # are cached by user ID (tokens change every hour) and served stale-while-revalidate: entries older
+    # than USER_RECS_REFRESH_AFTER are returned right away and replaced in the background
+    if not is_user_recs_input(api_token, limit):
         return None
+    user_id = get_user_id(api_token)
+    if not user_id:
+        return user_recs_result(fetch_user_recs(api_token, limit))
+    key = user_recs_cache_key(user_id, limit)
+    hit, entry = cached_user_recs(api_token, key, limit)
+    if not hit:
+        entry = cache_flight.do(key, lambda: refresh_user_recs(api_token, key, limit))
+    return user_recs_result(entry)
 
-    # Parse through the json from the response given above to pinpoint the track id's of each song then add them to a string
-    seed_tracks= ""
-    for i in range(0, 5):
-        x = response['items'][i]['id']
-        seed_tracks = str(seed_tracks) + str(x)
-        if i < 4:
-            seed_tracks = str(seed_tracks) + ','
+def is_user_recs_input(api_token, limit):
+    if not api_token:
+        logger.debug("No API token provided")
+        return False
+    if not is_recommendation_limit(limit):
+        logger.info("Recommendation limit must be between 1 and %s", RECOMMENDATION_MAX_LIMIT)
+        return False
+    return True
 
-    # URL Encode the string of tracks to ensure the request will process
-    track_query = urllib.parse.quote(seed_tracks)
-    url = f"{APIURL}/recommendations?limit=5&seed_tracks={track_query}"
-    try:
-        response = make_api_call(url, "GET", headers=headers)
-        if not response:
-            print("ERROR: Response from API request is empty")
-            return None
-        if not response["tracks"][0]:
-            print("ERROR: No track matching search criteria found")
-            return None
-    except ValueError as e:
-        print(f"ERROR: Error in search results: {e}")
-        return None
-
-    recs = ['']  # Will hold the track recommendation results
-    for rec in response['tracks']:
-        # Stores track id, album, artist and album art in dictionary
-        recs_result = {
-            "id": rec["id"],
-            "name": rec["name"],
-            "album": rec["album"]["name"],
-            "artist": rec["artists"][0]["name"],
-            "popularity" : rec["popularity"],
-            "songUrl" : rec["external_urls"]["spotify"],
-            "uri" : rec["uri"]
-        }
-        try:
-            recs_result['imageUrl'] = rec["album"]["images"][0]["url"]
-        except IndexError:
-            recs_result['imageUrl'] = "Image not found"
-        recs.append(recs_result)
-    return recs
+def cached_user_recs(api_token, key, limit):
+    # (hit, entry) of user_recs_cache; stale entries are queued for a refresh in the background
+    hit, entry = user_recs_cache.get(key)
+    record_cache_lookup("user_recs", hit)
+    if hit and is_stale_user_recs(entry):
+        user_recs_refresher.submit(api_token, key, limit)
+    return hit, entry
+
+def user_recs_result(entry):
+    if entry is None:
+        return None
+    return [''] + entry["recs"]  # Insert one null value at index 0 for easier array access in the template
 
+@timed
+@cached("get_related_artists", key=id_cache_key)
 def get_related_artists(api_token, artist_id):
     # Search for artists related to a given input artist and return matching results
-    # artistID can be obtained from the dictionary returned by search_artists()
+    # artistID can be obtained from the Artist returned by search_artists()
+    url = related_artists_url(api_token, artist_id)
+    if url is None:
+        return None
+    response = make_api_call(url, "GET", auth_headers(api_token))
+    missing = missing_related_artists(response)
+    if missing is None:
+        return None
+    hydrated = get_artists(api_token, missing) if missing else {}
+    return parse_related_artists(response, hydrated)
 
+def related_artists_url(api_token, artist_id):
     if not api_token:
-        print("ERROR: No API token provided")
+        logger.debug("No API token provided")
         return None
     if not artist_id:
-        print("ERROR: No artist ID provided")
-
-    headers = {"Authorization": f"Bearer {api_token}"}
-    # Construct the query URL
-    url = f"{APIURL}/artists/{artist_id}/related-artists"
-
-    try:
-        response = make_api_call(url, "GET", headers)
-        if not response:
-            print("ERROR: Response from API request is empty")
-            return None
+        logger.debug("No artist ID provided")
+        return None
+    return f"{get_settings().spotify_api_url}/artists/{artist_id}/related-artists"
 
-        # Check if any artists were found during search
-        if len(response['artists']) == 0:
-            raise ValueError("No search results found!")
-    except ValueError as e:
-        print(f"ERROR: Error in search results: {e}")
+def missing_related_artists(response):
+    # IDs of the simplified artists of a related-artists response, None if it holds no artists.
+    # The related-artists payload already contains full artist objects, so results are built
+    # from it directly. Any simplified entries are hydrated with batched /artists?ids= lookups
+    # rather than one name search per artist (which could also match a different artist)
+    if not response:
+        logger.warning("Response from API request is empty")
         return None
+    # Check if any artists were found during search
+    if len(response['artists']) == 0:
+        logger.info("Error in search results: No search results found!")
+        return None
+    return [a['id'] for a in response['artists'] if not is_full_artist(a) and a.get('id')]
+
+def parse_related_artists(response, hydrated):
+    # Related artists of a response, with simplified artists replaced by the full ones in hydrated
     related_artists = []
     for artist_result in response['artists']:
-        a = search_artists(api_token, artist_result['name'])
-        related_artists.append(a)
+        artist_result = hydrated.get(artist_result.get('id'), artist_result)
+        if not is_full_artist(artist_result):
+            logger.warning("Incomplete artist data for %s", artist_result.get('name'))
+            continue
+        # Keep the search_artists() result shape expected by get_related.html (result at index 1)
+        related_artists.append(['', parse_artist(artist_result)])
+    if not related_artists:
+        return None
+    search_index.add(artist for _, artist in related_artists)
     return related_artists
 
-def get_genius_lyrics(artist_name, track_name):
+# lyricsgenius clients of this worker, see get_genius_client()
+genius_clients = {}
+genius_lock = threading.Lock()
+
+def get_genius_client(genius_token, genius_url=GENIUS_URL):
+    # One lyricsgenius client (and so one kept-alive requests.Session) per token and worker process
+    key = (genius_token, genius_url, os.getpid())
+    with genius_lock:
+        client = genius_clients.get(key)
+        if client is None:
+            client = lyricsgenius.Genius(genius_token, timeout=GENIUS_TIMEOUT, sleep_time=GENIUS_SLEEP_TIME, verbose=False)
+            client.response_format = 'html'
+            client.PUBLIC_API_ROOT = f"{genius_url}api/"
+            client.WEB_ROOT = genius_url
+            client._session.hooks['response'].append(record_genius_response)
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_MAXSIZE)
+            # Both schemes, so a local stand-in (GENIUS_URL=http://...) goes through the same pool
+            client._session.mount('https://', adapter)
+            client._session.mount('http://', adapter)
+            genius_clients.clear()
+            genius_clients[key] = client
+        return client
+
+def record_genius_response(response, *args, **kwargs):
+    # requests response hook recording the calls lyricsgenius makes like make_api_call() calls
+    path = urllib.parse.urlsplit(response.url).path
+    endpoint = "genius:" + (path[path.index("/api/") + 4:] if "/api/" in path else "/{song}")
+    record_upstream_call(endpoint, response.request.method, response.status_code, len(response.content or b""),
+                         response.elapsed.total_seconds(), 0)
+
+def lyrics_cache_key(artist_name, track_name):
+    return f"lyrics:{normalize_query(artist_name)}:{normalize_query(track_name)}"
+
+@timed
+def get_genius_lyrics(artist_name, track_name, settings=None):
     # Retrieve Genius.com lyrics using lyricsgenius package
-    secrets = dotenv.dotenv_values('.env')
-    genius_token = secrets["GENIUS_TOKEN"]
-    genius = lyricsgenius.Genius(genius_token)
-    genius.response_format = 'html'
+    # Results are cached by normalized artist and track name, including songs without lyrics
+    settings = settings or get_settings()
 
     try:
         if not isinstance(artist_name, str):
@@ -441,112 +2589,192 @@ def get_genius_lyrics(artist_name, track_name):
             raise TypeError("Invalid track name type. Make sure track name is a string.")
         if not artist_name:
             raise ValueError("No artist name included in search")
-        if track_name:
-            song = genius.search_song(track_name, artist_name)
-        else:
+        if not track_name:
             raise ValueError("No track name included in search")
+
+        key = lyrics_cache_key(artist_name, track_name)
+        hit, lyrics = lyrics_cache.get(key)
+        record_cache_lookup("lyrics", hit)
+        if hit:
+            return lyrics or None
+        genius = get_genius_client(settings.genius_token, settings.genius_url)
+        song = genius.search_song(track_name, artist_name)
         if song:
             lyrics = song.lyrics
             lyrics = lyrics.split('\n')
             lyrics = '\n'.join(lyrics[1:])
+            lyrics_cache.set(key, lyrics, LYRICS_TTL)
             return lyrics
         else:
+            lyrics_cache.set(key, "", LYRICS_MISS_TTL)
             return None
     except ValueError as e:
-        print(f'ERROR: {e}')
+        logger.debug("Invalid lyrics search: %s", e)
         return None
     except AttributeError as e:
-        print(f'ERROR: Invalid input artist/track. {e}')
+        logger.debug("Invalid input artist/track. %s", e)
         return None
     except TypeError as e:
-        print(f'ERROR: {e}')
+        logger.debug("Invalid lyrics search: %s", e)
         return None
 
+class ForegroundTracker:
+    # Counts the user-facing requests currently being served by this worker (see app.py hooks)
+    def __init__(self):
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.active += 1
+
+    def exit(self):
+        with self._lock:
+            self.active = max(self.active - 1, 0)
+
+class LyricsPrefetcher(BackgroundQueue):
+    # Low-priority background queue warming lyrics_cache for tracks a user has just been shown.
+    # Admission control keeps it from competing with foreground requests: tracks are dropped when
+    # the queue is full or the worker is busy, and each queued track is checked again before it is
+    # fetched.
+    thread_name = 'prefetch'
+    description = 'Lyrics prefetch'
+
+    def __init__(self, workers=PREFETCH_WORKERS, queue_size=PREFETCH_QUEUE_SIZE,
+                 max_foreground=PREFETCH_MAX_FOREGROUND, enabled=LYRICS_PREFETCH):
+        super().__init__(workers, queue_size)
+        self.max_foreground = max_foreground
+        self.enabled = enabled
+
+    def busy(self):
+        return foreground.active > self.max_foreground
+
+    def submit(self, tracks):
+        # tracks is a list of (artist name, track name) pairs; returns how many were queued
+        if not self.enabled or not tracks:
+            return 0
+        queued = 0
+        for artist_name, track_name in tracks:
+            if not artist_name or not track_name:
+                continue
+            if self.busy():
+                self.dropped += 1
+                continue
+            key = lyrics_cache_key(artist_name, track_name)
+            if lyrics_cache.get(key)[0]:
+                continue
+            queued += self.put((artist_name, track_name), key=key)
+        return queued
+
+    def process(self, job):
+        if self.busy():
+            self.dropped += 1
+            return False
+        get_genius_lyrics(*job)
+        return True
+
+# Foreground request counter and lyrics prefetch queue of this worker
+foreground = ForegroundTracker()
+lyrics_prefetcher = LyricsPrefetcher()
+
+def prefetch_lyrics(tracks):
+    # Queue lyrics of result tracks (Track models) for background fetching
+    if not tracks:
+        return 0
+    return lyrics_prefetcher.submit([(track["artist"], track["name"]) for track in tracks if track])
+
+@timed
+@cached("get_artist_releases", key=releases_cache_key)
 def get_artist_releases(api_token, artist):
-    # Query all artist releases
-    # artist should be an artist dictionary returned from searchArtists()
+    # Query all artist releases, following pagination through the whole discography
+    # artist should be an Artist returned from search_artists()
+    artist_id = releases_artist_id(api_token, artist)
+    if not artist_id:
+        return None
+    releases = list(iter_artist_releases(api_token, artist_id))
+    if not releases:
+        return None
+    return releases
+
+def stream_artist_releases(api_token, artist):
+    # Streaming mode of get_artist_releases() for templates that render as pages arrive.
+    # Returns the cached release list if there is one, otherwise a generator fetching one page at a
+    # time that adds the whole list to the cache once it has been read to the end
+    artist_id = releases_artist_id(api_token, artist)
+    if not artist_id:
+        return None
+    cache_key = catalog_cache_key("get_artist_releases", artist_id)
+    hit, releases = response_cache.get(cache_key)
+    record_cache_lookup("get_artist_releases", hit)
+    if hit:
+        return releases
+    return cache_streamed_releases(cache_key, iter_artist_releases(api_token, artist_id))
+
+def cache_streamed_releases(cache_key, releases):
+    # Pass releases on as they arrive and store the collected list under cache_key, where
+    # get_artist_releases() stores it, when the last one has been passed on. Nothing is stored when the
+    # caller stops early or there are no releases. Discographies longer than STREAM_CACHE_MAX_RELEASES
+    # are not collected at all and keep being streamed from the API, so memory stays bounded
+    collected = []
+    for release in releases:
+        if collected is not None:
+            collected.append(release)
+            if len(collected) > STREAM_CACHE_MAX_RELEASES:
+                collected = None
+        yield release
+    if collected:
+        response_cache.set("get_artist_releases", cache_key, collected)
+
+def releases_artist_id(api_token, artist):
+    # Validate the inputs of get_artist_releases() and return the artist ID, or None if invalid
     try:
         if not artist:
-            raise ValueError("ERROR: No artist dictionary provided")
+            raise ValueError("ERROR: No artist provided")
         if not api_token:
             raise ValueError("ERROR: No API token provided")
-        artist_id = artist['id']
+        return artist['id']
     except KeyError:
-        print("ERROR: No artist ID found. Ensure you are passing a valid artist dictionary object from searchArtist()")
+        logger.debug("No artist ID found. Ensure you are passing an Artist from search_artists()")
         return None
     except TypeError:
-        print("ERROR: Input artist is not a valid artist dictionary.")
+        logger.debug("Input artist is not a valid Artist.")
         return None
     except ValueError:
         return None
 
-    headers = {"Authorization": f"Bearer {api_token}"}
-    url = f"{APIURL}/artists/{artist_id}/albums?limit=50"
+def iter_artist_releases(api_token, artist_id, prefetch=True):
+    # Generator yielding every release of an artist, page by page (see iter_pages)
+    for page in iter_pages(api_token, artist_releases_url(artist_id), prefetch=prefetch):
+        releases = parse_releases_page(page)
+        if releases is None:
+            return
+        yield from releases
 
-    try:
-        response = make_api_call(url, "GET", headers=headers)
-        if not response:
-            print("ERROR: Response from API request is empty")
-            return None
-        # Check if any releases were found during search
-        if response['total'] == 0:
-            raise ValueError("No releases found for this artist!")
-    except ValueError as e:
-        print(f"ERROR: Error in search results: {e}")
-        return None
-
-    releases = []
-    for release in response['items']:
-        releaseItem = {
-            "type": release["album_group"],
-            "url": release["external_urls"]["spotify"],
-            "album_id": release["id"],
-            "album_artists": [a for a in release['artists']],
-            "title": release["name"],
-            "release_date": release["release_date"],
-            "tracks": release["total_tracks"]
-        }
-        try:
-            releaseItem["cover_image"] = release["images"][0]["url"]
-        except IndexError:
-            releaseItem["cover_image"] = "Image not found"
-        finally:
-            releases.append(releaseItem)
-    return releases
+def artist_releases_url(artist_id):
+    return f"{get_settings().spotify_api_url}/artists/{artist_id}/albums?limit={RELEASES_PAGE_SIZE}&market={DEFAULT_MARKET}"
+
+def parse_releases_page(page):
+    # Releases of a page of artist albums, None when the artist has none
+    # Check if any releases were found during search
+    if page.get('total') == 0:
+        logger.info("Error in search results: No releases found for this artist!")
+        return None
+    return [parse_release(release) for release in page.get('items', [])]
 
+@timed
+@cached("get_new_album_releases", key=new_releases_cache_key)
 def get_new_album_releases(api_token):
     if not api_token:
-        print("ERROR: No API token provided.")
+        logger.debug("No API token provided.")
         return None
     # Query new albums and return top 10 results
-  
-    headers = {"Authorization": f"Bearer {api_token}"}
-    url = f"{APIURL}/browse/new-releases?limit=10"
+    return parse_new_releases(make_api_call(new_releases_url(), "GET", headers=auth_headers(api_token)))
 
-    try:
-        response = make_api_call(url, "GET", headers=headers)
-        if not response:
-            print("ERROR: Response from API request is empty")
-            return None
-    except ValueError as e:
-        print(f"ERROR: Error in search results: {e}")
-        return None
-    
-    new_albums = []
-    for albums in response['albums']['items']:
-        album_items = {
-            "uri" : albums["uri"],
-            "url" : albums["external_urls"]["spotify"],
-            "album_type" : albums["album_type"],
-            "total_tracks" : albums["total_tracks"],
-            "name" : albums["name"],
-            "release_date": albums["release_date"],
-            "imageUrl" : albums["images"][0]
-        }
-        try:
-            albums["imageUrl"] = albums["images"][1]
-        except IndexError:
-            albums["imageUrl"] = "Image not found"
-        finally:
-            new_albums.append(album_items)
-    return new_albums
+def new_releases_url():
+    return f"{get_settings().spotify_api_url}/browse/new-releases?country={DEFAULT_MARKET}&limit=10"
+
+def parse_new_releases(response):
+    if not response:
+        logger.warning("Response from API request is empty")
+        return None
+    return [parse_new_album(album) for album in response['albums']['items']]
@@ -0,0 +1,521 @@
+import asyncio
+import atexit
+import contextvars
+import functools
+import os
+import threading
+import time
+import urllib.parse
+import weakref
+import httpx
+import spotufy
+from spotufy import (auth_headers, artist_releases_url, artists_urls, backoff_delay, cached_user_id,
+                     cached_user_recs, catalog_cache_key, decode_response, endpoint_template, id_cache_key,
+                     indexed_artist, is_artist_name, is_playlist_input, is_song_input, is_track_recs_input,
+                     is_user_recs_input, known_song_details, known_track_id, known_track_ids, logger,
+                     missing_related_artists, name_cache_key, new_releases_cache_key, new_releases_url,
+                     parse_artists, parse_new_releases, parse_recommendations, parse_related_artists,
+                     parse_releases_page, parse_search_artists, parse_top_tracks, parse_track,
+                     parse_track_details, parse_user_seeds, playlist_request, playlist_tracks_requests,
+                     recommendation_cache_key, recommendations_url, record_cache_lookup,
+                     record_upstream_call, related_artists_url, releases_artist_id, releases_cache_key,
+                     resolved_track_ids, retry_after_seconds, search_artists_url, search_track_url,
+                     store_search_track, store_user_id, timed, top_tracks_url, track_id_cache_key,
+                     track_url, user_recs_cache_key, user_recs_entry, user_recs_result, user_seeds_url,
+                     RECOMMENDATION_LIMIT)
+
+# Async variant of the spotufy client API. The feature functions have the same names, arguments and
+# return values as their counterparts in spotufy.py, but are coroutines running on httpx's
+# non-blocking client, so a single thread can keep many upstream requests in flight at once.
+# Caches, rate limiters, circuit breakers, input validation, request building and response parsing
+# are shared with spotufy.py: the feature functions here only await the upstream calls in between,
+# so both variants send the same requests, return the same results and can be used side by side in
+# the same worker.
+
+# Maximum number of connections (and so in-flight upstream requests) of the async client per worker
+ASYNC_MAX_CONNECTIONS = int(os.environ.get('SPOTUFY_ASYNC_MAX_CONNECTIONS', 200))
+
+
+################ Core Functions ################
+
+class AsyncHTTPTransport:
+    # Pooled httpx.AsyncClient shared by all coroutines of an event loop. httpx clients are bound to
+    # the loop they are first used on, so one client is kept per loop.
+    def __init__(self, max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive=spotufy.POOL_MAXSIZE,
+                 timeout=(spotufy.CONNECT_TIMEOUT, spotufy.READ_TIMEOUT)):
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        self._clients = weakref.WeakKeyDictionary()
+
+    def client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = self._clients[loop] = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return client
+
+    async def request(self, method, url, **kwargs):
+        return await self.client().request(method, url, **kwargs)
+
+    async def close(self):
+        # Close the client of the running loop; a new one is created on next use
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+# Transport shared by all async feature functions of this worker
+transport = AsyncHTTPTransport()
+
+class EventLoopRunner:
+    # Event loop running in a daemon thread of each worker process. Synchronous code and per-request
+    # event loops (such as the one Flask creates for every async view) hand their coroutines to this
+    # loop, so all requests of a worker share one connection pool that outlives the request.
+    def __init__(self):
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def loop(self):
+        pid = os.getpid()
+        if self._loop is None or self._pid != pid:
+            with self._lock:
+                if self._loop is None or self._pid != pid:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name='spotufy-async', daemon=True).start()
+                    self._loop = loop
+                    self._pid = pid
+        return self._loop
+
+    def submit(self, coro):
+        # Schedule a coroutine on the shared loop. It runs with the caller's context variables, so
+        # its upstream calls are recorded in the trace of the request that scheduled it
+        return asyncio.run_coroutine_threadsafe(in_context(contextvars.copy_context(), coro), self.loop())
+
+    def run(self, coro, timeout=None):
+        # Run a coroutine on the shared loop and block until its result is available
+        return self.submit(coro).result(timeout)
+
+    async def call(self, coro):
+        # Await a coroutine running on the shared loop from another event loop
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def close(self):
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid():
+                loop = self._loop
+                asyncio.run_coroutine_threadsafe(transport.close(), loop).result(5)
+                loop.call_soon_threadsafe(loop.stop)
+            self._loop = None
+            self._pid = None
+
+async def in_context(context, coro):
+    # Tasks copy the context of the thread creating them, which for the shared loop is its own
+    # thread; apply the scheduling thread's context variables instead
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+# Background loop shared by all requests of this worker
+runner = EventLoopRunner()
+atexit.register(runner.close)
+
+def run(coro, timeout=None):
+    # Convenience wrapper around the shared runner, see EventLoopRunner.run()
+    return runner.run(coro, timeout)
+
+class AsyncSingleFlight:
+    # Deduplicates identical concurrent coroutine calls on the same event loop, like
+    # spotufy.SingleFlight does for threads
+    def __init__(self):
+        self._calls = {}
+        self.shared = 0
+
+    async def do(self, key, func):
+        key = (asyncio.get_running_loop(), key)
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared += 1
+            # shield() keeps one cancelled waiter from cancelling the call for everyone else
+            return await asyncio.shield(call)
+        call = self._calls[key] = asyncio.ensure_future(func())
+        try:
+            return await asyncio.shield(call)
+        finally:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+# Single-flight groups for upstream requests and for cached catalog lookups
+api_flight = AsyncSingleFlight()
+cache_flight = AsyncSingleFlight()
+
+async def fan_out(calls, max_concurrency=spotufy.FANOUT_CONCURRENCY, deadline=spotufy.FANOUT_DEADLINE):
+    # Run a list of zero-argument coroutine functions concurrently and return their results in the
+    # same order. At most max_concurrency calls run at once; calls that raise or are still unfinished
+    # when the deadline (in seconds) passes yield None. See spotufy.FanOutExecutor.run()
+    results = [None] * len(calls)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_call(index, call):
+        async with semaphore:
+            try:
+                results[index] = await call()
+            except Exception as e:
+                logger.error("Upstream call failed: %s", e)
+
+    tasks = [asyncio.ensure_future(run_call(index, call)) for index, call in enumerate(calls)]
+    if not tasks:
+        return results
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    if pending:
+        logger.warning("Fan-out deadline of %ss exceeded, cancelling %s call(s)", deadline, len(pending))
+        for task in pending:
+            task.cancel()
+    return results
+
+async def make_api_call(url, method, headers=None, payload=None):
+    # Async counterpart of spotufy.make_api_call()
+    # Identical concurrent GET requests (same URL and same credentials) share a single upstream call
+    if method.upper() == "GET":
+        authorization = (headers or {}).get("Authorization")
+        return await api_flight.do((url, authorization), lambda: send_api_request(url, method, headers, payload))
+    return await send_api_request(url, method, headers, payload)
+
+async def send_api_request(url, method, headers=None, payload=None):
+    # Async counterpart of spotufy.send_api_request(), with the same rate limiting, retry and circuit
+    # breaking behaviour. Waits are awaited instead of blocking the thread.
+    limiter = spotufy.get_rate_limiter()
+    breaker = spotufy.get_circuit_breaker(url)
+    idempotent = method.upper() in ("GET", "HEAD", "PUT", "DELETE")
+    started = time.perf_counter()
+    status, size, attempt = None, 0, 0
+    try:
+        for attempt in range(spotufy.MAX_RETRIES + 1):
+            last_attempt = attempt == spotufy.MAX_RETRIES
+            status, size = None, 0
+            if not breaker.allow():
+                logger.warning("Circuit open for %s, not sending request", urllib.parse.urlparse(url).netloc)
+                return None
+            while wait := limiter.reserve():
+                if wait > spotufy.MAX_RETRY_AFTER:
+                    logger.warning("Rate limited by API, not sending request")
+                    return None
+                await asyncio.sleep(wait)
+            try:
+                response = await transport.request(method, url, headers=headers, content=payload)
+            except (httpx.UnsupportedProtocol, httpx.InvalidURL) as e:
+                breaker.release()
+                logger.error("Missing schema info. Ensure the URL is valid: %s", e)
+                return None
+            except httpx.TransportError as e:
+                breaker.record_failure()
+                if idempotent and not last_attempt:
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+                logger.error("API request failed: %s", e)
+                return None
+            except httpx.HTTPError as e:
+                # Undecodable bodies, redirect loops and the like, see spotufy.send_api_request()
+                breaker.record_failure()
+                logger.error("API request failed: %s", e)
+                return None
+
+            status, size = response.status_code, len(response.content)
+            if response.status_code == 429:
+                delay = retry_after_seconds(response)
+                limiter.pause(delay)
+                if not last_attempt and delay <= spotufy.MAX_RETRY_AFTER:
+                    continue
+                logger.warning("Rate limited by API, retry after %ss", delay)
+                return None
+            if response.status_code >= 500:
+                breaker.record_failure()
+                if idempotent and not last_attempt:
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+            else:
+                breaker.record_success()
+
+            try:
+                response.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                logger.error("Error in API response code: %s", e)
+                return None
+            return decode_response(response.content)
+        return None
+    finally:
+        record_upstream_call(endpoint_template(url), method, status, size, time.perf_counter() - started, attempt)
+
+def caches_block():
+    # Whether any of the spotufy caches lives outside the process (SQLite, Redis)
+    return any(cache.blocking for cache in (spotufy.response_cache, spotufy.track_id_cache,
+                                            spotufy.user_recs_cache, spotufy.user_id_cache))
+
+async def cache_io(func, *args):
+    # Call a function reading or writing the spotufy caches. Backends outside the process block on
+    # I/O (a locked SQLite database for up to its busy timeout, Redis on its socket), which on the
+    # shared loop would stall every upstream request of the worker, so they are called from a thread
+    if caches_block():
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+def cached(endpoint, key):
+    # Async counterpart of spotufy.cached(). Results are stored in spotufy.response_cache under the
+    # same keys, so the sync and async variants of a feature function share cached results.
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            query = key(*args, **kwargs)
+            if query is None:
+                return await func(*args, **kwargs)
+            cache_key = catalog_cache_key(endpoint, query)
+            hit, value = await cache_io(spotufy.response_cache.get, cache_key)
+            record_cache_lookup(endpoint, hit)
+            if hit:
+                return value
+
+            async def lookup():
+                value = await func(*args, **kwargs)
+                if value is not None:
+                    await cache_io(spotufy.response_cache.set, endpoint, cache_key, value)
+                return value
+            return await cache_flight.do(cache_key, lookup)
+        return wrapper
+    return decorator
+
+async def get_user_id(api_token):
+    # Async counterpart of spotufy.get_user_id(), sharing its cache
+    hit, user_id = await cache_io(cached_user_id, api_token)
+    if hit:
+        return user_id
+    response = await make_api_call(f"{spotufy.get_settings().spotify_api_url}/me", "GET", headers=auth_headers(api_token))
+    return await cache_io(store_user_id, api_token, response)
+
+async def get_artists(api_token, artist_ids):
+    # Async counterpart of spotufy.get_artists(): chunked /artists?ids= lookups run concurrently
+    headers = auth_headers(api_token)
+    responses = await fan_out([lambda url=url: make_api_call(url, "GET", headers) for url in artists_urls(artist_ids)])
+    return parse_artists(responses)
+
+async def iter_pages(api_token, url, prefetch=True, max_pages=None):
+    # Async generator counterpart of spotufy.iter_pages(). With prefetch, the next page is requested
+    # in a task while the caller processes the current one.
+    headers = auth_headers(api_token)
+    max_pages = spotufy.MAX_PAGES if max_pages is None else max_pages
+    page = await make_api_call(url, "GET", headers=headers)
+    if not page:
+        logger.warning("Response from API request is empty")
+        return
+    pending = None
+    try:
+        for count in range(1, max_pages + 1):
+            next_url = page.get('next') if count < max_pages else None
+            if prefetch and next_url:
+                pending = asyncio.ensure_future(make_api_call(next_url, "GET", headers))
+            yield page
+            if not next_url:
+                return
+            page = await pending if pending else await make_api_call(next_url, "GET", headers=headers)
+            pending = None
+            if not page:
+                logger.warning("Response from API request is empty")
+                return
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+@timed
+async def create_playlist(api_token, playlist_name, track_list):
+    if not is_playlist_input(api_token, playlist_name, track_list):
+        return None
+    headers = auth_headers(api_token, **{"Content-Type": "application/json"})
+    user_id = await get_user_id(api_token)
+    if not user_id:
+        return None
+
+    url, payload = playlist_request(user_id, playlist_name)
+    response = await make_api_call(url, "POST", headers, payload)
+    if not response:
+        return None
+    playlist_id = response["id"]
+    play_url = response["external_urls"]["spotify"]
+
+    # Chunks are appended in order, see spotufy.create_playlist()
+    url, track_payloads = playlist_tracks_requests(playlist_id, track_list)
+    for track_payload in track_payloads:
+        response = await make_api_call(url, "POST", headers, track_payload)
+        if not response:
+            return None
+    return play_url
+
+
+################ Feature Functions ################
+
+@timed
+@cached("search_artists", key=name_cache_key)
+async def search_artists(api_token, input_artist):
+    url = search_artists_url(input_artist)
+    if url is None:
+        return None
+    return parse_search_artists(await make_api_call(url, "GET", auth_headers(api_token)))
+
+async def resolve_artist(api_token, name):
+    # Artist for an artist name, see spotufy.resolve_artist()
+    artist = indexed_artist(name)
+    if artist is not None:
+        return artist
+    artists = await search_artists(api_token, name)
+    return artists[1] if artists else None
+
+@timed
+@cached("get_top_tracks", key=name_cache_key)
+async def get_top_tracks(api_token, artist_name):
+    if not is_artist_name(artist_name):
+        return None
+    artist = await resolve_artist(api_token, artist_name)
+    if artist is None:
+        logger.info("Artist was not found.")
+        return None
+    return parse_top_tracks(await make_api_call(top_tracks_url(artist.id), "GET", headers=auth_headers(api_token)))
+
+@timed
+async def search_song_details(api_token, track, artist):
+    # Return information about a given track, see spotufy.search_song_details()
+    if not is_song_input(api_token, track, artist):
+        return None
+    known, details = await cache_io(known_song_details, track, artist)
+    if known:
+        return details
+    if details is not None:
+        return await get_track(api_token, details)
+    found = await search_track(api_token, track, artist)
+    if found is None:
+        return None
+    return parse_track_details(found)
+
+@timed
+@cached("get_track", key=id_cache_key)
+async def get_track(api_token, track_id):
+    # Details of a track by Spotify ID, see spotufy.get_track()
+    if not api_token or not track_id:
+        logger.debug("No API token or track ID provided")
+        return None
+    return parse_track(await make_api_call(track_url(track_id), "GET", headers=auth_headers(api_token)))
+
+@timed
+@cached("get_recommendations", key=recommendation_cache_key)
+async def get_recommendations(api_token, tracks=(), artists=(), genres=(), limit=RECOMMENDATION_LIMIT):
+    # Recommended tracks for up to RECOMMENDATION_MAX_SEEDS seeds, see spotufy.get_recommendations()
+    url = recommendations_url(api_token, tracks, artists, genres, limit)
+    if url is None:
+        return None
+    return parse_recommendations(await make_api_call(url, "GET", headers=auth_headers(api_token)))
+
+async def search_track(api_token, track, artist):
+    # Search for a (track, artist) pair and cache the track ID, see spotufy.search_track()
+    key = track_id_cache_key(track, artist)
+    url = search_track_url(track, artist)
+
+    async def lookup():
+        response = await make_api_call(url, "GET", auth_headers(api_token))
+        return await cache_io(store_search_track, key, response)
+    return await cache_flight.do(key, lookup)
+
+async def resolve_track_id(api_token, track, artist):
+    # Spotify ID of a track by track and artist name, see spotufy.resolve_track_id()
+    known, track_id = await cache_io(known_track_id, track, artist)
+    if known:
+        return track_id
+    found = await search_track(api_token, track, artist)
+    return found["id"] if found else None
+
+async def resolve_track_ids(api_token, pairs):
+    # Bulk form of resolve_track_id(), see spotufy.resolve_track_ids()
+    keys, resolved, pending = await cache_io(known_track_ids, api_token, pairs)
+    results = await fan_out([lambda pair=pair: search_track(api_token, *pair) for pair in pending.values()])
+    return resolved_track_ids(keys, resolved, pending, results)
+
+@timed
+async def get_track_recs(api_token, track, artist, limit=RECOMMENDATION_LIMIT):
+    # Get a list of recommended tracks based on a single input track
+    if not is_track_recs_input(api_token, track, artist):
+        return None
+    track_id = await resolve_track_id(api_token, track, artist)
+    if not track_id:
+        return None
+    return await get_recommendations(api_token, tracks=(track_id,), limit=limit)
+
+async def fetch_user_recs(api_token, limit=RECOMMENDATION_LIMIT):
+    # Fetch a user's top tracks and the recommendations based on them, see spotufy.fetch_user_recs()
+    seed_tracks = parse_user_seeds(await make_api_call(user_seeds_url(), "GET", headers=auth_headers(api_token)))
+    if seed_tracks is None:
+        return None
+    return user_recs_entry(seed_tracks, await get_recommendations(api_token, tracks=seed_tracks, limit=limit))
+
+async def refresh_user_recs(api_token, key, limit=RECOMMENDATION_LIMIT):
+    entry = await fetch_user_recs(api_token, limit)
+    if entry is not None:
+        await cache_io(spotufy.user_recs_cache.set, key, entry, spotufy.USER_RECS_TTL)
+    return entry
+
+@timed
+async def get_user_recs(api_token, limit=RECOMMENDATION_LIMIT):
+    # Recommendations based on the user's top tracks, cached by user ID and served
+    # stale-while-revalidate, see spotufy.get_user_recs(). Stale entries are refreshed by the
+    # background threads of spotufy.user_recs_refresher
+    if not is_user_recs_input(api_token, limit):
+        return None
+    user_id = await get_user_id(api_token)
+    if not user_id:
+        return user_recs_result(await fetch_user_recs(api_token, limit))
+    key = user_recs_cache_key(user_id, limit)
+    hit, entry = await cache_io(cached_user_recs, api_token, key, limit)
+    if not hit:
+        entry = await cache_flight.do(key, lambda: refresh_user_recs(api_token, key, limit))
+    return user_recs_result(entry)
+
+@timed
+@cached("get_related_artists", key=id_cache_key)
+async def get_related_artists(api_token, artist_id):
+    # Search for artists related to a given input artist, see spotufy.get_related_artists()
+    url = related_artists_url(api_token, artist_id)
+    if url is None:
+        return None
+    response = await make_api_call(url, "GET", auth_headers(api_token))
+    missing = missing_related_artists(response)
+    if missing is None:
+        return None
+    hydrated = await get_artists(api_token, missing) if missing else {}
+    return parse_related_artists(response, hydrated)
+
+async def get_genius_lyrics(artist_name, track_name, settings=None):
+    # lyricsgenius only has a blocking client, so lookups run in a worker thread
+    return await asyncio.to_thread(spotufy.get_genius_lyrics, artist_name, track_name, settings)
+
+@timed
+@cached("get_artist_releases", key=releases_cache_key)
+async def get_artist_releases(api_token, artist):
+    # Query all artist releases, following pagination through the whole discography
+    artist_id = releases_artist_id(api_token, artist)
+    if not artist_id:
+        return None
+    releases = [release async for release in iter_artist_releases(api_token, artist_id)]
+    if not releases:
+        return None
+    return releases
+
+async def iter_artist_releases(api_token, artist_id, prefetch=True):
+    # Async generator yielding every release of an artist, page by page (see iter_pages)
+    async for page in iter_pages(api_token, artist_releases_url(artist_id), prefetch=prefetch):
+        releases = parse_releases_page(page)
+        if releases is None:
+            return
+        for release in releases:
+            yield release
+
+@timed
+@cached("get_new_album_releases", key=new_releases_cache_key)
+async def get_new_album_releases(api_token):
+    if not api_token:
+        logger.debug("No API token provided.")
+        return None
+    return parse_new_releases(await make_api_call(new_releases_url(), "GET", headers=auth_headers(api_token)))
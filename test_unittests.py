@@ -1,14 +1,43 @@
 import unittest
+import asyncio
+import atexit
+import dataclasses
+import http.server
+import httpx
+import json
+import logging
+import logging.handlers
+import io
+import os
+import socketserver
+import sqlite3
+import tempfile
+import threading
+import time
 import requests
 import werkzeug.wrappers.response
 
 import spotufy
-from unittest.mock import patch
-
-class make_api_call_test(unittest.TestCase):
+import spotufy_async
+import batch
+import benchmark
+from fake_upstream import FakeUpstreamServer
+from unittest.mock import AsyncMock, patch
+
+class SpotufyTestCase(unittest.TestCase):
+    """Base test case; clears worker-level caches and circuit breakers so state does not leak between tests"""
+    def setUp(self):
+        spotufy.clear_caches()
+        spotufy.circuit_breakers.clear()
+        # No background refresh may outlive the mocks of the test that queued it
+        spotufy.user_recs_refresher.clear()
+        spotufy.user_recs_refresher.queue.join()
+
+
+class make_api_call_test(SpotufyTestCase):
     """Test module to test API call function in `spotufy.py`"""
 
-    @patch('spotufy.requests.request')
+    @patch('spotufy.requests.Session.request')
     def test_valid_return(self, mock_request):
         """Function should return a JSON object if given valid input"""
         response_object = requests.Response()
@@ -22,7 +51,7 @@ class make_api_call_test(unittest.TestCase):
         response = spotufy.make_api_call(url, "GET", headers)
         self.assertIsInstance(response, dict)
 
-    @patch('spotufy.requests.request', side_effect=requests.exceptions.HTTPError(401))
+    @patch('spotufy.requests.Session.request', side_effect=requests.exceptions.HTTPError(401))
     def test_HTTP_error_return(self, mock_request):
         """Function should return None if an HTTP status code is raised"""
         # Invalid url, should raise a 401 error and return None
@@ -32,19 +61,588 @@ class make_api_call_test(unittest.TestCase):
         response = spotufy.make_api_call(url, "GET", headers)
         self.assertTrue(response is None)
 
+    @patch('spotufy.BACKOFF_BASE', 0.001)
+    @patch('spotufy.requests.Session.request', side_effect=requests.exceptions.Timeout("timed out"))
+    def test_timeout_return(self, mock_request):
+        """Function should return None if the upstream request times out"""
+        url = "https://api.spotify.com/v1/tracks/11dFghVXANMlKmJXsNCbNl"
+        response = spotufy.make_api_call(url, "GET", {"Authorization": "Bearer abcdefg"})
+        self.assertTrue(response is None)
+        self.assertEqual(mock_request.call_count, spotufy.MAX_RETRIES + 1)
+
+
+class http_transport_test(SpotufyTestCase):
+    """Test module to test the shared HTTP transport in `spotufy.py`"""
+
+    def test_session_reused(self):
+        """The same pooled session should be returned for every call within a worker"""
+        transport = spotufy.HTTPTransport(pool_connections=1, pool_maxsize=2)
+        self.assertIs(transport.session(), transport.session())
+        adapter = transport.session().get_adapter("https://api.spotify.com")
+        self.assertEqual(adapter._pool_maxsize, 2)
+        transport.close()
+
+    @patch('spotufy.requests.Session.request')
+    def test_default_timeout(self, mock_request):
+        """Requests should be sent with the configured timeout unless one is given"""
+        transport = spotufy.HTTPTransport(timeout=(1, 2))
+        transport.request("GET", "https://api.spotify.com/v1/me")
+        self.assertEqual(mock_request.call_args.kwargs["timeout"], (1, 2))
+        transport.close()
+
+    def test_close_and_stats(self):
+        """Closing the transport should drop the session; stats should be zero before any request"""
+        transport = spotufy.HTTPTransport()
+        session = transport.session()
+        self.assertEqual(transport.stats(), {"requests": 0, "connections": 0, "reused": 0})
+        transport.close()
+        self.assertIsNot(transport.session(), session)
+        transport.close()
+
+
+class response_cache_test(SpotufyTestCase):
+    """Test module to test the catalog response cache in `spotufy.py`"""
+
+    def test_ttl_expiry(self):
+        """Entries should expire once their endpoint TTL has passed"""
+        cache = spotufy.ResponseCache(ttls={"search_artists": 0.01})
+        cache.set("search_artists", "key", ["value"])
+        self.assertEqual(cache.get("key"), (True, ["value"]))
+        time.sleep(0.02)
+        self.assertEqual(cache.get("key"), (False, None))
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_lru_eviction_by_entries(self):
+        """The least recently used entry should be evicted once max_entries is reached"""
+        cache = spotufy.ResponseCache(spotufy.MemoryCacheBackend(max_entries=2), ttls={"e": 60})
+        cache.set("e", "a", 1)
+        cache.set("e", "b", 2)
+        cache.get("a")
+        cache.set("e", "c", 3)
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("a"), (True, 1))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_lru_eviction_by_bytes(self):
+        """Entries should be evicted once max_bytes is exceeded; oversized values are not stored"""
+        cache = spotufy.ResponseCache(spotufy.MemoryCacheBackend(max_bytes=15), ttls={"e": 60})
+        cache.set("e", "a", "x" * 8)
+        cache.set("e", "b", "y" * 8)
+        self.assertEqual(cache.get("a"), (False, None))
+        self.assertEqual(cache.get("b"), (True, "y" * 8))
+        cache.set("e", "c", "z" * 50)
+        self.assertEqual(cache.get("c"), (False, None))
+        self.assertLessEqual(cache.stats()["bytes"], 15)
+
+    @patch('spotufy.make_api_call')
+    def test_search_artists_cached(self, api_response):
+        """Repeated searches for the same normalized artist should cost a single upstream call"""
+        api_response.return_value = {
+            "artists": {"total": 1, "items": [get_related_artists_test.full_artist]}
+        }
+        first = spotufy.search_artists("token", "Josh Lowe")
+        second = spotufy.search_artists("other token", "  josh lowe!")
+        self.assertEqual(first, second)
+        self.assertEqual(api_response.call_count, 1)
+        self.assertEqual(spotufy.response_cache.stats()["hits"], 1)
+
+    @patch('spotufy.make_api_call')
+    def test_failed_lookup_not_cached(self, api_response):
+        """None results should not be cached"""
+        api_response.return_value = None
+        spotufy.get_new_album_releases("token")
+        spotufy.get_new_album_releases("token")
+        self.assertEqual(api_response.call_count, 2)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Minimal Redis-protocol stand-in supporting the commands used by RedisCacheBackend"""
+    store = {}
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def bulk(self, value):
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def handle(self):
+        while (args := self.read_command()) is not None:
+            command = args[0].upper()
+            if command == b"GET":
+                entry = self.store.get(args[1])
+                if entry and entry[1] <= time.time():
+                    del self.store[args[1]]
+                    entry = None
+                self.wfile.write(self.bulk(entry[0] if entry else None))
+            elif command == b"SET":
+                self.store[args[1]] = (args[2], time.time() + int(args[4]) / 1000)
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"DEL":
+                removed = sum(self.store.pop(key, None) is not None for key in args[1:])
+                self.wfile.write(b":%d\r\n" % removed)
+            elif command == b"KEYS":
+                prefix = args[1].rstrip(b"*")
+                keys = [key for key in self.store if key.startswith(prefix)]
+                self.wfile.write(b"*%d\r\n" % len(keys) + b"".join(self.bulk(key) for key in keys))
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+class cache_backend_test(SpotufyTestCase):
+    """Test module to test the pluggable cache backends in `spotufy.py`"""
+
+    def check_backend(self, backend):
+        backend.clear()
+        self.assertEqual(backend.get("a"), (False, None))
+        backend.set("a", [{"name": "Josh Lowe"}], 60)
+        self.assertEqual(backend.get("a"), (True, [{"name": "Josh Lowe"}]))
+        backend.set("b", "expires", 0.01)
+        time.sleep(0.02)
+        self.assertEqual(backend.get("b"), (False, None))
+        backend.delete("a")
+        self.assertEqual(backend.get("a"), (False, None))
+
+    def test_memory_backend(self):
+        """The in-process backend should store, expire and delete values"""
+        self.check_backend(spotufy.create_cache_backend("memory://"))
+
+    def test_sqlite_backend_shared(self):
+        """The SQLite backend should store values visible to every instance using the same file"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.db")
+            backend = spotufy.create_cache_backend(f"sqlite:///{path}")
+            self.assertIsInstance(backend, spotufy.SQLiteCacheBackend)
+            self.check_backend(backend)
+            backend.set("shared", {"id": "1234"}, 60)
+            other_worker = spotufy.SQLiteCacheBackend(path)
+            self.assertEqual(other_worker.get("shared"), (True, {"id": "1234"}))
+
+    @patch('spotufy.SQLITE_TOUCH_INTERVAL', 0)
+    def test_sqlite_backend_eviction(self):
+        """The SQLite backend should evict the least recently used entries beyond max_entries"""
+        with tempfile.TemporaryDirectory() as directory:
+            backend = spotufy.SQLiteCacheBackend(os.path.join(directory, "cache.db"), max_entries=2)
+            backend.set("a", 1, 60)
+            backend.set("b", 2, 60)
+            backend.get("a")
+            backend.set("c", 3, 60)
+            self.assertEqual(backend.get("b"), (False, None))
+            self.assertEqual(backend.get("a"), (True, 1))
+            self.assertEqual(backend.stats()["entries"], 2)
+
+    def test_sqlite_backend_errors(self):
+        """Database errors of the SQLite backend should be treated as cache misses"""
+        with tempfile.TemporaryDirectory() as directory:
+            backend = spotufy.SQLiteCacheBackend(os.path.join(directory, "cache.db"))
+            backend.set("a", 1, 60)
+            # A closed connection raises sqlite3.ProgrammingError, an sqlite3.Error like "database is locked"
+            broken = sqlite3.connect(":memory:")
+            broken.close()
+            with patch.object(backend, '_connection', return_value=broken), self.assertLogs("spotufy", "ERROR"):
+                self.assertEqual(backend.get("a"), (False, None))
+                backend.set("b", 2, 60)
+                backend.delete("a")
+            self.assertEqual(backend.get("a"), (True, 1))
+
+    def test_sqlite_hit_without_write(self):
+        """Hits should only record their access time once per SQLITE_TOUCH_INTERVAL"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.db")
+            backend = spotufy.SQLiteCacheBackend(path)
+            backend.set("a", 1, 60)
+            before = backend.get("a") and backend._connection().total_changes
+            self.assertEqual(backend.get("a"), (True, 1))
+            self.assertEqual(backend._connection().total_changes, before)
+
+    def test_redis_backend(self):
+        """The Redis backend should work against a local Redis-protocol stand-in"""
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedisHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+        try:
+            backend = spotufy.create_cache_backend(f"redis://127.0.0.1:{server.server_address[1]}")
+            self.check_backend(backend)
+            backend.set("c", 1, 60)
+            backend.clear()
+            self.assertEqual(backend.get("c"), (False, None))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_corrupt_entries(self):
+        """Unreadable entries should be dropped and treated as cache misses"""
+        with tempfile.TemporaryDirectory() as directory:
+            backend = spotufy.SQLiteCacheBackend(os.path.join(directory, "cache.db"), compress=True)
+            backend.set("a", [1, 2], 60)
+            backend._connection().execute("UPDATE cache SET value = ? WHERE key = 'a'", (b"\x78\x9c truncated",))
+            with self.assertLogs("spotufy", "ERROR"):
+                self.assertEqual(backend.get("a"), (False, None))
+            self.assertEqual(backend.stats()["entries"], 0)
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedisHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+        try:
+            backend = spotufy.RedisCacheBackend("127.0.0.1", server.server_address[1])
+            backend._command("SET", backend.prefix + "b", b'{"tracks":', "PX", 60000)
+            with self.assertLogs("spotufy", "ERROR"):
+                self.assertEqual(backend.get("b"), (False, None))
+            self.assertTrue(backend._command("GET", backend.prefix + "b") is None)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_redis_backend_unavailable(self):
+        """An unreachable Redis server should be treated as a cache miss"""
+        backend = spotufy.RedisCacheBackend("127.0.0.1", 1)
+        self.assertEqual(backend.get("a"), (False, None))
+
+    def test_unknown_backend(self):
+        """Unknown backend URLs should be rejected"""
+        with self.assertRaises(ValueError):
+            spotufy.create_cache_backend("ftp://cache")
+
+
+class ScriptedAPIHandler(http.server.BaseHTTPRequestHandler):
+    """Local fake API server replying with a scripted list of (status, headers, body) responses"""
+    script = []
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        status, headers, body = self.script.pop(0) if self.script else (200, {}, b'{"ok": true}')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+@patch('spotufy.BACKOFF_BASE', 0.001)
+class resilience_test(SpotufyTestCase):
+    """Test module to test rate limiting, retries and circuit breaking in `spotufy.py`"""
+
+    def setUp(self):
+        super().setUp()
+        ScriptedAPIHandler.script = []
+        ScriptedAPIHandler.requests = []
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ScriptedAPIHandler)
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1/tracks/1"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry_after_429(self):
+        """A 429 response should be retried after its Retry-After delay"""
+        ScriptedAPIHandler.script = [(429, {"Retry-After": "0"}, b""), (200, {}, b'{"name": "Mock Track"}')]
+        response = spotufy.make_api_call(self.url, "GET", {"Authorization": "Bearer abc"})
+        self.assertEqual(response, {"name": "Mock Track"})
+        self.assertEqual(len(ScriptedAPIHandler.requests), 2)
+
+    def test_long_retry_after_fails_fast(self):
+        """A Retry-After longer than the configured maximum should not be waited for"""
+        ScriptedAPIHandler.script = [(429, {"Retry-After": "3600"}, b"")]
+        limiter = spotufy.TokenBucket()
+        with patch('spotufy.get_rate_limiter', return_value=limiter):
+            response = spotufy.make_api_call(self.url, "GET")
+        self.assertTrue(response is None)
+        self.assertEqual(len(ScriptedAPIHandler.requests), 1)
+        self.assertGreater(limiter.paused_until, time.monotonic())
+
+        # Later requests sharing the paused limiter should fail fast too instead of waiting it out
+        begin = time.monotonic()
+        with patch('spotufy.get_rate_limiter', return_value=limiter):
+            self.assertTrue(spotufy.make_api_call(self.url, "GET") is None)
+            self.assertTrue(spotufy_async.run(spotufy_async.make_api_call(self.url, "GET"), timeout=5) is None)
+        self.assertLess(time.monotonic() - begin, 1)
+        self.assertEqual(len(ScriptedAPIHandler.requests), 1)
+
+    def test_retry_server_error(self):
+        """5xx responses should be retried with backoff for GET requests"""
+        ScriptedAPIHandler.script = [(503, {}, b""), (502, {}, b""), (200, {}, b'{"ok": 1}')]
+        self.assertEqual(spotufy.make_api_call(self.url, "GET"), {"ok": 1})
+        self.assertEqual(len(ScriptedAPIHandler.requests), 3)
+
+    def test_post_not_retried(self):
+        """5xx responses to POST requests should not be retried"""
+        ScriptedAPIHandler.script = [(500, {}, b""), (200, {}, b'{"ok": 1}')]
+        self.assertTrue(spotufy.make_api_call(self.url, "POST", payload="{}") is None)
+        self.assertEqual(len(ScriptedAPIHandler.requests), 1)
+
+    @patch('spotufy.MAX_RETRIES', 0)
+    def test_circuit_breaker(self):
+        """After repeated failures the circuit should open and requests should fail fast"""
+        spotufy.circuit_breakers[f"127.0.0.1:{self.server.server_port}"] = spotufy.CircuitBreaker(threshold=2, reset_timeout=60)
+        ScriptedAPIHandler.script = [(500, {}, b"")] * 3
+        for _ in range(3):
+            self.assertTrue(spotufy.make_api_call(self.url, "GET") is None)
+        self.assertEqual(len(ScriptedAPIHandler.requests), 2)
+
+    def test_circuit_half_open(self):
+        """An open circuit should let one trial request through after its reset timeout"""
+        breaker = spotufy.CircuitBreaker(threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.02)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    @patch('spotufy.MAX_RETRIES', 0)
+    def test_half_open_unexpected_error(self):
+        """An unexpected request error during the trial request should re-open the circuit, not block it for good"""
+        breaker = spotufy.CircuitBreaker(threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        spotufy.circuit_breakers[f"127.0.0.1:{self.server.server_port}"] = breaker
+        time.sleep(0.02)
+        with patch('spotufy.requests.Session.request', side_effect=requests.exceptions.ChunkedEncodingError("truncated")):
+            self.assertTrue(spotufy.make_api_call(self.url, "GET") is None)
+        self.assertEqual(breaker.state, "open")
+        time.sleep(0.02)
+        with patch.object(spotufy_async.transport, 'request', AsyncMock(side_effect=httpx.DecodingError("bad body"))):
+            self.assertTrue(spotufy_async.run(spotufy_async.make_api_call(self.url, "GET")) is None)
+        self.assertEqual(breaker.state, "open")
+        time.sleep(0.02)
+        ScriptedAPIHandler.script = [(200, {}, b'{"name": "Mock Track"}')]
+        self.assertEqual(spotufy.make_api_call(self.url, "GET"), {"name": "Mock Track"})
+        self.assertEqual(breaker.state, "closed")
+
+    def test_token_bucket(self):
+        """The token bucket should delay requests beyond its burst capacity"""
+        bucket = spotufy.TokenBucket(rate=100, capacity=2)
+        begin = time.monotonic()
+        for _ in range(4):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - begin, 0.015)
 
-class request_api_token_test(unittest.TestCase):
+
+@patch('spotufy.make_api_call')
+class iter_pages_test(SpotufyTestCase):
+    """Test module to test the paging generator in `spotufy.py`"""
+
+    def pages(self, count):
+        return [{"items": [i], "next": f"https://api.spotify.com/v1/page{i + 1}" if i + 1 < count else None}
+                for i in range(count)]
+
+    def test_prefetch(self, api_response):
+        """The next page should be requested before the current one is consumed"""
+        api_response.side_effect = self.pages(3)
+        pages = spotufy.iter_pages("token", "https://api.spotify.com/v1/page0")
+        self.assertEqual(next(pages)["items"], [0])
+        time.sleep(0.05)
+        self.assertEqual(api_response.call_count, 2)
+        self.assertEqual([page["items"] for page in pages], [[1], [2]])
+
+    def test_no_prefetch(self, api_response):
+        """Without prefetch, pages should only be requested when needed"""
+        api_response.side_effect = self.pages(3)
+        pages = spotufy.iter_pages("token", "https://api.spotify.com/v1/page0", prefetch=False)
+        next(pages)
+        self.assertEqual(api_response.call_count, 1)
+        self.assertEqual(len(list(pages)), 2)
+
+    def test_max_pages(self, api_response):
+        """No more than max_pages pages should be fetched"""
+        api_response.side_effect = self.pages(5)
+        pages = list(spotufy.iter_pages("token", "https://api.spotify.com/v1/page0", max_pages=2))
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(api_response.call_count, 2)
+
+
+class single_flight_test(SpotufyTestCase):
+    """Test module to test request coalescing in `spotufy.py`"""
+
+    def run_concurrently(self, func, count=5):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(func())) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_coalesced(self):
+        """Identical concurrent calls should share a single execution"""
+        group = spotufy.SingleFlight()
+        calls = []
+        def slow():
+            calls.append(1)
+            time.sleep(0.05)
+            return "result"
+        results = self.run_concurrently(lambda: group.do("key", slow))
+        self.assertEqual(results, ["result"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(group.shared, 4)
+
+    def test_error_shared(self):
+        """Waiting callers should receive the error raised by the in-flight call"""
+        group = spotufy.SingleFlight()
+        started = threading.Event()
+        def fail():
+            started.set()
+            time.sleep(0.05)
+            raise ValueError("boom")
+        errors = []
+        def call():
+            try:
+                group.do("key", fail)
+            except ValueError as e:
+                errors.append(e)
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        call()
+        leader.join()
+        self.assertEqual(len(errors), 2)
+
+    @patch('spotufy.send_api_request')
+    def test_make_api_call_coalesced(self, api_request):
+        """Concurrent identical GET requests should result in one upstream request"""
+        api_request.side_effect = lambda *args: time.sleep(0.05) or {"name": "Mock Track"}
+        url = "https://api.spotify.com/v1/tracks/11dFghVXANMlKmJXsNCbNl"
+        headers = {"Authorization": "Bearer abcdefg"}
+        results = self.run_concurrently(lambda: spotufy.make_api_call(url, "GET", headers))
+        self.assertEqual(results, [{"name": "Mock Track"}] * 5)
+        self.assertEqual(api_request.call_count, 1)
+
+    @patch('spotufy.send_api_request')
+    def test_post_not_coalesced(self, api_request):
+        """Non-GET requests should never be coalesced"""
+        api_request.side_effect = lambda *args: time.sleep(0.02) or {}
+        self.run_concurrently(lambda: spotufy.make_api_call("https://api.spotify.com/v1/x", "POST", {}, "{}"), 3)
+        self.assertEqual(api_request.call_count, 3)
+
+    @patch('spotufy.make_api_call')
+    def test_cached_lookup_coalesced(self, api_response):
+        """Concurrent cache misses for the same artist from different users should make one lookup"""
+        def search(*args, **kwargs):
+            time.sleep(0.05)
+            return {"artists": {"total": 1, "items": [get_related_artists_test.full_artist]}}
+        api_response.side_effect = search
+        results = self.run_concurrently(lambda: spotufy.search_artists(f"token{threading.get_ident()}", "Josh Lowe"))
+        self.assertEqual(len(results), 5)
+        self.assertEqual(api_response.call_count, 1)
+
+
+class fan_out_test(SpotufyTestCase):
+    """Test module to test the concurrent fan-out executor in `spotufy.py`"""
+
+    def test_results_in_order(self):
+        """Results should be returned in the order the calls were given"""
+        calls = [lambda i=i: (time.sleep(0.01 * (3 - i)), i)[1] for i in range(3)]
+        self.assertEqual(spotufy.fan_out(calls), [0, 1, 2])
+
+    def test_failed_call(self):
+        """A call that raises should yield None without affecting its siblings"""
+        def fail():
+            raise ValueError("boom")
+        self.assertEqual(spotufy.fan_out([lambda: 1, fail]), [1, None])
+
+    def test_concurrency_limit(self):
+        """No more than max_concurrency calls should run at once"""
+        lock = threading.Lock()
+        state = {"running": 0, "peak": 0}
+        def call():
+            with lock:
+                state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+            time.sleep(0.02)
+            with lock:
+                state["running"] -= 1
+            return True
+        results = spotufy.fan_out([call] * 6, max_concurrency=2)
+        self.assertEqual(results, [True] * 6)
+        self.assertLessEqual(state["peak"], 2)
+
+    def test_deadline(self):
+        """Calls still pending when the deadline passes should be cancelled and yield None"""
+        started = []
+        def slow(i):
+            started.append(i)
+            time.sleep(0.2)
+            return i
+        calls = [lambda i=i: slow(i) for i in range(4)]
+        begin = time.monotonic()
+        results = spotufy.fan_out(calls, max_concurrency=1, deadline=0.05)
+        self.assertLess(time.monotonic() - begin, 0.2)
+        self.assertEqual(results, [None] * 4)
+        time.sleep(0.25)
+        self.assertEqual(started, [0])
+
+    def test_completed_order(self):
+        """fan_out_completed should yield (index, result) pairs as the calls finish"""
+        calls = [lambda i=i: (time.sleep(0.02 * (3 - i)), i)[1] for i in range(3)]
+        self.assertEqual(list(spotufy.fan_out_completed(calls)), [(2, 2), (1, 1), (0, 0)])
+
+    def test_completed_deadline(self):
+        """Calls unfinished at the deadline should not be yielded"""
+        calls = [lambda: 1, lambda: time.sleep(0.2)]
+        self.assertEqual(list(spotufy.fan_out_completed(calls, deadline=0.05)), [(0, 1)])
+
+
+class request_api_token_test(SpotufyTestCase):
     """Test module to test request API token function in `spotufy.py`"""
-    @patch('spotufy.dotenv.dotenv_values')
-    def test_token_received(self, secrets):
-        secrets.return_value = {"CLIENT_ID": "1", "CALLBACK_URL": "http://"}
+    def test_token_received(self):
         """Redirect object to authentication URL should be returned"""
-        response = spotufy.request_api_token()
+        settings = spotufy.Settings(client_id="1", callback_url="http://")
+        response = spotufy.request_api_token(settings)
         self.assertIsInstance(response, werkzeug.wrappers.response.Response)
         self.assertTrue(response.status_code == 302)
 
+    def test_missing_configuration(self):
+        """Should return None if no client ID is configured"""
+        response = spotufy.request_api_token(spotufy.Settings())
+        self.assertTrue(response is None)
+
 
-class parse_input_test(unittest.TestCase):
+class settings_test(SpotufyTestCase):
+    """Test module to test configuration loading in `spotufy.py`"""
+
+    def test_env_overrides_file(self):
+        """Environment variables should take precedence over the .env file"""
+        with tempfile.TemporaryDirectory() as directory:
+            env_file = os.path.join(directory, ".env")
+            with open(env_file, "w") as f:
+                f.write("CLIENT_ID=from_file\nGENIUS_TOKEN=genius\nFLASK_PORT=8000\n")
+            with patch.dict(os.environ, {"CLIENT_ID": "from_env"}):
+                settings = spotufy.load_settings(env_file)
+        self.assertEqual(settings.client_id, "from_env")
+        self.assertEqual(settings.genius_token, "genius")
+        self.assertEqual(settings.flask_port, 8000)
+
+    def test_settings_immutable(self):
+        """Settings should not be modifiable after loading"""
+        settings = spotufy.load_settings("/nonexistent/.env")
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            settings.client_id = "1"
+
+    def test_reload(self):
+        """reload_settings should replace the settings used by feature functions"""
+        original = spotufy.get_settings()
+        try:
+            with patch.dict(os.environ, {"CLIENT_ID": "reloaded"}):
+                spotufy.reload_settings("/nonexistent/.env")
+            self.assertEqual(spotufy.get_settings().client_id, "reloaded")
+        finally:
+            spotufy.settings = original
+
+
+class parse_input_test(SpotufyTestCase):
     """Test module to test parse input function in `spotufy.py`"""
     def test_valid_return(self):
         """Function should return a non-empty string when called"""
@@ -53,7 +651,7 @@ class parse_input_test(unittest.TestCase):
 
 @patch('spotufy.make_api_call')
 @patch('spotufy.json.dumps')
-class create_playlist_test(unittest.TestCase):
+class create_playlist_test(SpotufyTestCase):
     """Test module to test create_playlist function in 'spotufy.py'"""
     def test_valid_return(self, json_dump, api_request):
         """Should return playlist URL if playlist is created successfully"""
@@ -70,6 +668,32 @@ class create_playlist_test(unittest.TestCase):
         self.assertIsInstance(response, str)
         self.assertTrue(len(response) > 0)
 
+    def test_chunked_insertion(self, json_dump, api_request):
+        """Large track lists should be inserted in ordered chunks of at most 100 URIs"""
+        json_dump.side_effect = json.JSONEncoder().encode
+        api_request.side_effect = [
+            {"id": "user"},
+            {"id": "1234", "external_urls": {"spotify": "https://spotify.com/playlist"}},
+            {"snapshot_id": "a"}, {"snapshot_id": "b"}, {"snapshot_id": "c"}
+        ]
+        tracks = [{"uri": f"spotify:track:{i}"} for i in range(250)]
+        response = spotufy.create_playlist('token', 'Test23', tracks)
+        self.assertEqual(response, "https://spotify.com/playlist")
+        chunks = [json.loads(c.args[3])["uris"] for c in api_request.call_args_list[2:]]
+        self.assertEqual([len(chunk) for chunk in chunks], [100, 100, 50])
+        self.assertEqual(sum(chunks, []), [track["uri"] for track in tracks])
+
+    def test_user_id_cached(self, json_dump, api_request):
+        """The user ID should only be fetched once per token"""
+        json_dump.side_effect = json.JSONEncoder().encode
+        playlist = {"id": "1234", "external_urls": {"spotify": "https://spotify.com/playlist"}}
+        api_request.side_effect = [{"id": "user"}, playlist, {"snapshot_id": "a"}, playlist, {"snapshot_id": "b"}]
+        tracks = [{"uri": "spotify:track:6rqhFgbbKwnb9MLmUQDhG6"}]
+        spotufy.create_playlist('token', 'Test23', tracks)
+        spotufy.create_playlist('token', 'Test24', tracks)
+        me_calls = [c for c in api_request.call_args_list if c.args[0].endswith("/me")]
+        self.assertEqual(len(me_calls), 1)
+
     def test_invalid_input_playlist_name(self, placeholder1, placeholder2):
         """Should return None given invalid input playlist name type"""
         response = spotufy.create_playlist('token', [1], [{"uri":"spotify:track:6rqhFgbbKwnb9MLmUQDhG6"}])
@@ -94,7 +718,7 @@ class create_playlist_test(unittest.TestCase):
 
 
 @patch('spotufy.make_api_call')
-class search_artists_test(unittest.TestCase):
+class search_artists_test(SpotufyTestCase):
     """Test module to test search artists function in `spotufy.py`"""
 
     def test_valid_return(self, artists_response):
@@ -135,7 +759,7 @@ class search_artists_test(unittest.TestCase):
         self.assertTrue(response is None)
 
 @patch('spotufy.make_api_call')
-class get_top_tracks_test(unittest.TestCase):
+class get_top_tracks_test(SpotufyTestCase):
     """Test module to test search artists function in `spotufy.py"""
 
     def test_valid_return(self, api_response):
@@ -187,7 +811,7 @@ class get_top_tracks_test(unittest.TestCase):
 
 
 @patch('spotufy.make_api_call')
-class search_song_details_test(unittest.TestCase):
+class search_song_details_test(SpotufyTestCase):
     """Test module to test search song details function in `spotufy.py`"""
 
     def test_empty_input_artist(self, placeholder):
@@ -217,7 +841,7 @@ class search_song_details_test(unittest.TestCase):
         self.assertTrue(response is None)
 
     def test_valid_return(self, song_response):
-        """Function should return a dictionary of track information if given good input"""
+        """Function should return a Track with the track information if given good input"""
         song_response.return_value = {
             "tracks": {
                 "items":[{
@@ -230,12 +854,12 @@ class search_song_details_test(unittest.TestCase):
             }
         }
         response = spotufy.search_song_details("token", "Resonance", "Home")
-        self.assertIsInstance(response, dict)
-        self.assertTrue(len(response) > 0)
+        self.assertIsInstance(response, spotufy.Track)
+        self.assertEqual(response.duration, 100)
 
 
 @patch('spotufy.make_api_call')
-class get_track_recs_test(unittest.TestCase):
+class get_track_recs_test(SpotufyTestCase):
     """Test module to test get_track_recs function in `spotufy.py`"""
 
     def test_valid_return(self, recommended_tracks):
@@ -276,7 +900,7 @@ class get_track_recs_test(unittest.TestCase):
 
 
 @patch('spotufy.make_api_call')
-class get_user_recs_test(unittest.TestCase):
+class get_user_recs_test(SpotufyTestCase):
     """Test module to test get_user_recs function in 'spotufy.py'"""
 
     def test_valid_return(self, recommended_tracks):
@@ -293,7 +917,7 @@ class get_user_recs_test(unittest.TestCase):
                     "uri": None,
                 }]
             }
-        recommended_tracks.side_effect = [listened_tracks_dict, recommended_tracks_dict]
+        recommended_tracks.side_effect = [{"id": "user"}, listened_tracks_dict, recommended_tracks_dict]
         response = spotufy.get_user_recs("token")
         self.assertIsInstance(response, list)
         self.assertTrue(len(response) > 0)
@@ -305,17 +929,194 @@ class get_user_recs_test(unittest.TestCase):
 
 
 @patch('spotufy.make_api_call')
-class get_related_artists_test(unittest.TestCase):
+class get_recommendations_test(SpotufyTestCase):
+    """Test module to test the multi-seed get_recommendations function in `spotufy.py`"""
+
+    recommended_tracks_dict = {
+        "tracks": [{
+            "id": "5678",
+            "name": None,
+            "album": {"name": None, "artists": [{"name": None}], "images": [{"url": None}]},
+            "artists": [{"name": None}],
+            "external_urls": {"spotify": None},
+            "popularity": None,
+            "uri": "spotify:track:5678",
+        }]
+    }
+
+    def test_canonical_seeds(self, api_response):
+        """Seeds should be deduplicated and sorted, and rejected when there are none or too many"""
+        self.assertEqual(spotufy.canonical_seeds(["b", "a", "b"], "x", ["Rock"]), (("a", "b"), ("x",), ("rock",)))
+        self.assertTrue(spotufy.canonical_seeds() is None)
+        self.assertTrue(spotufy.canonical_seeds(["1", "2", "3"], ["4", "5", "6"]) is None)
+        self.assertTrue(spotufy.canonical_seeds(["1", ""]) is None)
+
+    def test_mixed_seeds(self, api_response):
+        """Track, artist and genre seeds and the limit should be passed to the API"""
+        api_response.return_value = self.recommended_tracks_dict
+        response = spotufy.get_recommendations("token", tracks=["1234"], artists=["abcd"], genres=["soul"], limit=20)
+        self.assertEqual(response[0]["uri"], "spotify:track:5678")
+        url = api_response.call_args[0][0]
+        for param in ("limit=20", "seed_tracks=1234", "seed_artists=abcd", "seed_genres=soul"):
+            self.assertIn(param, url)
+
+    def test_shared_seed_sets(self, api_response):
+        """The same seeds in any order should share one upstream call, whichever token asks"""
+        api_response.return_value = self.recommended_tracks_dict
+        first = spotufy.get_recommendations("token", tracks=["1", "2", "3"])
+        second = spotufy.get_recommendations("other", tracks=["3", "1", "2", "1"])
+        self.assertEqual(first, second)
+        self.assertEqual(api_response.call_count, 1)
+        spotufy.get_recommendations("token", tracks=["1", "2", "3"], limit=10)
+        self.assertEqual(api_response.call_count, 2)
+
+    def test_invalid_limit(self, api_response):
+        """Limits outside of 1-100 should be rejected without an upstream call"""
+        self.assertTrue(spotufy.get_recommendations("token", tracks=["1234"], limit=0) is None)
+        self.assertTrue(spotufy.get_recommendations("token", tracks=["1234"], limit=101) is None)
+        api_response.assert_not_called()
+
+    def test_no_recommendations(self, api_response):
+        """An empty list of recommendations should return None"""
+        api_response.return_value = {"tracks": []}
+        self.assertTrue(spotufy.get_recommendations("token", tracks=["1234"]) is None)
+
+    def test_user_recs_few_top_tracks(self, api_response):
+        """Users with fewer than five top tracks should get recommendations from the ones they have"""
+        api_response.side_effect = [{"id": "user"}, {"total": 2, "items": [{"id": "1"}, {"id": "2"}]}, self.recommended_tracks_dict]
+        response = spotufy.get_user_recs("token")
+        self.assertEqual(response[1]["id"], "5678")
+        self.assertIn("seed_tracks=1%2C2", api_response.call_args[0][0])
+
+    def test_user_recs_no_top_tracks(self, api_response):
+        """Users without top tracks should get None"""
+        api_response.side_effect = [{"id": "user"}, {"total": 0, "items": []}]
+        self.assertTrue(spotufy.get_user_recs("token") is None)
+        self.assertEqual(api_response.call_count, 2)
+
+    def test_async_shares_cache(self, api_response):
+        """Recommendations cached by the async client should be served to the sync client"""
+        with patch('spotufy_async.make_api_call', AsyncMock(return_value=self.recommended_tracks_dict)):
+            async_result = spotufy_async.run(spotufy_async.get_recommendations("token", tracks=["2", "1"]))
+        self.assertEqual(spotufy.get_recommendations("token", tracks=["1", "2"]), async_result)
+        api_response.assert_not_called()
+
+
+class user_recs_cache_test(SpotufyTestCase):
+    """Test module to test the per-user recommendations cache of get_user_recs in `spotufy.py`"""
+
+    top_tracks = {"total": 2, "items": [{"id": "1"}, {"id": "2"}]}
+
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        patcher = patch('spotufy.make_api_call', side_effect=self.respond)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Cleanups run last in first out: refreshes queued by the test finish while the mock is in place
+        self.addCleanup(spotufy.user_recs_refresher.queue.join)
+
+    def respond(self, url, method, headers=None, payload=None):
+        # The user of each token is in the token, the recommended track ID says how many were made
+        self.calls.append(url)
+        if url.endswith("/me"):
+            return {"id": headers["Authorization"].split(":")[-1]}
+        if "/me/top/tracks" in url:
+            return self.top_tracks
+        track = dict(get_recommendations_test.recommended_tracks_dict["tracks"][0], id=str(len(self.calls)))
+        return {"tracks": [track]}
+
+    def upstream_calls(self, path):
+        return len([url for url in self.calls if path in url])
+
+    def test_cached_per_user(self):
+        """Recommendations should be cached by user ID, across the tokens of the same user"""
+        first = spotufy.get_user_recs("token-1:alice")
+        second = spotufy.get_user_recs("token-2:alice")
+        self.assertEqual(first, second)
+        self.assertEqual(self.upstream_calls("/me/top/tracks"), 1)
+        spotufy.get_user_recs("token-3:bob")
+        self.assertEqual(self.upstream_calls("/me/top/tracks"), 2)
+        self.assertEqual(self.upstream_calls("/recommendations"), 1)
+
+    def test_stale_while_revalidate(self):
+        """Stale recommendations should be served right away and replaced in the background"""
+        first = spotufy.get_user_recs("token:alice")
+        self.top_tracks = {"total": 1, "items": [{"id": "3"}]}
+        with patch('spotufy.USER_RECS_REFRESH_AFTER', 0):
+            self.assertEqual(spotufy.get_user_recs("token:alice"), first)
+            spotufy.user_recs_refresher.queue.join()
+        refreshed = spotufy.get_user_recs("token:alice")
+        self.assertNotEqual(refreshed, first)
+        self.assertEqual(self.upstream_calls("/me/top/tracks"), 2)
+        self.assertEqual(spotufy.user_recs_cache.get(spotufy.user_recs_cache_key("alice", 5))[1]["seeds"], ["3"])
+
+    def test_failed_refresh_keeps_entry(self):
+        """A failed background refresh should leave the stale entry in place"""
+        first = spotufy.get_user_recs("token:alice")
+        self.top_tracks = None
+        with patch('spotufy.USER_RECS_REFRESH_AFTER', 0):
+            spotufy.get_user_recs("token:alice")
+            spotufy.user_recs_refresher.queue.join()
+            self.assertEqual(spotufy.get_user_recs("token:alice"), first)
+            spotufy.user_recs_refresher.queue.join()
+
+    def test_refresh_queued_once(self):
+        """A key should only be queued for refresh once at a time"""
+        refresher = spotufy.UserRecsRefresher(workers=0)
+        self.assertTrue(refresher.submit("token", "key"))
+        self.assertFalse(refresher.submit("token", "key"))
+        self.assertEqual(refresher.stats()["queued"], 1)
+        refresher.clear()
+        self.assertEqual(refresher.stats()["queued"], 0)
+        self.assertTrue(refresher.submit("token", "key"))
+
+    def test_async_shares_cache(self):
+        """Recommendations cached by the sync client should be served to the async client"""
+        first = spotufy.get_user_recs("token:alice")
+        with patch('spotufy_async.make_api_call', AsyncMock()) as mock_call:
+            self.assertEqual(spotufy_async.run(spotufy_async.get_user_recs("token:alice")), first)
+        mock_call.assert_not_called()
+
+
+@patch('spotufy.make_api_call')
+class get_related_artists_test(SpotufyTestCase):
     """Test module to test get related artists function in `spotufy.py"""
 
+    full_artist = {
+        "name": "Josh Lowe",
+        "external_urls": {"spotify": None},
+        "followers": {"total": 1000},
+        "popularity": None,
+        "genres": ["Rock"],
+        "id": "1234",
+        "uri": None,
+        "images": [{"url": None}]
+    }
+
     def test_valid_return(self, artists_response):
         """Should return a list given valid input"""
-        artists_response.return_value = {"artists": [{"name": "Josh Lowe"}]}
+        artists_response.return_value = {"artists": [self.full_artist]}
         with patch('spotufy.search_artists') as search_artists:
-            search_artists.return_value = "artist result"
             response = spotufy.get_related_artists('token', 'artist')
             self.assertIsInstance(response, list)
             self.assertTrue(len(response) > 0)
+            self.assertEqual(response[0][1]["name"], "Josh Lowe")
+            # Results are built from the related-artists payload, without any extra searches
+            search_artists.assert_not_called()
+            self.assertEqual(artists_response.call_count, 1)
+
+    def test_batch_hydration(self, artists_response):
+        """Simplified artist entries should be hydrated with a single batched lookup"""
+        artists_response.side_effect = [
+            {"artists": [{"name": "Josh Lowe", "id": "1234"}, {"name": "Someone", "id": "5678"}]},
+            {"artists": [self.full_artist, None]}
+        ]
+        response = spotufy.get_related_artists('token', 'artist')
+        self.assertEqual(len(response), 1)
+        self.assertEqual(response[0][1]["id"], "1234")
+        self.assertEqual(artists_response.call_count, 2)
+        self.assertIn("/artists?ids=1234%2C5678", artists_response.call_args_list[1].args[0])
 
     def test_missing_token(self, placeholder):
         response = spotufy.get_related_artists("", "123")
@@ -338,50 +1139,123 @@ class get_related_artists_test(unittest.TestCase):
         self.assertTrue(response is None)
 
 
-class get_genius_lyrics_test(unittest.TestCase):
+class get_genius_lyrics_test(SpotufyTestCase):
     """Test module to test get Genius lyrics function in `spotufy.py"""
+    settings = spotufy.Settings(genius_token="1234")
 
     @patch('spotufy.lyricsgenius.Genius.search_song')
     def test_valid_return(self, genius_response):
         """Should return a string given valid input; should also remove the first line of the string"""
-        with patch('spotufy.dotenv.dotenv_values') as dotenv:
-            dotenv.return_value = {"GENIUS_TOKEN": "1234"}
-            genius_response.return_value.lyrics = "Lorem\nipsum\ndolor"
-            response = spotufy.get_genius_lyrics('Dion', 'Only You Know')
-            self.assertIsInstance(response, str)
-            self.assertTrue(response == "ipsum\ndolor")
+        genius_response.return_value.lyrics = "Lorem\nipsum\ndolor"
+        response = spotufy.get_genius_lyrics('Dion', 'Only You Know', self.settings)
+        self.assertIsInstance(response, str)
+        self.assertTrue(response == "ipsum\ndolor")
+
+    @patch('spotufy.lyricsgenius.Genius.search_song')
+    def test_cached_lyrics(self, genius_response):
+        """Repeat lookups for the same normalized artist and track should be served from the cache"""
+        genius_response.return_value.lyrics = "Lorem\nipsum\ndolor"
+        first = spotufy.get_genius_lyrics('Dion', 'Only You Know', self.settings)
+        second = spotufy.get_genius_lyrics('dion', 'Only You Know!', self.settings)
+        self.assertEqual(first, second)
+        self.assertEqual(genius_response.call_count, 1)
+
+    @patch('spotufy.lyricsgenius.Genius.search_song')
+    def test_cached_miss(self, genius_response):
+        """Songs without lyrics should also be cached"""
+        genius_response.return_value = None
+        self.assertTrue(spotufy.get_genius_lyrics('Dion', 'Unknown', self.settings) is None)
+        self.assertTrue(spotufy.get_genius_lyrics('Dion', 'Unknown', self.settings) is None)
+        self.assertEqual(genius_response.call_count, 1)
+
+    def test_client_reused(self):
+        """The same Genius client should be reused for every lookup with the same token"""
+        client = spotufy.get_genius_client("1234")
+        self.assertIs(spotufy.get_genius_client("1234"), client)
+        self.assertEqual(client.response_format, 'html')
+        self.assertIsNot(spotufy.get_genius_client("5678"), client)
+
+    def test_client_pool_both_schemes(self):
+        """Plain HTTP Genius URLs should use the same pooled adapter as HTTPS ones"""
+        session = spotufy.get_genius_client("1234", "http://127.0.0.1:1/")._session
+        self.assertIs(session.get_adapter("http://127.0.0.1:1/api/search"), session.get_adapter("https://genius.com/"))
+        self.assertEqual(session.get_adapter("http://127.0.0.1:1/")._pool_maxsize, spotufy.POOL_MAXSIZE)
+
+    def test_compressed_disk_cache(self):
+        """Lyrics stored in a compressed SQLite cache should round-trip and take less space"""
+        with tempfile.TemporaryDirectory() as directory:
+            backend = spotufy.create_cache_backend(f"sqlite:///{directory}/lyrics.db?compress=1&max_entries=10")
+            lyrics = "la la la\n" * 200
+            backend.set("lyrics:dion:only you know", lyrics, 60)
+            self.assertEqual(backend.get("lyrics:dion:only you know"), (True, lyrics))
+            self.assertLess(backend.stats()["bytes"], len(lyrics))
+            self.assertEqual(backend.max_entries, 10)
 
     def test_invalid_artist_type(self):
         """Should return None if given invalid input artist type"""
-        with patch('spotufy.dotenv.dotenv_values') as dotenv:
-            dotenv.return_value = {"GENIUS_TOKEN": "1234"}
-            response = spotufy.get_genius_lyrics(1, "Song")
-            self.assertTrue(response is None)
+        response = spotufy.get_genius_lyrics(1, "Song", self.settings)
+        self.assertTrue(response is None)
 
     def test_missing_artist(self):
         """Should return None if artist is missing"""
-        with patch('spotufy.dotenv.dotenv_values') as dotenv:
-            dotenv.return_value = {"GENIUS_TOKEN": "1234"}
-            response = spotufy.get_genius_lyrics('', 'Song')
-            self.assertTrue(response is None)
+        response = spotufy.get_genius_lyrics('', 'Song', self.settings)
+        self.assertTrue(response is None)
 
     def test_missing_song(self):
         """Should return None if song is missing"""
-        with patch('spotufy.dotenv.dotenv_values') as dotenv:
-            dotenv.return_value = {"GENIUS_TOKEN": "1234"}
-            response = spotufy.get_genius_lyrics('Josh Lowe', '')
-            self.assertTrue(response is None)
+        response = spotufy.get_genius_lyrics('Josh Lowe', '', self.settings)
+        self.assertTrue(response is None)
 
     def test_invalid_song_type(self):
         """Should return None if given invalid input song type"""
-        with patch('spotufy.dotenv.dotenv_values') as dotenv:
-            dotenv.return_value = {"GENIUS_TOKEN": "1234"}
-            response = spotufy.get_genius_lyrics("Me", 1)
-            self.assertTrue(response is None)
+        response = spotufy.get_genius_lyrics("Me", 1, self.settings)
+        self.assertTrue(response is None)
+
+
+class lyrics_prefetch_test(SpotufyTestCase):
+    """Test module to test background lyrics prefetching in `spotufy.py`"""
+    tracks = [{"artist": "Dion", "name": "Only You Know"}, {"artist": "Dion", "name": "Runaround Sue"}]
+
+    @patch('spotufy.get_genius_lyrics')
+    def test_prefetch(self, genius_lyrics):
+        """Queued tracks should be fetched in the background"""
+        prefetcher = spotufy.LyricsPrefetcher(enabled=True)
+        with patch('spotufy.lyrics_prefetcher', prefetcher):
+            self.assertEqual(spotufy.prefetch_lyrics(self.tracks), 2)
+            prefetcher.queue.join()
+        self.assertEqual(genius_lyrics.call_count, 2)
+        self.assertEqual(prefetcher.stats()["completed"], 2)
+
+    def test_disabled(self):
+        """Nothing should be queued when prefetching is disabled"""
+        prefetcher = spotufy.LyricsPrefetcher(enabled=False)
+        self.assertEqual(prefetcher.submit([("Dion", "Only You Know")]), 0)
+
+    def test_busy_worker(self):
+        """Tracks should be dropped while the worker is busy with foreground requests"""
+        prefetcher = spotufy.LyricsPrefetcher(enabled=True, max_foreground=0)
+        spotufy.foreground.enter()
+        try:
+            self.assertEqual(prefetcher.submit([("Dion", "Only You Know")]), 0)
+        finally:
+            spotufy.foreground.exit()
+        self.assertEqual(prefetcher.stats()["dropped"], 1)
+
+    def test_queue_full(self):
+        """Tracks beyond the queue size should be dropped instead of blocking"""
+        prefetcher = spotufy.LyricsPrefetcher(enabled=True, workers=0, queue_size=1)
+        self.assertEqual(prefetcher.submit([("Dion", "Only You Know"), ("Dion", "Runaround Sue")]), 1)
+        self.assertEqual(prefetcher.stats()["dropped"], 1)
+
+    def test_cached_skipped(self):
+        """Tracks whose lyrics are already cached should not be queued"""
+        spotufy.lyrics_cache.set(spotufy.lyrics_cache_key("Dion", "Only You Know"), "lyrics", 60)
+        prefetcher = spotufy.LyricsPrefetcher(enabled=True, workers=0)
+        self.assertEqual(prefetcher.submit([("Dion", "Only You Know")]), 0)
 
 
 @patch('spotufy.make_api_call')
-class get_artist_releases_test(unittest.TestCase):
+class get_artist_releases_test(SpotufyTestCase):
     """Test module to test get artist releases function in `spotufy.py`"""
 
     def test_invalid_artist_input(self, placeholder):
@@ -403,7 +1277,7 @@ class get_artist_releases_test(unittest.TestCase):
                 "album_group":None,
                 "external_urls":{"spotify":None},
                 "id":None,
-                "artists":[None],
+                "artists":[{"name":None}],
                 "name":None,
                 "release_date":None,
                 "total_tracks":None,
@@ -414,6 +1288,64 @@ class get_artist_releases_test(unittest.TestCase):
         self.assertIsInstance(response, list)
         self.assertTrue(len(response) > 0)
 
+    release = {
+        "album_group": "album",
+        "external_urls": {"spotify": None},
+        "id": None,
+        "artists": [{"name": None}],
+        "name": None,
+        "release_date": None,
+        "total_tracks": None,
+        "images": []
+    }
+
+    def test_pagination(self, releases_response):
+        """Function should follow `next` links and return releases from every page"""
+        releases_response.side_effect = [
+            {"total": 3, "items": [self.release, self.release], "next": "https://api.spotify.com/v1/next"},
+            {"total": 3, "items": [self.release], "next": None}
+        ]
+        response = spotufy.get_artist_releases("token", {"name": "Al Green", "id": "3dkbV4qihUeMsqN4vBGg93"})
+        self.assertEqual(len(response), 3)
+        self.assertEqual(releases_response.call_args_list[1].args[0], "https://api.spotify.com/v1/next")
+
+    def test_streaming(self, releases_response):
+        """Streaming mode should return a generator fetching pages lazily"""
+        releases_response.side_effect = [
+            {"total": 2, "items": [self.release], "next": "https://api.spotify.com/v1/next"},
+            {"total": 2, "items": [self.release], "next": None}
+        ]
+        releases = spotufy.stream_artist_releases("token", {"name": "Al Green", "id": "3dkbV4qihUeMsqN4vBGg93"})
+        self.assertEqual(releases_response.call_count, 0)
+        self.assertEqual(next(releases)["type"], "album")
+        self.assertEqual(len(list(releases)), 1)
+
+    def test_streaming_fills_cache(self, releases_response):
+        """A streamed discography read to the end should be cached for later views"""
+        releases_response.return_value = {"total": 1, "items": [self.release], "next": None}
+        artist = {"name": "Al Green", "id": "3dkbV4qihUeMsqN4vBGg93"}
+        streamed = list(spotufy.stream_artist_releases("token", artist))
+        self.assertEqual(spotufy.stream_artist_releases("token", artist), streamed)
+        self.assertEqual(spotufy.get_artist_releases("token", artist), streamed)
+        self.assertEqual(releases_response.call_count, 1)
+
+    @patch('spotufy.STREAM_CACHE_MAX_RELEASES', 1)
+    def test_streaming_cache_cap(self, releases_response):
+        """Streamed discographies longer than the cap should not be collected for the cache"""
+        releases_response.return_value = {"total": 2, "items": [self.release, self.release], "next": None}
+        artist = {"name": "Al Green", "id": "3dkbV4qihUeMsqN4vBGg93"}
+        self.assertEqual(len(list(spotufy.stream_artist_releases("token", artist))), 2)
+        self.assertEqual(len(list(spotufy.stream_artist_releases("token", artist))), 2)
+        self.assertEqual(releases_response.call_count, 2)
+
+    def test_streaming_cached(self, releases_response):
+        """Streaming mode should reuse a cached release list"""
+        releases_response.return_value = {"total": 1, "items": [self.release]}
+        artist = {"name": "Al Green", "id": "3dkbV4qihUeMsqN4vBGg93"}
+        releases = spotufy.get_artist_releases("token", artist)
+        self.assertEqual(spotufy.stream_artist_releases("token", artist), releases)
+        self.assertEqual(releases_response.call_count, 1)
+
     def test_missing_token(self, placeholder):
         response = spotufy.get_artist_releases('', 'asdf')
         self.assertTrue(response is None)
@@ -424,7 +1356,7 @@ class get_artist_releases_test(unittest.TestCase):
 
 
 @patch('spotufy.make_api_call')
-class get_new_album_releases_test(unittest.TestCase):
+class get_new_album_releases_test(SpotufyTestCase):
     """Test module to test get new releases function in `spotufy.py`"""
     def test_valid_return(self, api_response):
         """Should return a non-empty list given valid input"""
@@ -437,7 +1369,7 @@ class get_new_album_releases_test(unittest.TestCase):
                     "total_tracks": 5,
                     "name": "The Album",
                     "release_date": "2024/03/01",
-                    "images": ["image.com"]}
+                    "images": [{"url": "image.com"}]}
                 ]
             }
         }
@@ -460,3 +1392,825 @@ class get_new_album_releases_test(unittest.TestCase):
 
 if __name__ == '__main__':
     unittest.main()
+
+
+class SlowAPIHandler(http.server.BaseHTTPRequestHandler):
+    """Local fake API server answering every request after a fixed delay"""
+    delay = 0.2
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = json.dumps({"path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SlowAPIServer(http.server.ThreadingHTTPServer):
+    """Threading HTTP server with a listen backlog large enough for many simultaneous connections"""
+    request_queue_size = 128
+
+
+class spotufy_async_test(SpotufyTestCase):
+    """Test module to test the async client in `spotufy_async.py`"""
+
+    artists_response = {
+        "artists": {
+            "total": 1,
+            "items": [{
+                "name": "Al Green",
+                "external_urls": {"spotify": None},
+                "followers": {"total": 1000},
+                "popularity": None,
+                "genres": "Rock",
+                "id": "1234",
+                "uri": None,
+                "images": [{"url": None}]
+            }]
+        }
+    }
+
+    def test_same_result_as_sync(self):
+        """Async feature functions should return the same results as their sync counterparts"""
+        with patch('spotufy_async.make_api_call', AsyncMock(return_value=self.artists_response)):
+            async_result = spotufy_async.run(spotufy_async.search_artists("token", "Al Green"))
+        spotufy.clear_caches()
+        with patch('spotufy.make_api_call', return_value=self.artists_response):
+            sync_result = spotufy.search_artists("token", "Al Green")
+        self.assertEqual(async_result, sync_result)
+
+    def test_shares_cache_with_sync(self):
+        """Results cached by the async client should be served to the sync client"""
+        with patch('spotufy_async.make_api_call', AsyncMock(return_value=self.artists_response)):
+            spotufy_async.run(spotufy_async.search_artists("token", "Al Green"))
+        with patch('spotufy.make_api_call') as mock_call:
+            response = spotufy.search_artists("token", "al green")
+        mock_call.assert_not_called()
+        self.assertEqual(response[1]["name"], "Al Green")
+
+    def test_invalid_input(self):
+        """Invalid input should return None without making a request"""
+        with patch('spotufy_async.make_api_call', AsyncMock()) as mock_call:
+            self.assertTrue(spotufy_async.run(spotufy_async.search_song_details("token", "", "artist")) is None)
+            self.assertTrue(spotufy_async.run(spotufy_async.get_related_artists(None, "1234")) is None)
+        mock_call.assert_not_called()
+
+    def test_features_match_sync(self):
+        """Every async feature function should return what its sync counterpart returns"""
+        server = FakeUpstreamServer(seed=1).start()
+        self.addCleanup(server.stop)
+        calls = [
+            ("search_artists", ("token", "Al Green")),
+            ("get_top_tracks", ("token", "Al Green")),
+            ("search_song_details", ("token", "Let's Stay Together", "Al Green")),
+            ("get_track_recs", ("token", "Let's Stay Together", "Al Green")),
+            ("get_related_artists", ("token", "u8jzPde0IgxLd6GncfBAep")),
+            ("get_new_album_releases", ("token",)),
+            ("get_user_recs", ("token",)),
+        ]
+        with patch('spotufy.settings', spotufy.Settings(spotify_api_url=f"{server.url}/v1")):
+            for name, args in calls:
+                spotufy.clear_caches()
+                sync_result = getattr(spotufy, name)(*args)
+                spotufy.clear_caches()
+                async_result = spotufy_async.run(getattr(spotufy_async, name)(*args))
+                self.assertIsNotNone(sync_result, name)
+                self.assertEqual(async_result, sync_result, name)
+
+    def test_blocking_cache_off_loop(self):
+        """Cache backends outside the process should not be called on the shared event loop"""
+        threads = []
+
+        class BlockingBackend(spotufy.MemoryCacheBackend):
+            blocking = True
+
+            def get(self, key):
+                threads.append(threading.current_thread().name)
+                return super().get(key)
+
+            def set(self, key, value, ttl):
+                threads.append(threading.current_thread().name)
+                super().set(key, value, ttl)
+        with patch('spotufy.response_cache', spotufy.ResponseCache(BlockingBackend())), \
+                patch('spotufy_async.make_api_call', AsyncMock(return_value=self.artists_response)):
+            spotufy_async.run(spotufy_async.search_artists("token", "Al Green"))
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn("spotufy-async", threads)
+
+    def test_empty_top_tracks(self):
+        """An artist without top tracks should give None with either client"""
+        responses = [self.artists_response, {"tracks": []}]
+        with patch('spotufy_async.make_api_call', AsyncMock(side_effect=responses)):
+            self.assertIsNone(spotufy_async.run(spotufy_async.get_top_tracks("token", "Al Green")))
+        spotufy.clear_caches()
+        with patch('spotufy.make_api_call', side_effect=responses):
+            self.assertIsNone(spotufy.get_top_tracks("token", "Al Green"))
+
+    @patch('spotufy.BACKOFF_BASE', 0.001)
+    def test_retry_after_429(self):
+        """A 429 response should be retried by the async client too"""
+        ScriptedAPIHandler.script = [(429, {"Retry-After": "0"}, b""), (200, {}, b'{"name": "Mock Track"}')]
+        ScriptedAPIHandler.requests = []
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ScriptedAPIHandler)
+        threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/v1/tracks/1"
+            response = spotufy_async.run(spotufy_async.make_api_call(url, "GET"))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(response, {"name": "Mock Track"})
+        self.assertEqual(len(ScriptedAPIHandler.requests), 2)
+
+    def test_concurrent_requests(self):
+        """Many slow requests should be in flight at the same time on a single thread"""
+        server = SlowAPIServer(("127.0.0.1", 0), SlowAPIHandler)
+        threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+
+        async def fetch_all():
+            urls = [f"http://127.0.0.1:{server.server_port}/v1/tracks/{i}" for i in range(100)]
+            return await asyncio.gather(*(spotufy_async.make_api_call(url, "GET") for url in urls))
+        try:
+            begin = time.monotonic()
+            with patch('spotufy.get_rate_limiter', return_value=spotufy.TokenBucket(rate=0)):
+                responses = spotufy_async.run(fetch_all())
+            elapsed = time.monotonic() - begin
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual([r["path"] for r in responses], [f"/v1/tracks/{i}" for i in range(100)])
+        self.assertLess(elapsed, 100 * SlowAPIHandler.delay / 4)
+
+    def test_single_flight(self):
+        """Identical concurrent GET requests should share one upstream call"""
+        calls = []
+
+        async def fake_send(url, method, headers=None, payload=None):
+            calls.append(url)
+            await asyncio.sleep(0.01)
+            return {"ok": True}
+
+        async def fetch_twice():
+            return await asyncio.gather(spotufy_async.make_api_call("https://x/1", "GET"),
+                                        spotufy_async.make_api_call("https://x/1", "GET"))
+        with patch('spotufy_async.send_api_request', fake_send):
+            self.assertEqual(spotufy_async.run(fetch_twice()), [{"ok": True}, {"ok": True}])
+        self.assertEqual(calls, ["https://x/1"])
+
+    def test_fan_out_deadline(self):
+        """Fan-out calls still running at the deadline should yield None"""
+        async def fast():
+            return 1
+
+        async def slow():
+            await asyncio.sleep(1)
+            return 2
+        results = spotufy_async.run(spotufy_async.fan_out([fast, slow], deadline=0.05))
+        self.assertEqual(results, [1, None])
+
+
+class fake_upstream_test(SpotufyTestCase):
+    """Test module to test the local stand-in server in `fake_upstream.py` and the benchmark helpers"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeUpstreamServer(seed=1).start()
+        self.settings = spotufy.Settings(genius_token="1234", spotify_api_url=f"{self.server.url}/v1",
+                                         spotify_accounts_url=self.server.url, genius_url=f"{self.server.url}/")
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_replays_fixtures(self):
+        """Feature functions should work against the recorded responses"""
+        with patch('spotufy.settings', self.settings):
+            artists = spotufy.search_artists("token", "Al Green")
+            tracks = spotufy.get_top_tracks("token", "Al Green")
+        self.assertEqual(artists[1]["name"], "Al Green")
+        self.assertEqual(len(tracks), 5)
+        self.assertEqual(self.server.stats()["routes"], {"spotify_search": 1, "spotify_top_tracks": 1})
+
+    def test_pagination(self):
+        """Artist albums should be paged through like the real endpoint"""
+        with patch('spotufy.settings', self.settings):
+            releases = spotufy.get_artist_releases("token", {"id": "1234"})
+        self.assertEqual(len(releases), 120)
+        self.assertEqual(self.server.stats()["routes"]["spotify_artist_albums"], 3)
+
+    def test_genius_lyrics(self):
+        """Lyrics should be scraped from the recorded Genius page"""
+        lyrics = spotufy.get_genius_lyrics("Al Green", "Let's Stay Together", self.settings)
+        self.assertTrue(lyrics.startswith("[Verse 1]"))
+
+    @patch('spotufy.MAX_RETRIES', 1)
+    def test_injected_throttling(self):
+        """Injected 429 responses should be counted and retried by the client"""
+        self.server.throttle_rate = 1.0
+        self.server.retry_after = 0
+        with patch('spotufy.settings', self.settings):
+            self.assertTrue(spotufy.search_artists("token", "Al Green") is None)
+        self.assertEqual(self.server.stats()["throttled"], 2)
+
+    def test_market_omits_available_markets(self):
+        """Catalog requests should pass the market so track and album objects come without their market lists"""
+        with patch('spotufy.settings', self.settings):
+            releases = spotufy.make_api_call(f"{self.server.url}/v1/artists/1234/albums?limit=50&market=US", "GET")
+            tracks = spotufy.make_api_call(f"{self.server.url}/v1/recommendations?limit=5", "GET")
+        self.assertNotIn("available_markets", releases["items"][0])
+        self.assertIn("market=US", releases["next"])
+        self.assertIn("available_markets", tracks["tracks"][0]["album"])
+
+    def test_track_details_by_cached_id(self):
+        """Repeated track details should not search again, even after the top tracks indexed a namesake"""
+        with patch('spotufy.settings', self.settings):
+            spotufy.get_top_tracks("token", "Al Green")
+            first = spotufy.search_song_details("token", "Let's Stay Together", "Al Green")
+            second = spotufy.search_song_details("token", "Let's Stay Together", "Al Green")
+            spotufy.response_cache.clear()
+            third = spotufy.search_song_details("token", "Let's Stay Together", "Al Green")
+        self.assertEqual(first.id, "TEGbOY1xHvAV8DnRlzGW7h")
+        self.assertEqual(first, second)
+        self.assertEqual(third.id, first.id)
+        routes = self.server.stats()["routes"]
+        self.assertEqual((routes["spotify_search"], routes["spotify_track"]), (2, 1))
+
+    def test_percentile(self):
+        """Benchmark percentiles should use the nearest-rank method"""
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertEqual(benchmark.percentile([3], 95), 3)
+        self.assertTrue(benchmark.percentile([], 50) is None)
+
+
+class bulk_api_test(SpotufyTestCase):
+    """Test module to test the bulk JSON endpoints in `app.py` against the local stand-in server"""
+
+    def setUp(self):
+        super().setUp()
+        import app
+        self.app = app
+        self.client = app.app.test_client()
+        self.server = FakeUpstreamServer(seed=1).start()
+        patcher = patch('spotufy.settings', spotufy.Settings(spotify_api_url=f"{self.server.url}/v1"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def post(self, path, body, token="token"):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = self.client.post(path, json=body, headers=headers)
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()] \
+            if response.mimetype == "application/x-ndjson" else response.get_json()
+        return response.status_code, lines
+
+    def test_dedupes_inputs(self):
+        """Repeated inputs should be looked up once and reported with all their positions"""
+        status, lines = self.post("/api/v1/artists/search", {"artists": ["Al Green", "al green ", "Al Green"]})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]["indexes"], [0, 1, 2])
+        self.assertEqual(lines[0]["result"][0]["name"], "Al Green")
+        self.assertEqual(self.server.stats()["routes"], {"spotify_search": 1})
+
+    def test_top_tracks(self):
+        """Top tracks should be returned as plain JSON objects"""
+        status, lines = self.post("/api/v1/artists/top-tracks", {"artists": ["Al Green"]})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(lines[0]["result"]), 5)
+        self.assertIn("uri", lines[0]["result"][0])
+
+    def test_invalid_items(self):
+        """Invalid items should be reported without failing the rest of the request"""
+        status, lines = self.post("/api/v1/tracks/details", {"tracks": [{"track": "Tired"}, 7]})
+        self.assertEqual(status, 200)
+        self.assertEqual([line["error"] for line in lines], ["invalid input"] * 2)
+        self.assertEqual(self.server.stats()["requests"], 0)
+
+    def test_rejected_requests(self):
+        """Requests without a token, without an array or with too many items should be rejected"""
+        self.assertEqual(self.post("/api/v1/artists/search", {"artists": ["Al Green"]}, token=None)[0], 401)
+        self.assertEqual(self.post("/api/v1/artists/search", {"artist": "Al Green"})[0], 400)
+        with patch.object(self.app, 'BULK_MAX_ITEMS', 1):
+            self.assertEqual(self.post("/api/v1/artists/search", {"artists": ["a", "b"]})[0], 413)
+
+    def test_recommendations(self):
+        """Recommendations should be returned for valid seeds and rejected for invalid ones"""
+        response = self.client.get("/api/v1/recommendations?seed_tracks=1,2&seed_genres=soul&limit=5",
+                                   headers={"Authorization": "Bearer token"})
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(body["seeds"], {"tracks": ["1", "2"], "artists": [], "genres": ["soul"]})
+        self.assertEqual(len(body["tracks"]), 5)
+        response = self.client.get("/api/v1/recommendations?seed_tracks=1,2,3&seed_artists=4,5,6",
+                                   headers={"Authorization": "Bearer token"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_deadline(self):
+        """Lookups still running at the deadline should be reported as errors"""
+        def slow(token, name):
+            time.sleep(0.2)
+        with patch.object(self.app, 'BULK_DEADLINE', 0.05), patch.object(self.app, 'get_top_tracks', slow):
+            status, lines = self.post("/api/v1/artists/top-tracks", {"artists": ["a", "b"]})
+        self.assertEqual(status, 200)
+        self.assertEqual([line["error"] for line in lines], ["deadline exceeded"] * 2)
+
+
+class result_pages_test(SpotufyTestCase):
+    """Test module to test the streamed result pages in `app.py` against the local stand-in server"""
+
+    def setUp(self):
+        super().setUp()
+        import app
+        self.app = app
+        self.client = app.app.test_client()
+        # The session cookie needs a secret key, which is not configured while testing
+        patcher = patch.dict(app.app.config, {"SECRET_KEY": "secret"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with self.client.session_transaction() as session:
+            session["access_token"] = "token"
+        self.server = FakeUpstreamServer(seed=1).start()
+        patcher = patch('spotufy.settings', spotufy.Settings(spotify_api_url=f"{self.server.url}/v1"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_related_artists(self):
+        """Related artists should be streamed into the page"""
+        response = self.client.post("/get_related", data={"search_related": "Al Green"})
+        self.assertEqual(response.status_code, 200)
+        page = response.get_data(as_text=True)
+        self.assertIn("Related Artists", page)
+        self.assertNotIn("could not be found", page)
+
+    def test_unknown_artist(self):
+        """An artist that cannot be resolved should give a 404 before anything is streamed"""
+        with patch.object(self.app, 'resolve_artist', return_value=None):
+            related = self.client.post("/get_related", data={"search_related": "Nobody"})
+            releases = self.client.post("/get_artist_releases", data={"search_artist_releases": "Nobody"})
+        self.assertEqual(related.status_code, 404)
+        self.assertEqual(releases.status_code, 404)
+
+    def test_failure_while_streaming(self):
+        """A lookup failing part way through the results should end the page with the error state"""
+        def releases(token, artist):
+            yield spotufy.Release(id="1", title="First", type="album", url="url", release_date="2000",
+                                  tracks=1, cover_image="cover", artists=["Al Green"])
+            raise requests.exceptions.ConnectionError("connection reset")
+        with patch.object(self.app, 'stream_artist_releases', releases):
+            response = self.client.post("/get_artist_releases", data={"search_artist_releases": "Al Green"})
+            page = response.get_data(as_text=True)
+        self.assertIn("First", page)
+        self.assertIn("The content you are trying to access could not be found!", page)
+        self.assertTrue(page.rstrip().endswith("</html>"))
+
+    def test_failure_without_streaming(self):
+        """A failed lookup should give the 404 page when pages are rendered in one piece"""
+        with patch.object(self.app, 'STREAM_RESPONSES', False), \
+                patch.object(self.app, 'get_related_artists', side_effect=requests.exceptions.ConnectionError()):
+            response = self.client.post("/get_related", data={"search_related": "Al Green"})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("404 Not Found", response.get_data(as_text=True))
+
+class metrics_endpoint_test(SpotufyTestCase):
+    """Test module to test the metrics endpoint in `app.py`"""
+
+    def setUp(self):
+        super().setUp()
+        import app
+        self.app = app
+        self.client = app.app.test_client()
+
+    def test_open_without_token(self):
+        """Metrics should be served to anyone when no token is configured"""
+        with patch.object(self.app, 'METRICS_TOKEN', ''):
+            self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    def test_token_required(self):
+        """With a token configured, only scrapers presenting it should get the metrics"""
+        with patch.object(self.app, 'METRICS_TOKEN', 'secret'):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            self.assertEqual(self.client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code, 401)
+            response = self.client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("text/plain", response.content_type)
+
+
+class batch_test(SpotufyTestCase):
+    """Test module to test the command-line batch mode in `batch.py` against the local stand-in server"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeUpstreamServer(seed=1).start()
+        patcher = patch('spotufy.settings', spotufy.Settings(spotify_api_url=f"{self.server.url}/v1"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.output = os.path.join(self.directory, "results.jsonl")
+
+    def tearDown(self):
+        self.server.stop()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def run_batch(self, seeds, **kwargs):
+        return batch.run_batch("token", seeds, self.output, progress_interval=0, stream=io.StringIO(), **kwargs)
+
+    def read_output(self):
+        with open(self.output) as f:
+            return [json.loads(line) for line in f]
+
+    def test_read_seeds(self):
+        """Seeds should be read from CSV files with or without a header and from JSONL files"""
+        header = self.write("header.csv", "track,artist\nTired,Adele\n,Adele\n")
+        plain = self.write("plain.csv", "Adele,Tired\nAl Green,Let's Stay Together\n")
+        lines = self.write("seeds.jsonl", '{"artist": "Adele", "track": "Tired"}\n\n{"artist": "Adele"}\nnot json\n')
+        self.assertEqual(batch.read_seeds(header), [("Adele", "Tired")])
+        self.assertEqual(batch.read_seeds(plain), [("Adele", "Tired"), ("Al Green", "Let's Stay Together")])
+        self.assertEqual(batch.read_seeds(lines), [("Adele", "Tired")])
+
+    def test_run(self):
+        """Every distinct seed should be written once with its details and recommendations"""
+        summary = self.run_batch([("Adele", "Tired"), ("adele", "tired"), ("Al Green", "Tired")], recommendations=True)
+        self.assertEqual(summary["completed"], 2)
+        self.assertEqual(summary["failed"], 0)
+        records = self.read_output()
+        self.assertEqual(sorted(record["artist"] for record in records), ["Adele", "Al Green"])
+        self.assertEqual(len(records[0]["recommendations"]), 5)
+        self.assertTrue(batch.playlist_uris(self.output)[0].startswith("spotify:track:"))
+
+    def test_resume(self):
+        """A resumed run should skip the seeds of the checkpoint"""
+        self.run_batch([("Adele", "Tired")])
+        requests_made = self.server.stats()["requests"]
+        summary = self.run_batch([("Adele", "Tired"), ("Al Green", "Tired")], resume=True)
+        self.assertEqual((summary["skipped"], summary["completed"]), (1, 1))
+        self.assertEqual(len(self.read_output()), 2)
+        self.assertEqual(self.server.stats()["requests"], requests_made + 1)
+
+    def test_failed_seeds_are_retried(self):
+        """Seeds whose lookup failed should not be checkpointed"""
+        with patch('batch.search_song_details', return_value=None):
+            summary = self.run_batch([("Adele", "Tired")])
+        self.assertEqual(summary["failed"], 1)
+        self.assertEqual(self.read_output(), [])
+        summary = self.run_batch([("Adele", "Tired")], resume=True)
+        self.assertEqual((summary["skipped"], summary["completed"]), (0, 1))
+
+    def test_client_credentials_refresh(self):
+        """Client credentials tokens should be fetched again when they expire or are invalidated"""
+        with patch('batch.client_credentials_token', side_effect=[("first", 3600), ("second", 30), ("third", 3600)]):
+            tokens = batch.ClientCredentials(margin=60)
+            self.assertEqual(tokens.get(), "first")
+            self.assertEqual(tokens.get(), "first")
+            tokens.invalidate("first")
+            # Lives shorter than the margin, so it is replaced on the next call
+            self.assertEqual(tokens.get(), "second")
+            self.assertEqual(tokens.get(), "third")
+
+    def test_refused_token_is_replaced(self):
+        """A seed whose token was refused should be looked up again with a new token"""
+        def lookup(api_token, artist, track, recommendations=False):
+            if api_token == "expired":
+                spotufy.record_upstream_call("/search", "GET", 401, 0, 0.01, 0)
+                return {"artist": artist, "track": track, "details": None}, False
+            return {"artist": artist, "track": track, "details": None}, True
+        tokens = batch.ClientCredentials()
+        tokens.token, tokens.expires = "expired", time.monotonic() + 3600
+        with patch('batch.client_credentials_token', return_value=("fresh", 3600)), \
+                patch('batch.lookup_seed', side_effect=lookup) as mock_lookup:
+            summary = batch.run_batch(tokens, [("Adele", "Tired")], self.output, progress_interval=0, stream=io.StringIO())
+        self.assertEqual((summary["completed"], summary["failed"]), (1, 0))
+        self.assertEqual([call.args[0] for call in mock_lookup.call_args_list], ["expired", "fresh"])
+
+
+class decode_json_test(SpotufyTestCase):
+    """Test module to test the response decoding in `spotufy.py`"""
+    body = b'{"tracks": {"items": [{"name": "Let\'s Stay Together", "popularity": 70}]}}'
+
+    def test_decode(self):
+        """Responses should decode the same with and without orjson"""
+        expected = json.loads(self.body)
+        self.assertEqual(spotufy.decode_json(self.body), expected)
+        with patch('spotufy.orjson', None):
+            self.assertEqual(spotufy.decode_json(self.body), expected)
+
+    def test_invalid_json(self):
+        """Invalid bodies should raise a ValueError with either decoder"""
+        with self.assertRaises(ValueError):
+            spotufy.decode_json(b'{"tracks":')
+        with patch('spotufy.orjson', None), self.assertRaises(ValueError):
+            spotufy.decode_json(b'{"tracks":')
+
+    def test_invalid_response(self):
+        """Empty and invalid response bodies should be decoded as None"""
+        self.assertEqual(spotufy.decode_response(self.body), json.loads(self.body))
+        self.assertTrue(spotufy.decode_response(b'') is None)
+        self.assertTrue(spotufy.decode_response(b'{"tracks":') is None)
+
+
+class tracing_test(SpotufyTestCase):
+    """Test module to test upstream call tracing and metrics in `spotufy.py`"""
+
+    def setUp(self):
+        super().setUp()
+        self.trace = spotufy.RequestTrace()
+        self.token = spotufy.current_trace.set(self.trace)
+
+    def tearDown(self):
+        spotufy.current_trace.reset(self.token)
+
+    def test_endpoint_template(self):
+        """IDs should be replaced so calls group by endpoint"""
+        api = spotufy.get_settings().spotify_api_url
+        self.assertEqual(spotufy.endpoint_template(f"{api}/artists/4x1nvY2FN8jxqAFA0DA02H/top-tracks?market=US"), "/artists/{id}/top-tracks")
+        self.assertEqual(spotufy.endpoint_template(f"{api}/me/top/tracks?limit=5"), "/me/top/tracks")
+        self.assertEqual(spotufy.endpoint_template(f"{api}/users/abc/playlists"), "/users/{id}/playlists")
+        self.assertEqual(spotufy.endpoint_template(f"{api}/search?q=a"), "/search")
+
+    @patch('spotufy.BACKOFF_BASE', 0.001)
+    def test_records_upstream_call(self):
+        """Upstream calls should be recorded with their final status, size and retries"""
+        ScriptedAPIHandler.script = [(503, {}, b""), (200, {}, b'{"name": "Mock Track"}')]
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ScriptedAPIHandler)
+        threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+        try:
+            spotufy.make_api_call(f"http://127.0.0.1:{server.server_port}/v1/tracks/1", "GET")
+        finally:
+            server.shutdown()
+            server.server_close()
+        call = self.trace.calls[0]
+        self.assertEqual((call["endpoint"], call["status"], call["retries"], call["bytes"]), ("/tracks/{id}", 200, 1, 22))
+        self.assertIn('upstream-0;desc="GET /tracks/{id} 200"', self.trace.server_timing())
+
+    def test_fan_out_propagates_trace(self):
+        """Fan-out calls should see the trace of the request that started them"""
+        results = spotufy.fan_out([spotufy.current_trace.get, spotufy.current_trace.get])
+        self.assertEqual(results, [self.trace, self.trace])
+
+    @patch('spotufy.make_api_call')
+    def test_cache_and_feature_timing(self, api_response):
+        """Cache hits and misses and feature durations should be recorded"""
+        api_response.return_value = {"albums": {"items": []}}
+        before = spotufy.feature_latency.value(function="get_new_album_releases")
+        spotufy.get_new_album_releases("token")
+        spotufy.get_new_album_releases("token")
+        self.assertEqual(self.trace.cache, [("get_new_album_releases", False), ("get_new_album_releases", True)])
+        self.assertEqual([name for name, _ in self.trace.features], ["get_new_album_releases"] * 2)
+        self.assertEqual(spotufy.feature_latency.value(function="get_new_album_releases"), before + 2)
+
+    def test_async_runner_propagates_trace(self):
+        """Coroutines run on the shared event loop should record into the caller's trace"""
+        async def lookup():
+            return spotufy.current_trace.get()
+        self.assertIs(spotufy_async.run(lookup()), self.trace)
+
+    def test_histogram_render(self):
+        """Histograms should render cumulative buckets in the Prometheus text format"""
+        histogram = spotufy.Histogram("test_seconds", "Test histogram", ("function",), buckets=(0.1, 1))
+        histogram.observe(0.05, function="a")
+        histogram.observe(0.5, function="a")
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{function="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{function="a",le="1"} 2', lines)
+        self.assertIn('test_seconds_bucket{function="a",le="+Inf"} 2', lines)
+        self.assertIn('test_seconds_count{function="a"} 2', lines)
+
+class logging_test(SpotufyTestCase):
+    def make_record(self, message, level=logging.INFO, *args, **fields):
+        record = logging.LogRecord("spotufy", level, __file__, 0, message, args, None)
+        record.fields = fields
+        return record
+
+    def test_redact(self):
+        """Bearer tokens and Spotify tokens in log messages should be masked"""
+        token = "BQ" + "x" * 40
+        self.assertEqual(spotufy.redact(f"Authorization: Bearer {token}"), "Authorization: Bearer [REDACTED]")
+        self.assertEqual(spotufy.redact(f"token={token}&x=1"), "token=[REDACTED]&x=1")
+        self.assertEqual(spotufy.redact("Artist not found"), "Artist not found")
+
+    def test_json_formatter(self):
+        """Records should be written as one JSON object with their fields, secrets removed"""
+        record = self.make_record("Request to %s failed", logging.ERROR, "/me", route="/callback", access_token="abc")
+        entry = json.loads(spotufy.JsonFormatter().format(record))
+        self.assertEqual((entry["level"], entry["logger"], entry["message"]), ("ERROR", "spotufy", "Request to /me failed"))
+        self.assertEqual((entry["route"], entry["access_token"]), ("/callback", "[REDACTED]"))
+
+    def test_sampling(self):
+        """Sampling should drop records below WARNING but keep warnings and errors"""
+        sampler = spotufy.SamplingFilter(rate=0)
+        self.assertFalse(sampler.filter(self.make_record("no results", logging.INFO)))
+        self.assertTrue(sampler.filter(self.make_record("rate limited", logging.WARNING)))
+        self.assertTrue(spotufy.SamplingFilter(rate=1).filter(self.make_record("no results", logging.DEBUG)))
+
+    def test_full_queue_drops_records(self):
+        """A full log queue should drop records without blocking the caller"""
+        handler = spotufy.DroppingQueueHandler(queue_size=2)
+        start = time.perf_counter()
+        for i in range(5):
+            handler.handle(self.make_record("message %s", logging.ERROR, i))
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual((handler.queue.qsize(), handler.dropped), (2, 3))
+        self.assertEqual(handler.queue.get_nowait().getMessage(), "message 0")
+
+    def test_listener_writes_json(self):
+        """Records handed to the queue should be written as JSON lines by the listener"""
+        stream = io.StringIO()
+        output = logging.StreamHandler(stream)
+        output.setFormatter(spotufy.JsonFormatter())
+        handler = spotufy.DroppingQueueHandler()
+        listener = logging.handlers.QueueListener(handler.queue, output)
+        listener.start()
+        handler.handle(self.make_record("Circuit open for %s", logging.WARNING, "api.spotify.com"))
+        listener.stop()
+        self.assertEqual(json.loads(stream.getvalue())["message"], "Circuit open for api.spotify.com")
+
+class result_model_test(SpotufyTestCase):
+    """Test module to test the result models in `spotufy.py`"""
+    track = spotufy.Track(id="1", name="Let's Stay Together", artist="Al Green", album="Let's Stay Together",
+                          uri="spotify:track:1", url="https://open.spotify.com/track/1", popularity=70, image="image.com")
+
+    def test_slots(self):
+        """Models should not carry a per-instance dictionary"""
+        self.assertFalse(hasattr(self.track, "__dict__"))
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            self.track.name = "Tired of Being Alone"
+
+    def test_item_access(self):
+        """Models should still support the item access of the former result dictionaries"""
+        self.assertEqual(self.track["uri"], "spotify:track:1")
+        self.assertEqual(self.track.get("missing", "default"), "default")
+        with self.assertRaises(KeyError):
+            self.track["missing"]
+
+    def test_cache_round_trip(self):
+        """Models should be stored compactly and decoded back into models by the cache backends"""
+        value = ['', spotufy.Artist("1", "Al Green", "spotify:artist:1", "https://", "1,000", 60, "soul", "image.com"), [self.track]]
+        with tempfile.TemporaryDirectory() as directory:
+            backend = spotufy.SQLiteCacheBackend(os.path.join(directory, "cache.db"), compress=True)
+            backend.set("key", value, 60)
+            self.assertEqual(backend.get("key"), (True, value))
+        self.assertLess(len(backend.encode(self.track)), len(backend.encode(self.track.to_dict())))
+
+    @patch('spotufy.make_api_call')
+    def test_create_playlist_accepts_models_and_uris(self, api_request):
+        """create_playlist should insert the URIs of Track models and plain URI strings"""
+        api_request.side_effect = [{"id": "user"}, {"id": "1234", "external_urls": {"spotify": "https://spotify.com/playlist"}}, {"snapshot_id": "a"}]
+        spotufy.create_playlist("token", "Al Green", [self.track, "spotify:track:2"])
+        self.assertEqual(json.loads(api_request.call_args_list[2].args[3])["uris"], ["spotify:track:1", "spotify:track:2"])
+
+class search_index_test(SpotufyTestCase):
+    """Test module to test the local search index in `spotufy.py`"""
+    def artist(self, artist_id, name, popularity):
+        return spotufy.Artist(artist_id, name, f"spotify:artist:{artist_id}", "https://", "1,000", popularity, "soul", "image.com")
+
+    def track(self, track_id, name, artist, popularity=None, duration=None):
+        return spotufy.Track(track_id, name, artist, "Album", uri=f"spotify:track:{track_id}", popularity=popularity, duration=duration)
+
+    def test_exact_lookup(self):
+        """Names should be looked up with the same normalization as the cache keys"""
+        index = spotufy.SearchIndex(path='')
+        index.add(['', self.artist("1", "Al Green", 60), self.track("2", "Let's Stay Together", "Al Green")])
+        self.assertEqual(index.artist("  al GREEN!").id, "1")
+        self.assertEqual(index.track("lets stay together", "Al Green").id, "2")
+        self.assertTrue(index.artist("Al Gree") is None)
+
+    def test_suggest(self):
+        """Typeahead should match word prefixes and rank results by popularity"""
+        index = spotufy.SearchIndex(path='')
+        index.add([self.artist("1", "Al Green", 60), self.artist("2", "Green Day", 80), self.artist("3", "Alabama Shakes", 50),
+                   self.track("4", "Green Onions", "Booker T. & the M.G.'s", 40)])
+        self.assertEqual([m.id for m in index.suggest("gre")], ["2", "1", "4"])
+        self.assertEqual([m.id for m in index.suggest("al g")], ["1"])
+        self.assertEqual([m.id for m in index.suggest("gre", kind="track")], ["4"])
+        self.assertEqual([m.id for m in index.suggest("gre", limit=1)], ["2"])
+        self.assertEqual(index.suggest("   "), [])
+
+    def test_merge_and_collisions(self):
+        """Results for the same ID should be merged, name collisions should keep the more popular entry"""
+        index = spotufy.SearchIndex(path='')
+        index.add([self.track("1", "Tired of Being Alone", "Al Green", popularity=60)])
+        index.add([self.track("1", "Tired of Being Alone", "Al Green", duration=170.5)])
+        merged = index.track("Tired of Being Alone", "Al Green")
+        self.assertEqual((merged.popularity, merged.duration), (60, 170.5))
+        index.add([self.artist("2", "Nirvana", 10), self.artist("3", "Nirvana", 80), self.artist("4", "Nirvana", 20)])
+        self.assertEqual(index.artist("Nirvana").id, "3")
+        self.assertEqual([m.id for m in index.suggest("nirv")], ["3"])
+
+    def test_eviction(self):
+        """The oldest entries should be dropped, with their words, once the index is full"""
+        index = spotufy.SearchIndex(path='', max_entries=2)
+        index.add([self.artist("1", "Al Green", 60), self.artist("2", "Green Day", 80), self.artist("3", "Otis Redding", 70)])
+        self.assertEqual(len(index), 2)
+        self.assertTrue(index.artist("Al Green") is None)
+        self.assertEqual([m.id for m in index.suggest("green")], ["2"])
+
+    def test_persistence(self):
+        """Saved entries should be loaded back by a new index"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.json")
+            index = spotufy.SearchIndex(path=path, save_interval=0)
+            self.addCleanup(atexit.unregister, index.save)
+            index.add([self.artist("1", "Al Green", 60), self.track("2", "Let's Stay Together", "Al Green", 70)])
+            index.save()
+            loaded = spotufy.SearchIndex(path=path, save_interval=0)
+            self.addCleanup(atexit.unregister, loaded.save)
+            self.assertEqual(loaded.artist("Al Green"), index.artist("Al Green"))
+            self.assertEqual([m.id for m in loaded.suggest("stay")], ["2"])
+
+    @patch('spotufy.make_api_call')
+    def test_skips_upstream_search(self, api_response):
+        """Names already seen in results should be resolved without a Spotify search"""
+        spotufy.search_index.add([self.artist("1", "Al Green", 60), self.track("2", "Let's Stay Together", "Al Green", 70)])
+        api_response.return_value = None
+        spotufy.get_top_tracks("token", "Al Green")
+        spotufy.get_track_recs("token", "Let's Stay Together", "Al Green")
+        self.assertEqual([c.args[0].split("?")[0].rsplit("/v1", 1)[1] for c in api_response.call_args_list],
+                         ["/artists/1/top-tracks", "/recommendations"])
+
+@patch('spotufy.make_api_call')
+class track_id_cache_test(SpotufyTestCase):
+    """Test module to test the (track, artist) -> track ID resolution in `spotufy.py`"""
+    def search_response(self, track_id):
+        return {"tracks": {"items": [{
+            "id": track_id, "name": "Let's Stay Together", "uri": f"spotify:track:{track_id}", "duration_ms": 198000,
+            "album": {"name": "Let's Stay Together", "artists": [{"name": "Al Green"}], "release_date": "1972", "images": [{"url": "a"}, {"url": "b"}]},
+            "external_urls": {"spotify": "https://"}}]}}
+
+    def test_details_then_recommendations(self, api_response):
+        """The track ID found for the details page should be reused by the recommendations"""
+        api_response.side_effect = [self.search_response("1"), None]
+        spotufy.search_song_details("token", "Let's Stay Together", "Al Green")
+        spotufy.search_index.clear()
+        spotufy.get_track_recs("token", "lets stay together", "AL GREEN")
+        urls = [c.args[0] for c in api_response.call_args_list]
+        self.assertEqual(len(urls), 2)
+        self.assertIn("/recommendations?", urls[1])
+        self.assertIn("seed_tracks=1", urls[1])
+
+    def test_negative_caching(self, api_response):
+        """Pairs without a match should not be searched for again"""
+        api_response.return_value = {"tracks": {"items": []}}
+        self.assertTrue(spotufy.search_song_details("token", "Banana Pop Bozo", "Frisbee Cube Clock") is None)
+        self.assertTrue(spotufy.get_track_recs("token", "Banana Pop Bozo", "Frisbee Cube Clock") is None)
+        self.assertTrue(spotufy.resolve_track_id("token", "Banana Pop Bozo", "Frisbee Cube Clock") is None)
+        self.assertEqual(api_response.call_count, 1)
+
+    def test_cached_id_over_index(self, api_response):
+        """A pair should keep resolving to its cached track even when the index holds a more popular namesake"""
+        api_response.side_effect = [self.search_response("1"), None]
+        details = spotufy.search_song_details("token", "Let's Stay Together", "Al Green")
+        spotufy.search_index.add([spotufy.Track(id="2", name="Let's Stay Together", artist="Al Green", album="Greatest Hits",
+                                                popularity=90, duration=198.0)])
+        self.assertEqual(spotufy.search_song_details("token", "Let's Stay Together", "Al Green"), details)
+        self.assertEqual(api_response.call_count, 1)
+        spotufy.get_track_recs("token", "Let's Stay Together", "Al Green")
+        self.assertIn("seed_tracks=1", api_response.call_args_list[1].args[0])
+
+    def test_cached_id_fetched_by_id(self, api_response):
+        """Details of a pair with a cached track ID should be fetched by that ID instead of searched for"""
+        api_response.side_effect = [self.search_response("1"), self.search_response("1")["tracks"]["items"][0]]
+        spotufy.search_song_details("token", "Let's Stay Together", "Al Green")
+        spotufy.response_cache.clear()
+        spotufy.search_index.clear()
+        self.assertEqual(spotufy.search_song_details("token", "Let's Stay Together", "Al Green")["id"], "1")
+        self.assertIn("/tracks/1?", api_response.call_args_list[1].args[0])
+
+    def test_failures_not_cached(self, api_response):
+        """Failed searches should be retried on the next lookup"""
+        api_response.side_effect = [None, self.search_response("1")]
+        self.assertTrue(spotufy.resolve_track_id("token", "Let's Stay Together", "Al Green") is None)
+        self.assertEqual(spotufy.resolve_track_id("token", "Let's Stay Together", "Al Green"), "1")
+
+    def test_bulk_resolve(self, api_response):
+        """Bulk resolution should keep the order and search for each unknown pair once"""
+        api_response.side_effect = lambda url, *args: self.search_response("2") if "Tired" in url else {"tracks": {"items": []}}
+        spotufy.track_id_cache.set(spotufy.track_id_cache_key("Let's Stay Together", "Al Green"), "1", 60)
+        pairs = [("Let's Stay Together", "Al Green"), ("Tired of Being Alone", "Al Green"), ("tired of being alone", "al green"),
+                 ("Unknown", "Nobody"), ("", "Al Green"), "not a pair"]
+        self.assertEqual(spotufy.resolve_track_ids("token", pairs), ["1", "2", "2", None, None, None])
+        self.assertEqual(api_response.call_count, 2)
+
+    def test_async_bulk_resolve(self, placeholder):
+        """The async client should resolve pairs through the same cache"""
+        spotufy.track_id_cache.set(spotufy.track_id_cache_key("Let's Stay Together", "Al Green"), "1", 60)
+        with patch('spotufy_async.make_api_call', new=AsyncMock(return_value=self.search_response("2"))) as api_response:
+            ids = spotufy_async.run(spotufy_async.resolve_track_ids("token", [("Let's Stay Together", "Al Green"), ("Tired of Being Alone", "Al Green")]))
+        self.assertEqual(ids, ["1", "2"])
+        self.assertEqual(api_response.await_count, 1)
+        self.assertEqual(spotufy.resolve_track_id("token", "Tired of Being Alone", "Al Green"), "2")